@@ -0,0 +1,119 @@
+"""Compare path-based and descriptor-relative copies of a deep tree.
+
+Builds a tree of many small files several levels deep, then copies it
+with ``shutil.copytree`` using the copy engine, as backups did before,
+and with ``copy_tree_at``. Each copy goes to a fresh destination and the
+best of several rounds is reported.
+
+Run from the repository root::
+
+    uv run python benchmarks/bench_dirfd.py --depth 12 --files 40
+"""
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from kachi.dirfd import HAVE_DIR_FD, copy_tree_at  # noqa: E402
+from kachi.engine import CopyEngine  # noqa: E402
+
+
+def make_tree(root: Path, depth: int, fanout: int, files: int) -> int:
+    """Create a tree of small files.
+
+    Args:
+        root: Directory to create the tree in.
+        depth: Number of directory levels.
+        fanout: Subdirectories per directory on the first two levels;
+            deeper levels have a single subdirectory so the tree stays
+            deep without growing exponentially.
+        files: Files per directory.
+
+    Returns:
+        The number of files created.
+    """
+    created = 0
+    level = [root]
+    for d in range(depth):
+        next_level = []
+        for directory in level:
+            directory.mkdir(parents=True, exist_ok=True)
+            for i in range(files):
+                (directory / f"file{i:04}.txt").write_bytes(b"x" * (64 + i))
+                created += 1
+            width = fanout if d < 2 else 1
+            next_level.extend(directory / f"dir{j:02}" for j in range(width))
+        level = next_level
+    return created
+
+
+def best_of(rounds: int, copies: dict, src: Path, scratch: Path) -> dict:
+    """Time copy functions, returning the fastest of several rounds each.
+
+    The functions take turns within each round so that drifting cache
+    and disk state affects them equally.
+
+    Args:
+        rounds: Number of rounds to run.
+        copies: Functions called as ``copy(src, dest)``, by name.
+        src: The tree to copy.
+        scratch: Directory the destinations are created in.
+
+    Returns:
+        The fastest round of each function, in seconds, by name.
+    """
+    best = dict.fromkeys(copies, float("inf"))
+    for _ in range(rounds):
+        for name, copy in copies.items():
+            dest = scratch / "dest"
+            started = time.perf_counter()
+            copy(src, dest)
+            best[name] = min(best[name], time.perf_counter() - started)
+            shutil.rmtree(dest)
+    return best
+
+
+def main() -> None:
+    """Build the tree, run both copies and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, default=12)
+    parser.add_argument("--fanout", type=int, default=4)
+    parser.add_argument("--files", type=int, default=40)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    if not HAVE_DIR_FD:
+        sys.exit("This platform does not support dir_fd-relative calls.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = Path(tmp)
+        src = scratch / "src"
+        count = make_tree(src, args.depth, args.fanout, args.files)
+        print(f"{count} files, {args.depth} levels deep")
+
+        def by_path(s: Path, d: Path) -> None:
+            shutil.copytree(s, d, copy_function=CopyEngine().copy_file)
+
+        def by_fd(s: Path, d: Path) -> None:
+            copy_tree_at(s, d, CopyEngine().copy_file_at)
+
+        times = best_of(
+            args.rounds,
+            {"shutil.copytree": by_path, "copy_tree_at": by_fd},
+            src,
+            scratch,
+        )
+
+    for name, seconds in times.items():
+        print(f"{name + ':':17}{seconds:.3f}s ({count / seconds:,.0f} files/s)")
+    path_time, fd_time = times["shutil.copytree"], times["copy_tree_at"]
+    print(f"{'speedup:':17}{path_time / fd_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
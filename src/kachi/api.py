@@ -0,0 +1,171 @@
+"""Python API for running backups from other programs.
+
+``backup_events`` runs a profile in a background thread and yields an
+event for every file as it is handled, so callers can react while the
+backup is in progress instead of parsing log output::
+
+    events = backup_events(profile)
+    for event in events:
+        if isinstance(event, FileFailed):
+            ...
+
+The generator's return value, available as ``StopIteration.value`` or
+through ``result = yield from backup_events(profile)``, summarizes the run.
+Events pass through a bounded queue: when the caller falls behind, the
+backup pauses, so memory use does not depend on the number of files.
+"""
+
+import queue
+import threading
+import time
+from collections.abc import Generator
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from kachi.backup import backup_profile
+from kachi.config import Profile
+from kachi.engine import CopyEngine
+from kachi.errors import DestinationError
+from kachi.events import FileCopied, FileEvent, FileFailed, FileSkipped
+
+# Events buffered before the backup waits for the caller.
+MAX_PENDING_EVENTS = 1024
+
+# How often a paused backup checks whether the caller has stopped.
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class BackupCancelled(Exception):
+    """Raised in the backup thread when the caller stops consuming events."""
+
+
+@dataclass
+class BackupResult:
+    """Summary of a profile run.
+
+    Attributes:
+        profile: Name of the profile.
+        copied: Files copied.
+        skipped: Files left alone because their copy was up to date.
+        failed: Files that could not be copied.
+        bytes: Size of the files copied.
+        seconds: Wall-clock duration of the run.
+        not_found: Sources that could not be located.
+        success: Sources backed up without errors.
+        errors: Errors encountered, including those not tied to a file.
+        aborted: Whether the run stopped because no destination was valid.
+    """
+
+    profile: str
+    copied: int = 0
+    skipped: int = 0
+    failed: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    not_found: list[Path] = field(default_factory=list)
+    success: int = 0
+    errors: int = 0
+    aborted: bool = False
+
+    def add(self, event: FileEvent) -> None:
+        """Count a file event.
+
+        Args:
+            event: The event to count.
+        """
+        if isinstance(event, FileCopied):
+            self.copied += 1
+            self.bytes += event.bytes
+        elif isinstance(event, FileSkipped):
+            self.skipped += 1
+        elif isinstance(event, FileFailed):
+            self.failed += 1
+
+
+def backup_events(
+    profile: Profile,
+    engine: CopyEngine | None = None,
+    max_pending: int = MAX_PENDING_EVENTS,
+) -> Generator[FileEvent, None, BackupResult]:
+    """Back up a profile, yielding an event for every file.
+
+    Closing the generator early cancels the backup once the file in
+    progress is done. Files already copied are still committed.
+
+    Args:
+        profile: The profile to back up.
+        engine: Copy engine to use. Defaults to a plain ``CopyEngine``.
+            Its ``listener`` is replaced for the duration of the run.
+        max_pending: Events buffered before the backup waits for the
+            caller to catch up.
+
+    Yields:
+        A ``FileCopied``, ``FileSkipped`` or ``FileFailed`` event per file.
+
+    Returns:
+        The summary of the run.
+
+    Raises:
+        Exception: Any unexpected error raised by the backup.
+    """
+    engine = engine or CopyEngine()
+    events: queue.Queue = queue.Queue(maxsize=max_pending)
+    cancelled = threading.Event()
+    outcome = {}
+
+    def put(item) -> None:
+        """Queue an item, giving up if the caller has stopped listening."""
+        while not cancelled.is_set():
+            try:
+                events.put(item, timeout=_POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+        raise BackupCancelled()
+
+    def run() -> None:
+        """Run the backup and queue the end-of-run marker."""
+        try:
+            outcome["result"] = backup_profile(profile, engine)
+        except DestinationError:
+            outcome["aborted"] = True
+        except BackupCancelled:
+            # Still commit the files already written.
+            engine.listener = None
+            try:
+                engine.flush()
+            except OSError:
+                pass
+            return
+        except BaseException as e:
+            outcome["error"] = e
+        try:
+            put(_DONE)
+        except BackupCancelled:
+            pass
+
+    engine.listener = put
+    result = BackupResult(profile=profile.name)
+    started = time.perf_counter()
+    thread = threading.Thread(target=run, name=f"kachi-backup-{profile.name}")
+    thread.start()
+    try:
+        while (event := events.get()) is not _DONE:
+            result.add(event)
+            yield event
+    finally:
+        cancelled.set()
+        thread.join()
+        engine.listener = None
+
+    result.seconds = time.perf_counter() - started
+    if "error" in outcome:
+        raise outcome["error"]
+    if outcome.get("aborted"):
+        result.aborted = True
+        result.errors = 1
+    else:
+        result.not_found, result.success, result.errors = outcome["result"]
+    return result
@@ -1,34 +1,101 @@
 """File-system backup operations for Kachi profiles."""
 
 import shutil
-from pathlib import Path
-
-import typer
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path, PurePath, PurePosixPath
 
 from kachi import logger
-from kachi.config import Profile
-from kachi.errors import BackupErrorHandler
+from kachi.config import Profile, RemoteDestination
+from kachi.dirfd import HAVE_DIR_FD, copy_tree_at
+from kachi.engine import CopyEngine, SourceStats
+from kachi.errors import BackupErrorHandler, DestinationError
+from kachi.events import FileFailed, FileSkipped
+from kachi.fanout import FanOut
+from kachi.links import find_duplicates
+from kachi.remote import RemoteSender, get_pool, ping
+from kachi.scan import fast_copy_tree
 
 # Create a module-level error handler to avoid unnecessary object creation
 error_handler = BackupErrorHandler(logger)
 
 
-def backup_dir(src: Path, dest: Path) -> bool:
+@contextmanager
+def _measure(engine: CopyEngine | None, src: Path) -> Iterator[None]:
+    """Record the time a source takes and what it adds to the engine's totals.
+
+    The result is stored in ``engine.sources``. Nothing is recorded without
+    an engine.
+
+    Args:
+        engine: The copy engine the source is backed up with.
+        src: The source being backed up.
+    """
+    if engine is None:
+        yield
+        return
+    files, bytes_copied = engine.stats.files, engine.stats.bytes
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        engine.sources[src] = SourceStats(
+            seconds=time.perf_counter() - started,
+            files=engine.stats.files - files,
+            bytes=engine.stats.bytes - bytes_copied,
+        )
+
+
+def backup_dir(src: Path, dest: Path, engine: CopyEngine | None = None) -> bool:
     """Copy a directory from src to dest.
 
     Args:
         src: Source directory path to copy.
         dest: Destination directory where the copy is placed.
+        engine: Optional copy engine used for each file. Defaults to
+            ``shutil.copy2``. When the engine has fast scans enabled, only
+            files that changed since the previous run are copied. Otherwise
+            the engine walks the tree relative to open directory
+            descriptors where the platform supports it.
 
     Returns:
         True if the backup was successful, False if an error occurred.
     """
     try:
         dest_dir_name = dest / src.name
-        if not Path(dest_dir_name).exists():
-            dest_dir_name.mkdir(exist_ok=True)
+        if engine is not None and engine.fast_scan is not None:
+            scan = fast_copy_tree(
+                src,
+                dest_dir_name,
+                engine.copy_file,
+                engine.scan_dir,
+                engine.fast_scan,
+                on_skip=lambda s, d, size: engine.emit(FileSkipped(s, d, size)),
+                flush=engine.flush,
+            )
+            logger.debug(
+                f"{'Full' if scan.full else 'Fast'} scan of {str(src)}: "
+                f"listed {scan.dirs_listed} and reused {scan.dirs_reused} "
+                f"directories, copied {scan.copied} of {scan.files} files"
+            )
+        elif engine is not None and HAVE_DIR_FD:
+            copy_tree_at(
+                src,
+                dest_dir_name,
+                engine.copy_file_at,
+                on_error=lambda s, d, reason: engine.emit(
+                    FileFailed(Path(s), Path(d), reason)
+                ),
+            )
+        else:
+            if not Path(dest_dir_name).exists():
+                dest_dir_name.mkdir(exist_ok=True)
 
-        shutil.copytree(src, dest_dir_name, dirs_exist_ok=True)
+            copy_function = engine.copy_file if engine else shutil.copy2
+            shutil.copytree(
+                src, dest_dir_name, copy_function=copy_function, dirs_exist_ok=True
+            )
         logger.info(
             f"Backed up directory, all subdirectories, and files for {str(src)} to {str(dest)}"  # noqa: E501
         )
@@ -51,19 +118,22 @@ def backup_dir(src: Path, dest: Path) -> bool:
         return False
 
 
-def backup_file(src: Path, dest: Path) -> bool:
+def backup_file(src: Path, dest: Path, engine: CopyEngine | None = None) -> bool:
     """Copy a file from src to dest.
 
     Args:
         src: Source file path to copy.
         dest: Destination directory where the copy is placed.
+        engine: Optional copy engine used for the file. Defaults to
+            ``shutil.copy2``.
 
     Returns:
         True if the backup was successful, False if an error occurred.
     """
     try:
         f = Path(src).name
-        shutil.copy2(src, (dest / f))
+        copy_function = engine.copy_file if engine else shutil.copy2
+        copy_function(src, (dest / f))
         logger.info(f"Backed up {str(src)} to {str(dest)}")
         return True
     except PermissionError:
@@ -84,44 +154,342 @@ def backup_file(src: Path, dest: Path) -> bool:
         return False
 
 
-def backup_profile(profile: Profile) -> tuple[list, int, int]:
+def backup_fan_out(src: Path, fan_out: FanOut) -> dict[Path, bool]:
+    """Copy a file or directory to several destinations, reading it once.
+
+    Args:
+        src: Source file or directory path to copy.
+        fan_out: The fan-out writing to every destination.
+
+    Returns:
+        A mapping of each destination to whether the source was backed up
+        to it without errors.
+    """
+    read_error = None
+    try:
+        if src.is_dir():
+            fan_out.copy_tree(src, PurePath(src.name))
+        else:
+            fan_out.copy_file(src, PurePath(src.name))
+    except FileNotFoundError:
+        # Let FileNotFoundError propagate for proper error handling
+        fan_out.wait()
+        raise
+    except PermissionError:
+        error_handler.handle_permission_error(src)
+        read_error = True
+    except OSError as e:
+        # shutil.Error is an OSError raised for unreadable entries in a tree
+        error_handler.handle_shutil_error(e, src)
+        read_error = True
+
+    results = {}
+    for dest, failures in fan_out.wait().items():
+        for path, error in failures:
+            if isinstance(error, PermissionError):
+                error_handler.handle_permission_error(path)
+            else:
+                error_handler.handle_shutil_error(error, path)
+            try:
+                rel = path.relative_to(dest)
+                # A failure of the destination as a whole is the source's.
+                failed_src = src.parent / rel if rel.parts else src
+            except ValueError:
+                failed_src = src
+            fan_out.engine.emit(FileFailed(failed_src, path, str(error)))
+        results[dest] = not read_error and not failures
+        if results[dest]:
+            logger.info(f"Backed up {str(src)} to {str(dest)}")
+    return results
+
+
+def backup_remote(
+    src: Path, dest: RemoteDestination, profile: str, engine: CopyEngine
+) -> bool:
+    """Send a file or directory to a backup server.
+
+    Args:
+        src: Source file or directory path to send.
+        dest: The backup server.
+        profile: Name of the profile, which selects the directory the
+            server stores the copy in.
+        engine: Copy engine whose statistics and throttles apply.
+
+    Returns:
+        True if the backup was successful, False if an error occurred.
+    """
+    read_error = None
+    try:
+        with get_pool(dest).connection() as conn:
+            sender = RemoteSender(conn, profile, engine)
+            try:
+                if src.is_dir():
+                    sender.send_tree(src, PurePosixPath(src.name))
+                else:
+                    sender.send_file(src, PurePosixPath(src.name))
+            except shutil.Error as e:
+                # Unreadable entries in a tree leave the connection usable.
+                read_error = e
+            write_errors = sender.finish()
+    except FileNotFoundError:
+        # Let FileNotFoundError propagate for proper error handling
+        raise
+    except PermissionError:
+        error_handler.handle_permission_error(src)
+        return False
+    except OSError as e:
+        error_handler.handle_shutil_error(e, src)
+        return False
+
+    if read_error is not None:
+        error_handler.handle_shutil_error(read_error, src)
+    for path, error in write_errors:
+        error_handler.handle_shutil_error(error, f"{dest}/{profile}/{path}")
+        engine.emit(FileFailed(src.parent / path, Path(path), error))
+    if read_error is not None or write_errors:
+        return False
+    logger.info(f"Backed up {str(src)} to {str(dest)}")
+    return True
+
+
+def backup_profile(
+    profile: Profile, engine: CopyEngine | None = None
+) -> tuple[list, int, int]:
     """Backup all sources defined in a profile.
 
+    When the profile has several destinations, each source is read once
+    and written to all of them concurrently. A destination that is missing
+    or fails is reported on its own without stopping the others. A
+    ``kachi://`` destination sends the sources to a backup server.
+
     Args:
         profile: The Profile object containing sources and destination.
+        engine: Optional copy engine shared by all sources, e.g. to collect
+            transfer statistics for the run.
 
     Returns:
         A tuple containing:
         - List of sources not found.
         - Count of successfully backed up sources.
         - Count of errors encountered.
+
+    Raises:
+        DestinationError: If no destination is valid, or the backup
+            server cannot be reached.
     """
-    dest = profile.backup_destination
-    if dest is None or not dest.exists() or not dest.is_dir():
-        error_handler.handle_invalid_destination(dest)
-        raise typer.Exit(code=1)
+    if isinstance(profile.backup_destination, RemoteDestination):
+        return _backup_profile_remote(
+            profile, profile.backup_destination, engine or CopyEngine()
+        )
+
+    destinations = []
+    invalid_count = 0
+    for dest in profile.destinations or [None]:
+        if dest is None or not dest.exists() or not dest.is_dir():
+            error_handler.handle_invalid_destination(dest)
+            invalid_count += 1
+        else:
+            destinations.append(dest)
+    if not destinations:
+        raise DestinationError(f"No valid destination for profile {profile.name}")
 
     logger.info(f"Backing up profile: {profile}")
 
+    if len(destinations) > 1:
+        return _backup_profile_fan_out(
+            profile, destinations, engine or CopyEngine(), invalid_count
+        )
+
+    dest = destinations[0]
+    # The parallel scheduler hands in an index shared by all sources.
+    if profile.link_duplicates and (engine is None or engine.links is None):
+        engine = engine or CopyEngine()
+        _index_duplicates(profile, engine)
+
     sources_not_found = []
-    success_count = 0
-    error_count = 0
+    backed_up = []
+    error_count = invalid_count
 
     for src in profile.sources:
-        if src.is_file():
-            if backup_file(src, dest):
-                success_count += 1
+        if src.is_file() or src.is_dir():
+            with _measure(engine, src):
+                backup = backup_file if src.is_file() else backup_dir
+                ok = backup(src, dest, engine)
+            if ok:
+                backed_up.append(src)
             else:
                 error_count += 1
-        elif src.is_dir():
-            if backup_dir(src, dest):
+        else:
+            sources_not_found.append(src)
+            error_handler.handle_file_not_found(src)
+            error_count += 1
+
+    if engine:
+        try:
+            engine.flush()
+        except OSError as e:
+            error_handler.handle_shutil_error(e, dest)
+            failed = _sources_failed_in_flush(e, backed_up)
+            backed_up = [src for src in backed_up if src not in failed]
+            error_count += len(failed) or 1
+
+    return sources_not_found, len(backed_up), error_count
+
+
+def _sources_failed_in_flush(error: OSError, sources: list[Path]) -> list[Path]:
+    """Find the sources with files that failed after being queued.
+
+    Compressed and deduplicated copies are finished by worker processes,
+    so their failures only surface when the engine is flushed, after the
+    source has been walked.
+
+    Args:
+        error: The error raised by ``CopyEngine.flush``.
+        sources: Sources that were walked without errors.
+
+    Returns:
+        The sources containing a failed file. Empty when the error is not
+        about individual files, such as a failed durable commit.
+    """
+    if not isinstance(error, shutil.Error):
+        return []
+    failed = [Path(src) for src, _, _ in error.args[0]]
+    return [
+        src
+        for src in sources
+        if any(path == src or path.is_relative_to(src) for path in failed)
+    ]
+
+
+def _index_duplicates(profile: Profile, engine: CopyEngine) -> None:
+    """Find identical source files so the engine links their copies.
+
+    Args:
+        profile: The profile about to be backed up.
+        engine: The copy engine the profile is backed up with.
+    """
+    if engine.compressor or engine.deduplicator:
+        logger.warning(
+            "Duplicate files are not linked when compression or dedup is enabled."
+        )
+        return
+    engine.links = find_duplicates(profile.sources)
+    logger.debug(
+        f"Found {len(engine.links)} source files with identical content "
+        f"for profile '{profile.name}'"
+    )
+
+
+def _backup_profile_fan_out(
+    profile: Profile, destinations: list[Path], engine: CopyEngine, error_count: int
+) -> tuple[list, int, int]:
+    """Backup a profile's sources to several destinations at once.
+
+    Args:
+        profile: The Profile object containing the sources.
+        destinations: The valid destination directories.
+        engine: Copy engine whose statistics and throttles apply.
+        error_count: Errors already counted, e.g. for invalid destinations.
+
+    Returns:
+        The same tuple as ``backup_profile``. A source only counts as a
+        success when it was backed up to every destination.
+    """
+    sources_not_found = []
+    success_count = 0
+    failed_sources = dict.fromkeys(destinations, 0)
+
+    if (
+        engine.compressor
+        or profile.dedup
+        or profile.link_duplicates
+        or profile.drop_cache
+        or profile.fast_scan
+    ):
+        logger.warning(
+            "Compression, dedup, duplicate linking, cache dropping and fast "
+            "scans are not applied when backing up to multiple destinations."
+        )
+
+    with FanOut(engine, destinations) as fan_out:
+        for src in profile.sources:
+            if not src.exists():
+                sources_not_found.append(src)
+                error_handler.handle_file_not_found(src)
+                error_count += 1
+                continue
+
+            with _measure(engine, src):
+                results = backup_fan_out(src, fan_out)
+            for dest, ok in results.items():
+                if not ok:
+                    failed_sources[dest] += 1
+            if all(results.values()):
                 success_count += 1
             else:
                 error_count += 1
-        else:
+
+    for dest, failed in failed_sources.items():
+        if failed:
+            error_handler.handle_destination_errors(dest, failed)
+
+    return sources_not_found, success_count, error_count
+
+
+def _backup_profile_remote(
+    profile: Profile, dest: RemoteDestination, engine: CopyEngine
+) -> tuple[list, int, int]:
+    """Backup a profile's sources to a backup server.
+
+    Args:
+        profile: The Profile object containing the sources.
+        dest: The backup server.
+        engine: Copy engine whose statistics and throttles apply.
+
+    Returns:
+        The same tuple as ``backup_profile``.
+
+    Raises:
+        DestinationError: If the server cannot be reached.
+    """
+    try:
+        ping(dest)
+    except OSError as e:
+        error_handler.handle_unreachable_server(dest, e)
+        raise DestinationError(f"Unable to connect to {dest}") from e
+
+    logger.info(f"Backing up profile: {profile}")
+
+    if (
+        engine.compressor
+        or profile.dedup
+        or profile.link_duplicates
+        or profile.drop_cache
+        or profile.fast_scan
+        or engine.batch
+    ):
+        logger.warning(
+            "Compression, dedup, duplicate linking, cache dropping, fast scans "
+            "and durable writes are not applied when backing up to a server; "
+            "the server renames each file into place."
+        )
+
+    sources_not_found = []
+    success_count = 0
+    error_count = 0
+
+    for src in profile.sources:
+        if not src.exists():
             sources_not_found.append(src)
             error_handler.handle_file_not_found(src)
             error_count += 1
+            continue
+        with _measure(engine, src):
+            ok = backup_remote(src, dest, profile.name, engine)
+        if ok:
+            success_count += 1
+        else:
+            error_count += 1
 
     return sources_not_found, success_count, error_count
 
@@ -0,0 +1,214 @@
+"""Copies that do not push other programs' data out of the page cache.
+
+A plain copy leaves every byte it reads and writes in the page cache,
+where it evicts the data running applications rely on. Here the kernel is
+told that the source is read sequentially, and each chunk is dropped from
+the cache of both files once it has been copied. Very large files can
+bypass the cache entirely with ``O_DIRECT``.
+
+Dropping a written chunk only succeeds once it has reached the disk, so
+the hint for each chunk starts its writeback and the hint for the next
+chunk drops it. The final chunk of a file may stay cached until the
+kernel writes it back.
+"""
+
+import errno
+import mmap
+import os
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+# Bytes copied between hints. A multiple of every common block size, so
+# O_DIRECT transfers stay aligned.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# O_DIRECT transfers must be a multiple of the device's block size.
+DIRECT_ALIGN = 4096
+
+MEMINFO_PATH = Path("/proc/meminfo")
+
+HAVE_FADVISE = hasattr(os, "posix_fadvise")
+
+
+@dataclass(frozen=True)
+class CacheSnapshot:
+    """System-wide page cache usage at one point in time.
+
+    Attributes:
+        cached: Bytes of file data in the page cache.
+        dirty: Bytes of cached data waiting to be written to disk.
+    """
+
+    cached: int
+    dirty: int
+
+
+def cache_snapshot(path: Path = MEMINFO_PATH) -> CacheSnapshot | None:
+    """Read the current page cache usage.
+
+    Args:
+        path: The ``meminfo`` file to read.
+
+    Returns:
+        The current usage, or ``None`` where ``/proc/meminfo`` is not
+        available, such as on macOS and Windows.
+    """
+    try:
+        text = path.read_text()
+    except OSError:
+        return None
+    values = {}
+    for line in text.splitlines():
+        name, _, rest = line.partition(":")
+        if name in ("Cached", "Dirty"):
+            values[name] = int(rest.split()[0]) * 1024
+    if len(values) < 2:
+        return None
+    return CacheSnapshot(cached=values["Cached"], dirty=values["Dirty"])
+
+
+def _advise(fd: int, offset: int, length: int, advice: int) -> None:
+    """Pass a hint to the kernel, ignoring platforms and files that refuse it.
+
+    Args:
+        fd: The file descriptor.
+        offset: Start of the range.
+        length: Length of the range, or 0 for the rest of the file.
+        advice: One of the ``os.POSIX_FADV_*`` constants.
+    """
+    if HAVE_FADVISE:
+        try:
+            os.posix_fadvise(fd, offset, length, advice)
+        except OSError:
+            pass
+
+
+def _open(path, flags: int, direct: bool) -> tuple[int, bool]:
+    """Open a file, with ``O_DIRECT`` if requested and supported.
+
+    Args:
+        path: The file to open.
+        flags: ``os.open`` flags.
+        direct: Whether to try ``O_DIRECT`` first.
+
+    Returns:
+        The file descriptor and whether ``O_DIRECT`` is in effect.
+    """
+    # Without O_BINARY, Windows opens files in text mode and rewrites
+    # line endings in the copied data.
+    flags |= getattr(os, "O_BINARY", 0)
+    if direct and hasattr(os, "O_DIRECT"):
+        try:
+            return os.open(path, flags | os.O_DIRECT, 0o666), True
+        except OSError as e:
+            # File systems such as tmpfs do not support direct I/O.
+            if e.errno != errno.EINVAL:
+                raise
+    return os.open(path, flags, 0o666), False
+
+
+def _clear_direct(fd: int) -> None:
+    """Turn ``O_DIRECT`` off for an open file.
+
+    Args:
+        fd: The file descriptor.
+    """
+    import fcntl
+
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_DIRECT)
+
+
+def copy_uncached(
+    src,
+    dst,
+    wait_for_bytes: Callable[[int], None],
+    direct: bool = False,
+) -> int:
+    """Copy a file's data while keeping it out of the page cache.
+
+    Metadata is not copied.
+
+    Args:
+        src: Source file path.
+        dst: Destination file path.
+        wait_for_bytes: Called with the size of each chunk before it is
+            written, to apply rate limits.
+        direct: Read and write with ``O_DIRECT`` where the file systems
+            support it.
+
+    Returns:
+        The number of bytes copied.
+    """
+    fsrc, src_direct = _open(src, os.O_RDONLY, direct)
+    try:
+        fdst, dst_direct = _open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, direct)
+        try:
+            if HAVE_FADVISE:
+                _advise(fsrc, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            # Anonymous maps are page aligned, as O_DIRECT buffers must be.
+            buffer = mmap.mmap(-1, CHUNK_SIZE)
+            view = memoryview(buffer)
+            # Unbuffered, so reads go straight into the aligned buffer.
+            reader = open(fsrc, "rb", buffering=0, closefd=False)
+            offset = 0
+            try:
+                while True:
+                    try:
+                        n = reader.readinto(view)
+                    except OSError as e:
+                        # Some file systems accept O_DIRECT when opening
+                        # but refuse the I/O, and a short read leaves the
+                        # next one unaligned. Nothing was read; retry
+                        # through the cache.
+                        if not src_direct or e.errno != errno.EINVAL:
+                            raise
+                        _clear_direct(fsrc)
+                        src_direct = False
+                        continue
+                    if not n:
+                        break
+                    wait_for_bytes(n)
+                    if dst_direct and n % DIRECT_ALIGN:
+                        # Only the final, partial block of a file is
+                        # unaligned; it is written through the cache.
+                        _clear_direct(fdst)
+                        dst_direct = False
+                    written = 0
+                    while written < n:
+                        if dst_direct and written:
+                            # The rest of a short write is unaligned.
+                            _clear_direct(fdst)
+                            dst_direct = False
+                        try:
+                            with view[written:n] as part:
+                                written += os.write(fdst, part)
+                        except OSError as e:
+                            if not dst_direct or e.errno != errno.EINVAL:
+                                raise
+                            _clear_direct(fdst)
+                            dst_direct = False
+                    if HAVE_FADVISE:
+                        _advise(fsrc, offset, n, os.POSIX_FADV_DONTNEED)
+                        # Drops the previous chunk, written back by now,
+                        # and starts writing back this one.
+                        previous = max(0, offset - CHUNK_SIZE)
+                        _advise(
+                            fdst,
+                            previous,
+                            offset + n - previous,
+                            os.POSIX_FADV_DONTNEED,
+                        )
+                    offset += n
+            finally:
+                reader.close()
+                view.release()
+                buffer.close()
+            if HAVE_FADVISE:
+                _advise(fdst, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+    return offset
@@ -1,6 +1,11 @@
 """CLI layer for Kachi, built with Typer."""
 
 import logging
+import os
+import signal
+import sqlite3
+import time
+from collections.abc import Callable
 from pathlib import Path
 from typing import Annotated
 
@@ -9,7 +14,18 @@ import typer
 from kachi import __version__ as kachi_version
 from kachi import logger
 from kachi.backup import backup_profile, log_not_found
-from kachi.config import Config
+from kachi.cache import CacheSnapshot, cache_snapshot
+from kachi.config import DEFAULT_PORT, Config, Limits, Profile
+from kachi.daemon import Daemon
+from kachi.dedup import STORE_DIRNAME, restore_tree
+from kachi.engine import CopyEngine, Throttle
+from kachi.errors import DestinationError
+from kachi.history import HISTORY_FILENAME, HistoryStore, Trend
+from kachi.plan import ProfilePlan, plan_profile
+from kachi.remote import BackupServer, close_pools
+from kachi.scan import SCAN_DIRNAME
+from kachi.scheduler import DeviceScheduler, DeviceStats, ProfileRun
+from kachi.units import format_bytes, format_duration
 
 app = typer.Typer(no_args_is_help=True)
 
@@ -50,10 +66,306 @@ def cli(
         logging.getLogger().setLevel(logging.DEBUG)
 
 
+def _selected_profiles(conf: Config, profile: str) -> list[Profile]:
+    """Return the profiles a command should operate on.
+
+    Args:
+        conf: The parsed configuration.
+        profile: Name of a single profile, or empty for all profiles.
+
+    Returns:
+        The selected profiles.
+    """
+    if not profile:
+        return conf.settings
+
+    try:
+        return [conf.get_profile(profile)]
+    except ValueError as e:
+        logger.error(e)
+        raise typer.Exit(code=1)
+
+
+def _log_plan(plan: ProfilePlan, history: HistoryStore) -> None:
+    """Log a dry-run plan for a single profile.
+
+    Args:
+        plan: The plan to report.
+        history: History store used to look up measured throughput.
+    """
+    if not plan.destination_valid:
+        logger.warning(
+            f"Destination for profile '{plan.profile}' is not a directory: "
+            f"{plan.destination}"
+        )
+
+    file_word = "file" if plan.files == 1 else "files"
+    logger.info(
+        f"Plan for profile '{plan.profile}': {plan.files} {file_word}, "
+        f"{format_bytes(plan.bytes)} ({plan.new} new, {plan.changed} changed)"
+    )
+    if plan.errors:
+        error_word = "entry" if plan.errors == 1 else "entries"
+        logger.warning(
+            f"{plan.errors} {error_word} in profile '{plan.profile}' could not "
+            "be read and are not included in the plan"
+        )
+    for source in plan.sources:
+        logger.debug(
+            f"  {source.source}: {source.files} files, "
+            f"{format_bytes(source.bytes)} ({source.new} new, "
+            f"{source.changed} changed, {source.unchanged} unchanged)"
+        )
+
+    try:
+        throughput = history.throughput(plan.profile)
+    except sqlite3.Error as e:
+        logger.warning(f"Unable to read run history: {e}")
+        throughput = None
+
+    seconds = plan.estimate_seconds(throughput)
+    if seconds is None:
+        logger.info("Estimated duration: unknown (no previous runs recorded)")
+    else:
+        logger.info(
+            f"Estimated duration: {format_duration(seconds)} "
+            f"at {format_bytes(throughput)}/s"
+        )
+
+
+def _record_run(history: HistoryStore, run: ProfileRun) -> None:
+    """Record a completed profile run, logging rather than failing on errors.
+
+    Aborted runs copied nothing and are not recorded. Runs with errors are
+    recorded with their error count, which keeps them out of estimates and
+    trends.
+
+    Args:
+        history: The history store to write to.
+        run: The results of the profile run.
+    """
+    if run.aborted:
+        return
+    try:
+        history.record_run(
+            run.profile.name,
+            run.seconds,
+            run.stats.files,
+            run.stats.bytes,
+            {src: (s.seconds, s.files, s.bytes) for src, s in run.sources.items()},
+            errors=run.errors,
+        )
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Unable to record run history: {e}")
+
+
+def _log_transfer(run: ProfileRun, global_limits: Limits) -> None:
+    """Log the achieved transfer rate of a run and any rate caps applied.
+
+    The summary is logged at INFO level when the profile is throttled or
+    sparse files were copied, and at DEBUG level otherwise. Linked
+    duplicates, compression and dedup results are always logged.
+
+    Args:
+        run: The results of the profile run.
+        global_limits: Limits shared by all profiles.
+    """
+    profile = run.profile
+    stats = run.stats
+    seconds = run.seconds
+    elapsed = max(seconds, 1e-9)
+    written = ""
+    if stats.physical_bytes != stats.bytes:
+        # Holes, linked duplicates or chunks already stored were not written.
+        written = f" ({format_bytes(stats.physical_bytes)} written)"
+    message = (
+        f"Transferred {format_bytes(stats.bytes)}{written} in {stats.files} files "
+        f"for profile '{profile.name}' in {format_duration(seconds)} "
+        f"({format_bytes(stats.bytes / elapsed)}/s, "
+        f"{stats.files / elapsed:.1f} files/s)"
+    )
+
+    caps = []
+    for scope, limits in (("profile", profile.limits), ("global", global_limits)):
+        if limits.bytes_per_second:
+            caps.append(f"{scope} cap {format_bytes(limits.bytes_per_second)}/s")
+        if limits.files_per_second:
+            caps.append(f"{scope} cap {limits.files_per_second:g} files/s")
+
+    if caps:
+        logger.info(
+            f"{message}; {', '.join(caps)}; "
+            f"throttled for {format_duration(stats.throttled_seconds)}"
+        )
+    elif written:
+        logger.info(message)
+    else:
+        logger.debug(message)
+
+    if stats.linked_files:
+        file_word = "file" if stats.linked_files == 1 else "files"
+        logger.info(
+            f"Hard linked {stats.linked_files} duplicate {file_word}, saving "
+            f"{format_bytes(stats.linked_bytes)}"
+        )
+
+    if stats.uncached_bytes:
+        logger.info(
+            f"Copied {format_bytes(stats.uncached_bytes)} without keeping it "
+            "in the page cache"
+        )
+
+    if run.compression:
+        compressed = run.compression
+        logger.info(
+            f"Compressed {compressed.files} files from "
+            f"{format_bytes(compressed.bytes_in)} to "
+            f"{format_bytes(compressed.bytes_out)} "
+            f"(ratio {compressed.ratio:.2f}, "
+            f"{format_duration(compressed.cpu_seconds)} CPU); "
+            f"{compressed.stored} stored uncompressed"
+        )
+
+    if run.dedup:
+        dedup = run.dedup
+        logger.info(
+            f"Deduplicated {dedup.files} files of {format_bytes(dedup.bytes_in)} "
+            f"into {dedup.chunks} chunks, {dedup.new_chunks} new "
+            f"({format_bytes(dedup.bytes_stored)} stored, "
+            f"dedup ratio {dedup.ratio:.2f}:1, "
+            f"{format_duration(dedup.cpu_seconds)} CPU)"
+        )
+
+
+def _log_devices(devices: list[DeviceStats]) -> None:
+    """Log the throughput of each device used by a parallel run.
+
+    Args:
+        devices: Per-device statistics from the scheduler.
+    """
+    for device in devices:
+        kind = {True: "rotational", False: "non-rotational"}.get(
+            device.rotational, "unknown type"
+        )
+        # Windows has no major and minor numbers; show the raw st_dev.
+        if hasattr(os, "major"):
+            name = f"{os.major(device.device)}:{os.minor(device.device)}"
+        else:
+            name = str(device.device)
+        logger.info(
+            f"Device {name} "
+            f"({device.label}, {kind}, limit {device.limit}): "
+            f"{device.files} files, {format_bytes(device.bytes)} in "
+            f"{format_duration(device.busy_seconds)} busy "
+            f"({format_bytes(device.throughput)}/s)"
+        )
+
+
+def _run_sequential(
+    profiles: list[Profile], make_engine: Callable[[Profile], CopyEngine]
+) -> list[ProfileRun]:
+    """Back up profiles one after another.
+
+    Args:
+        profiles: The profiles to back up.
+        make_engine: Returns a new copy engine for a profile.
+
+    Returns:
+        One result per profile.
+
+    Raises:
+        DestinationError: If a profile has no valid destination.
+    """
+    runs = []
+    for p in profiles:
+        engine = make_engine(p)
+        run = ProfileRun(profile=p, started=time.perf_counter())
+        run.not_found, run.success, run.errors = backup_profile(p, engine)
+        run.finished = time.perf_counter()
+        run.stats = engine.stats
+        run.sources = engine.sources
+        if engine.compressor:
+            run.compression = engine.compressor.stats
+        if engine.deduplicator:
+            run.dedup = engine.deduplicator.stats
+        runs.append(run)
+    return runs
+
+
+def _log_page_cache(before: CacheSnapshot | None) -> None:
+    """Log how the system's page cache changed since a snapshot.
+
+    Nothing is logged where page cache usage cannot be read.
+
+    Args:
+        before: Usage when the backup started.
+    """
+    after = cache_snapshot()
+    if before is None or after is None:
+        return
+
+    def change(old: int, new: int) -> str:
+        """Describe a change in usage, such as ``1.0 GB -> 1.2 GB (+200.0 MB)``."""
+        sign = "-" if new < old else "+"
+        delta = format_bytes(abs(new - old))
+        return f"{format_bytes(old)} -> {format_bytes(new)} ({sign}{delta})"
+
+    logger.info(
+        f"Page cache {change(before.cached, after.cached)}, "
+        f"dirty {change(before.dirty, after.dirty)}"
+    )
+
+
+def _engine_factory(
+    conf: Config, global_throttle: Throttle
+) -> Callable[[Profile], CopyEngine]:
+    """Return a function creating copy engines for the profiles of a config.
+
+    Args:
+        conf: The parsed configuration.
+        global_throttle: Throttle enforcing the global rate limits, shared
+            by every engine.
+
+    Returns:
+        A function that creates a new engine for a profile. Engines share
+        the global throttle. Each gets its own throttle for the profile's
+        limits unless one is passed in, as the parallel scheduler does so
+        that all work items of a profile share the profile's limits.
+    """
+
+    def make_engine(p: Profile, throttle: Throttle | None = None) -> CopyEngine:
+        """Create a copy engine configured for a profile."""
+        dest = p.backup_destination
+        return CopyEngine(
+            throttles=[throttle or Throttle(p.limits), global_throttle],
+            durable=p.durable,
+            compression=p.compression,
+            fast_scan=p.fast_scan,
+            scan_dir=conf.state_dir / SCAN_DIRNAME / p.name,
+            dedup=p.dedup,
+            chunk_store=dest / STORE_DIRNAME if isinstance(dest, Path) else None,
+            drop_cache=p.drop_cache,
+        )
+
+    return make_engine
+
+
 @app.command()
 def backup(
     config: Annotated[str, typer.Option(help="Path to a configuration file")] = "",
     profile: Annotated[str, typer.Option(help="Name of the profile to backup")] = "",
+    dry_run: Annotated[
+        bool,
+        typer.Option(
+            "--dry-run", help="Show what would be copied without writing anything"
+        ),
+    ] = False,
+    parallel: Annotated[
+        bool,
+        typer.Option(
+            "--parallel", help="Back up sources on different devices in parallel"
+        ),
+    ] = False,
 ):
     """Backup files and directories.
 
@@ -66,35 +378,58 @@ def backup(
             path when empty.
         profile: Name of a single profile to back up. When empty, all
             profiles are backed up.
+        dry_run: Plan the backup and report its size and estimated
+            duration instead of copying anything.
+        parallel: Run sources concurrently, with one concurrency limit
+            per source and destination device.
     """
 
-    logger.info("Starting backup...")
-
     conf = Config(Path(config) if config else None)
     conf.parse()
+    history = HistoryStore(conf.state_dir / HISTORY_FILENAME)
+    profiles = _selected_profiles(conf, profile)
+
+    if dry_run:
+        logger.info("Planning backup (dry run)...")
+        not_found = []
+        for p in profiles:
+            plan = plan_profile(p)
+            not_found.extend(plan.not_found)
+            _log_plan(plan, history)
+        log_not_found(not_found)
+        return
+
+    logger.info("Starting backup...")
+
+    make_engine = _engine_factory(conf, Throttle(conf.limits))
+    cache_before = cache_snapshot() if any(p.drop_cache for p in profiles) else None
+
+    try:
+        if parallel:
+            scheduler = DeviceScheduler(conf.scheduling, make_engine)
+            runs = scheduler.run(profiles)
+        else:
+            runs = _run_sequential(profiles, make_engine)
+    except DestinationError:
+        # The invalid destination has already been reported.
+        raise typer.Exit(code=1)
+    finally:
+        close_pools()
 
     not_found = []
     total_success = 0
     total_errors = 0
 
-    if profile:
-        try:
-            p = conf.get_profile(profile)
-        except ValueError as e:
-            logger.error(e)
-            raise typer.Exit(code=1)
+    for run in runs:
+        _record_run(history, run)
+        _log_transfer(run, conf.limits)
+        not_found.extend(run.not_found)
+        total_success += run.success
+        total_errors += run.errors
 
-        nf, success, errors = backup_profile(p)
-        not_found.extend(nf)
-        total_success += success
-        total_errors += errors
-
-    else:
-        for p in conf.settings:
-            nf, success, errors = backup_profile(p)
-            not_found.extend(nf)
-            total_success += success
-            total_errors += errors
+    if parallel:
+        _log_devices(list(scheduler.devices.values()))
+    _log_page_cache(cache_before)
 
     log_not_found(not_found)
     source_word = "source" if total_success == 1 else "sources"
@@ -104,6 +439,255 @@ def backup(
         f"{total_errors} {error_word}."
     )
 
+    if any(run.aborted for run in runs):
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def serve(
+    root: Annotated[
+        Path, typer.Argument(help="Directory to store received backups in")
+    ],
+    host: Annotated[str, typer.Option(help="Address to listen on")] = "127.0.0.1",
+    port: Annotated[int, typer.Option(help="TCP port to listen on")] = DEFAULT_PORT,
+    token: Annotated[
+        str | None,
+        typer.Option(
+            envvar="KACHI_SERVER_TOKEN",
+            help="Secret clients must present, set as server.token in their config",
+        ),
+    ] = None,
+):
+    """Receive backups from other hosts over TCP.
+
+    Profiles whose backup destination is ``kachi://host:port`` send their
+    sources to this server, which stores them under a directory named
+    after each profile.
+
+    Args:
+        root: Directory received files are stored under.
+        host: Address to listen on. Use ``0.0.0.0`` to accept connections
+            from other hosts.
+        port: TCP port to listen on.
+        token: Secret clients must present before sending files. Without
+            one any client that can connect may write to the store.
+    """
+    if not root.is_dir():
+        logger.error(f"Destination is not a directory: {str(root)}")
+        raise typer.Exit(code=1)
+
+    with BackupServer(root, host, port, token or None) as server:
+        bound_host, bound_port = server.server_address[:2]
+        logger.info(f"Serving backups to {str(root)} on {bound_host}:{bound_port}")
+        if not token:
+            logger.warning(
+                "No token set: any client that can connect may write backups. "
+                "Only listen on trusted networks."
+            )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Server stopped.")
+
+
+@app.command()
+def restore(
+    source: Annotated[
+        Path, typer.Argument(help="Backed-up file or directory to restore")
+    ],
+    target: Annotated[Path, typer.Argument(help="Directory to restore into")],
+):
+    """Rebuild files from a deduplicated backup.
+
+    Every recipe under ``source`` is joined back together from the chunk
+    store and written under the file's original name. Other files are
+    copied as they are.
+
+    Args:
+        source: A file or directory inside a deduplicated backup.
+        target: Directory the restored files are written to.
+    """
+    if not source.exists():
+        logger.error(f"Source not found: {str(source)}")
+        raise typer.Exit(code=1)
+
+    try:
+        files, total = restore_tree(source, target)
+    except (OSError, ValueError) as e:
+        logger.error(f"Restore failed: {e}")
+        raise typer.Exit(code=1)
+
+    file_word = "file" if files == 1 else "files"
+    logger.info(f"Restored {files} {file_word} ({format_bytes(total)}) to {target}")
+
+
+def _run_scheduled(conf: Config, profile: Profile, global_throttle: Throttle) -> None:
+    """Back up a single profile for the daemon and record the run.
+
+    Args:
+        conf: The configuration the profile belongs to.
+        profile: The profile to back up.
+        global_throttle: Throttle enforcing the global rate limits.
+    """
+    history = HistoryStore(conf.state_dir / HISTORY_FILENAME)
+    cache_before = cache_snapshot() if profile.drop_cache else None
+    try:
+        runs = _run_sequential([profile], _engine_factory(conf, global_throttle))
+    except DestinationError:
+        # The invalid destination has already been reported.
+        return
+    for run in runs:
+        _record_run(history, run)
+        _log_transfer(run, conf.limits)
+        log_not_found(run.not_found)
+        error_word = "error" if run.errors == 1 else "errors"
+        logger.info(
+            f"Scheduled backup of profile '{profile.name}' complete: "
+            f"{run.errors} {error_word}."
+        )
+    _log_page_cache(cache_before)
+
+
+def _describe_trend(trend: Trend) -> str:
+    """Summarize a trend, such as ``2m 3s, 1.2 GB in 340 files (time +23%)``.
+
+    Args:
+        trend: The trend to describe.
+
+    Returns:
+        The latest duration and size, and their change from the baseline.
+    """
+    file_word = "file" if trend.files == 1 else "files"
+    text = (
+        f"{format_duration(trend.seconds)}, {format_bytes(trend.bytes)} in "
+        f"{trend.files} {file_word}"
+    )
+    changes = []
+    if trend.time_growth is not None:
+        changes.append(f"time {trend.time_growth - 1:+.0%}")
+    if trend.size_growth is not None:
+        changes.append(f"size {trend.size_growth - 1:+.0%}")
+    if changes:
+        text += f" ({', '.join(changes)})"
+    return text
+
+
+def _log_regression(label: str, trend: Trend, threshold: float) -> None:
+    """Warn about a profile or source that grew beyond a threshold.
+
+    Args:
+        label: How to refer to the profile or source.
+        trend: The trend of the profile or source.
+        threshold: Growth factor that counts as a regression.
+    """
+    reasons = []
+    if trend.slower(threshold):
+        reasons.append(
+            f"took {format_duration(trend.seconds)}, {trend.time_growth:.1f}x "
+            f"the usual {format_duration(trend.baseline_seconds)}"
+        )
+    if trend.larger(threshold):
+        reasons.append(
+            f"copied {format_bytes(trend.bytes)}, {trend.size_growth:.1f}x "
+            f"the usual {format_bytes(trend.baseline_bytes)}"
+        )
+    if reasons:
+        logger.warning(f"{label} {' and '.join(reasons)}")
+
+
+@app.command()
+def history(
+    config: Annotated[str, typer.Option(help="Path to a configuration file")] = "",
+    profile: Annotated[str, typer.Option(help="Name of the profile to show")] = "",
+    runs: Annotated[
+        int, typer.Option(min=2, help="Number of recent runs to compare")
+    ] = 10,
+    threshold: Annotated[
+        float,
+        typer.Option(
+            min=1.0, help="Growth over the usual time or size that is flagged"
+        ),
+    ] = 1.5,
+):
+    """Show how recent backups compare with earlier ones.
+
+    For each profile, the latest run and each of its sources is compared
+    with the median of the runs before it. Profiles and sources whose
+    duration or size grew by more than ``threshold`` are flagged.
+
+    Args:
+        config: Path to a YAML configuration file. Uses the default
+            path when empty.
+        profile: Name of a single profile to show. When empty, every
+            profile with recorded runs is shown.
+        runs: Number of most recent runs to look at, including the latest.
+        threshold: Growth factor over the median of earlier runs that is
+            flagged, e.g. ``1.5`` for 50% more time or data.
+    """
+    conf = Config(Path(config) if config else None)
+    conf.parse()
+    store = HistoryStore(conf.state_dir / HISTORY_FILENAME)
+
+    try:
+        names = [profile] if profile else store.profiles()
+        results = [(name, *store.trends(name, runs)) for name in names]
+    except sqlite3.Error as e:
+        logger.error(f"Unable to read run history: {e}")
+        raise typer.Exit(code=1)
+
+    if not any(trend for _, trend, _ in results):
+        logger.info("No backup runs recorded yet.")
+        return
+
+    for name, trend, sources in results:
+        if trend is None:
+            logger.info(f"No runs without errors recorded for profile '{name}'.")
+            continue
+        run_word = "run" if trend.previous_runs == 1 else "runs"
+        logger.info(
+            f"Profile '{name}': {_describe_trend(trend)}, compared with "
+            f"{trend.previous_runs} earlier {run_word}"
+        )
+        for source in sources:
+            logger.info(f"  {source.name}: {_describe_trend(source)}")
+        _log_regression(f"Profile '{name}'", trend, threshold)
+        for source in sources:
+            _log_regression(f"Source {source.name}", source, threshold)
+
+
+@app.command()
+def daemon(
+    config: Annotated[str, typer.Option(help="Path to a configuration file")] = "",
+):
+    """Back up profiles on their schedules until interrupted.
+
+    Profiles with a ``schedule`` in the configuration file are backed up
+    whenever they fall due. The configuration is reloaded automatically
+    when the file changes.
+
+    Args:
+        config: Path to a YAML configuration file. Uses the default
+            path when empty.
+    """
+    conf = Config(Path(config) if config else None)
+    scheduler = Daemon(conf, _run_scheduled)
+    try:
+        scheduler.reload()
+    except Exception as e:
+        logger.error(f"Unable to load config file: {e}")
+        raise typer.Exit(code=1)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    logger.info("Daemon started. Press Ctrl+C to stop.")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+        scheduler.run_forever()
+    finally:
+        close_pools()
+    logger.info("Daemon stopped.")
+
 
 if __name__ == "__main__":
     typer.run(cli)  # pragma: no cover
@@ -0,0 +1,242 @@
+"""Parallel, adaptive compression of backed-up files.
+
+Files are compressed in a pool of worker processes so compression scales
+with the number of cores. Each file gets its own codec and level: content
+that is already compressed, judged by its extension or by the entropy of
+a small sample, is copied as it is rather than recompressed.
+"""
+
+import bz2
+import gzip
+import lzma
+import math
+import os
+import shutil
+import time
+from collections import Counter, deque
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from kachi.config import Compression
+
+# Extensions of formats that are compressed already.
+COMPRESSED_EXTENSIONS = frozenset(
+    {
+        ".7z", ".aac", ".avi", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz",
+        ".heic", ".jar", ".jpeg", ".jpg", ".lz4", ".lzma", ".m4a", ".mkv",
+        ".mov", ".mp3", ".mp4", ".ogg", ".png", ".pptx", ".rar", ".tgz",
+        ".webm", ".webp", ".whl", ".xlsx", ".xz", ".zip", ".zst",
+    }
+)  # fmt: skip
+
+SUFFIXES = {"gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+
+# Bytes read from the start of a file to estimate its entropy.
+SAMPLE_SIZE = 64 * 1024
+
+# Samples above this many bits per byte are treated as incompressible.
+ENTROPY_THRESHOLD = 7.5
+
+_OPENERS = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+_LEVEL_ARG = {"gzip": "compresslevel", "bz2": "compresslevel", "xz": "preset"}
+
+
+def sample_entropy(path: Path, size: int = SAMPLE_SIZE) -> float:
+    """Estimate the Shannon entropy of the start of a file.
+
+    Args:
+        path: The file to sample.
+        size: Number of bytes to read.
+
+    Returns:
+        The entropy in bits per byte, from 0.0 to 8.0.
+    """
+    with open(path, "rb") as f:
+        sample = f.read(size)
+    if not sample:
+        return 0.0
+
+    total = len(sample)
+    return -sum(c / total * math.log2(c / total) for c in Counter(sample).values())
+
+
+def choose_codec(
+    path: Path, size: int, settings: Compression
+) -> tuple[str, int | None] | None:
+    """Pick the codec and level to compress a file with.
+
+    Args:
+        path: The source file.
+        size: Size of the file in bytes.
+        settings: The profile's compression settings.
+
+    Returns:
+        A ``(codec, level)`` tuple, or ``None`` if the file should be
+        copied without compression.
+    """
+    if path.suffix.lower() in COMPRESSED_EXTENSIONS or size == 0:
+        return None
+
+    entropy = sample_entropy(path)
+    if entropy > ENTROPY_THRESHOLD:
+        return None
+
+    if settings.codec != "auto":
+        return settings.codec, settings.level
+
+    # Highly redundant, large files repay xz's extra CPU time; everything
+    # else gets gzip, which is fast and still effective.
+    if size >= 1024 * 1024 and entropy < 4.0:
+        return "xz", settings.level if settings.level is not None else 6
+    return "gzip", settings.level if settings.level is not None else 6
+
+
+def compress_file(
+    src: str, dst: str, codec: str, level: int | None
+) -> tuple[int, int, float]:
+    """Compress a file, preserving its metadata. Runs in a worker process.
+
+    Args:
+        src: Source file path.
+        dst: Path of the compressed file to write.
+        codec: One of the keys of ``SUFFIXES``.
+        level: Compression level, or ``None`` for the codec's default.
+
+    Returns:
+        A tuple containing:
+        - Bytes read from the source.
+        - Bytes written to the destination.
+        - CPU seconds spent compressing.
+    """
+    start = time.process_time()
+    kwargs = {} if level is None else {_LEVEL_ARG[codec]: level}
+    with open(src, "rb") as fsrc, _OPENERS[codec](dst, "wb", **kwargs) as fdst:
+        shutil.copyfileobj(fsrc, fdst)
+    shutil.copystat(src, dst)
+    cpu_seconds = time.process_time() - start
+    return Path(src).stat().st_size, Path(dst).stat().st_size, cpu_seconds
+
+
+@dataclass
+class CompressionStats:
+    """Totals for the files handled by a Compressor.
+
+    Attributes:
+        files: Number of files compressed.
+        stored: Number of files copied without compression.
+        bytes_in: Size of the compressed files before compression.
+        bytes_out: Size of the compressed files after compression.
+        cpu_seconds: CPU time spent compressing, summed over workers.
+    """
+
+    files: int = 0
+    stored: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    cpu_seconds: float = 0.0
+
+    def merge(self, other: "CompressionStats") -> None:
+        """Add the totals of another compressor to these.
+
+        Args:
+            other: The statistics to add.
+        """
+        self.files += other.files
+        self.stored += other.stored
+        self.bytes_in += other.bytes_in
+        self.bytes_out += other.bytes_out
+        self.cpu_seconds += other.cpu_seconds
+
+    @property
+    def ratio(self) -> float:
+        """Compressed size as a fraction of the original size."""
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+
+class Compressor:
+    """Compress files on a pool of worker processes.
+
+    At most a few files per worker are in flight at once, so memory use
+    does not grow with the number of files in a run.
+    """
+
+    def __init__(
+        self,
+        settings: Compression,
+        on_done: Callable[[str, str, str, int, Exception | None], None],
+    ):
+        """Initialize the compressor. The pool is started on first use.
+
+        Args:
+            settings: The profile's compression settings.
+            on_done: Called in the submitting thread once a file has been
+                compressed, with the source path, the path written, the
+                final path, the bytes written and the error, if any.
+        """
+        self.settings = settings
+        self.stats = CompressionStats()
+        self._on_done = on_done
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: deque[tuple[str, str, str, Future]] = deque()
+        self._max_pending = 4 * (settings.workers or os.cpu_count() or 1)
+
+    def choose(self, src) -> tuple[str, int | None] | None:
+        """Pick the codec for a file, counting files that are not compressed.
+
+        Args:
+            src: Source file path.
+
+        Returns:
+            A ``(codec, level)`` tuple, or ``None`` if the file should be
+            copied as it is.
+        """
+        path = Path(src)
+        choice = choose_codec(path, path.stat().st_size, self.settings)
+        if choice is None:
+            self.stats.stored += 1
+        return choice
+
+    def submit(self, src, write_path: str, final_path: str, codec, level) -> None:
+        """Queue a file for compression.
+
+        Blocks until an earlier file finishes when too many are in flight.
+
+        Args:
+            src: Source file path.
+            write_path: Path the worker writes the compressed data to.
+            final_path: Path the compressed file ends up at. Differs from
+                ``write_path`` when it is renamed into place afterwards.
+            codec: Codec returned by ``choose``.
+            level: Level returned by ``choose``.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.settings.workers)
+        future = self._pool.submit(compress_file, str(src), write_path, codec, level)
+        self._pending.append((str(src), write_path, final_path, future))
+        while len(self._pending) > self._max_pending:
+            self._finish_oldest()
+
+    def drain(self) -> None:
+        """Wait for every pending file and shut the pool down."""
+        while self._pending:
+            self._finish_oldest()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _finish_oldest(self) -> None:
+        """Wait for the oldest pending file and report its result."""
+        src, write_path, final_path, future = self._pending.popleft()
+        try:
+            bytes_in, bytes_out, cpu_seconds = future.result()
+        except Exception as e:
+            Path(write_path).unlink(missing_ok=True)
+            self._on_done(src, write_path, final_path, 0, e)
+            return
+        self.stats.files += 1
+        self.stats.bytes_in += bytes_in
+        self.stats.bytes_out += bytes_out
+        self.stats.cpu_seconds += cpu_seconds
+        self._on_done(src, write_path, final_path, bytes_out, None)
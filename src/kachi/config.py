@@ -1,15 +1,511 @@
 """YAML configuration parsing for Kachi backup profiles."""
 
+import os
 import pathlib
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 from pathlib import Path
 
 import yaml
 
 from kachi import logger
+from kachi.units import parse_duration, parse_size
 
 DEFAULT_CONFIG_PATH = pathlib.Path.home() / ".config" / "kachi" / "config.yaml"
 
+# Destinations starting with this scheme are served by ``kachi serve``.
+REMOTE_SCHEME = "kachi://"
+DEFAULT_PORT = 7847
+
+
+@dataclass
+class Limits:
+    """I/O rate limits applied while copying.
+
+    Attributes:
+        bytes_per_second: Maximum bytes written per second, or ``None``
+            for no limit.
+        files_per_second: Maximum files copied per second, or ``None``
+            for no limit.
+    """
+
+    bytes_per_second: int | None = None
+    files_per_second: float | None = None
+
+
+def _parse_limits(raw: dict | None) -> Limits:
+    """Parse a ``limits`` mapping from the configuration file.
+
+    Args:
+        raw: The mapping as loaded from YAML, or ``None``.
+
+    Returns:
+        The parsed Limits.
+
+    Raises:
+        ValueError: If a limit is not a positive number or size.
+    """
+    if not raw:
+        return Limits()
+
+    limits = Limits()
+    if raw.get("bytes_per_second") is not None:
+        limits.bytes_per_second = parse_size(raw["bytes_per_second"])
+        if limits.bytes_per_second <= 0:
+            raise ValueError("bytes_per_second must be greater than zero.")
+    if raw.get("files_per_second") is not None:
+        limits.files_per_second = float(raw["files_per_second"])
+        if limits.files_per_second <= 0:
+            raise ValueError("files_per_second must be greater than zero.")
+    return limits
+
+
+COMPRESSION_CODECS = ("auto", "gzip", "bz2", "xz")
+
+# Lowest level each codec accepts; every codec's highest level is 9.
+_MIN_COMPRESSION_LEVEL = {"auto": 0, "gzip": 0, "bz2": 1, "xz": 0}
+
+
+@dataclass
+class Compression:
+    """Settings for writing compressed backups.
+
+    Attributes:
+        codec: One of ``COMPRESSION_CODECS``. ``auto`` picks a codec and
+            level for each file.
+        level: Compression level for the chosen codec, or ``None`` for the
+            codec's default.
+        workers: Number of compression processes, or ``None`` to use one
+            per CPU.
+    """
+
+    codec: str = "auto"
+    level: int | None = None
+    workers: int | None = None
+
+
+def _parse_compression(raw: bool | dict | None) -> Compression | None:
+    """Parse a ``compression`` value from the configuration file.
+
+    Args:
+        raw: ``true`` for the default settings, a mapping of settings, or
+            a false value to disable compression.
+
+    Returns:
+        The parsed Compression settings, or ``None`` when disabled.
+
+    Raises:
+        ValueError: If the codec, level or worker count is invalid.
+    """
+    if not raw:
+        return None
+    if raw is True:
+        return Compression()
+
+    compression = Compression(
+        codec=raw.get("codec", "auto"),
+        level=raw.get("level"),
+        workers=raw.get("workers"),
+    )
+    if compression.codec not in COMPRESSION_CODECS:
+        raise ValueError(
+            f"Unknown compression codec '{compression.codec}'. "
+            f"Expected one of: {', '.join(COMPRESSION_CODECS)}."
+        )
+    level = compression.level
+    if level is not None:
+        lowest = _MIN_COMPRESSION_LEVEL[compression.codec]
+        if (
+            not isinstance(level, int)
+            or isinstance(level, bool)
+            or not (lowest <= level <= 9)
+        ):
+            raise ValueError(
+                f"Compression level for codec '{compression.codec}' must be an "
+                f"integer from {lowest} to 9."
+            )
+    if compression.workers is not None and compression.workers < 1:
+        raise ValueError("Compression workers must be at least 1.")
+    return compression
+
+
+@dataclass
+class FastScan:
+    """Settings for skipping directories that have not changed.
+
+    Attributes:
+        full_rescan_every: Every this many runs, every directory is listed
+            again regardless of its recorded state.
+    """
+
+    full_rescan_every: int = 10
+
+
+def _parse_fast_scan(raw: bool | dict | None) -> FastScan | None:
+    """Parse a ``fast_scan`` value from the configuration file.
+
+    Args:
+        raw: ``true`` for the default settings, a mapping of settings, or
+            a false value to disable fast scans.
+
+    Returns:
+        The parsed FastScan settings, or ``None`` when disabled.
+
+    Raises:
+        ValueError: If the rescan interval is not a positive integer.
+    """
+    if not raw:
+        return None
+    if raw is True:
+        return FastScan()
+
+    fast_scan = FastScan(full_rescan_every=raw.get("full_rescan_every", 10))
+    if (
+        not isinstance(fast_scan.full_rescan_every, int)
+        or fast_scan.full_rescan_every < 1
+    ):
+        raise ValueError("fast_scan.full_rescan_every must be a positive integer.")
+    return fast_scan
+
+
+@dataclass
+class Dedup:
+    """Settings for storing files as deduplicated chunks.
+
+    Attributes:
+        chunk_size: Average chunk size in bytes, a power of two. Chunks
+            are between a quarter and four times this size.
+        workers: Number of chunking processes, or ``None`` to use one per
+            CPU.
+    """
+
+    chunk_size: int = 64 * 1024
+    workers: int | None = None
+
+
+def _parse_dedup(raw: bool | dict | None) -> Dedup | None:
+    """Parse a ``dedup`` value from the configuration file.
+
+    Args:
+        raw: ``true`` for the default settings, a mapping of settings, or
+            a false value to copy files whole.
+
+    Returns:
+        The parsed Dedup settings, or ``None`` when disabled.
+
+    Raises:
+        ValueError: If the chunk size or worker count is invalid.
+    """
+    if not raw:
+        return None
+    if raw is True:
+        return Dedup()
+
+    dedup = Dedup(
+        chunk_size=parse_size(raw.get("chunk_size", Dedup.chunk_size)),
+        workers=raw.get("workers"),
+    )
+    size = dedup.chunk_size
+    if size < 1024 or size > 16 * 1024 * 1024 or size & (size - 1):
+        raise ValueError(
+            "dedup.chunk_size must be a power of two between 1KiB and 16MiB."
+        )
+    if dedup.workers is not None and dedup.workers < 1:
+        raise ValueError("Dedup workers must be at least 1.")
+    return dedup
+
+
+@dataclass
+class DropCache:
+    """Settings for keeping copied data out of the page cache.
+
+    Attributes:
+        direct_io_min_size: Files of at least this many bytes are read and
+            written with ``O_DIRECT``, bypassing the cache entirely, or
+            ``None`` to always go through the cache.
+    """
+
+    direct_io_min_size: int | None = None
+
+
+def _parse_drop_cache(raw: bool | dict | None) -> DropCache | None:
+    """Parse a ``drop_cache`` value from the configuration file.
+
+    Args:
+        raw: ``true`` for the default settings, a mapping of settings, or
+            a false value to copy through the page cache as usual.
+
+    Returns:
+        The parsed DropCache settings, or ``None`` when disabled.
+
+    Raises:
+        ValueError: If the direct I/O size is not positive.
+    """
+    if not raw:
+        return None
+    if raw is True:
+        return DropCache()
+
+    drop_cache = DropCache()
+    if raw.get("direct_io_min_size") is not None:
+        drop_cache.direct_io_min_size = parse_size(raw["direct_io_min_size"])
+        if drop_cache.direct_io_min_size < 1:
+            raise ValueError("drop_cache.direct_io_min_size must be positive.")
+    return drop_cache
+
+
+@dataclass
+class Schedule:
+    """How often ``kachi daemon`` backs up a profile.
+
+    Attributes:
+        every: Seconds between the starts of consecutive runs.
+        jitter: Up to this many seconds are added at random to each start
+            time, so profiles with the same interval do not all start at
+            once.
+    """
+
+    every: float
+    jitter: float = 0.0
+
+
+def _parse_schedule(raw: int | float | str | dict | None) -> Schedule | None:
+    """Parse a ``schedule`` value from the configuration file.
+
+    Args:
+        raw: An interval such as ``"6h"``, a mapping with ``every`` and
+            optionally ``jitter``, or ``None`` for no schedule.
+
+    Returns:
+        The parsed Schedule, or ``None`` when the profile is not scheduled.
+
+    Raises:
+        ValueError: If the interval is missing, invalid or zero.
+    """
+    if raw is None or raw is False:
+        return None
+    if not isinstance(raw, dict):
+        raw = {"every": raw}
+    if "every" not in raw:
+        raise ValueError("A schedule needs an 'every' interval.")
+
+    schedule = Schedule(
+        every=parse_duration(raw["every"]),
+        jitter=parse_duration(raw.get("jitter", 0)),
+    )
+    if schedule.every <= 0:
+        raise ValueError("A schedule interval must be greater than zero.")
+    return schedule
+
+
+@dataclass
+class DaemonSettings:
+    """Settings for ``kachi daemon``.
+
+    Attributes:
+        max_concurrent: Maximum number of profiles backed up at once.
+    """
+
+    max_concurrent: int = 2
+
+
+def _parse_daemon(raw: dict | None) -> DaemonSettings:
+    """Parse the top-level ``daemon`` mapping from the configuration file.
+
+    Args:
+        raw: The mapping as loaded from YAML, or ``None``.
+
+    Returns:
+        The parsed DaemonSettings.
+
+    Raises:
+        ValueError: If a setting is unknown or not a positive integer.
+    """
+    raw = raw or {}
+    unknown = set(raw) - {"max_concurrent"}
+    if unknown:
+        raise ValueError(f"Unknown daemon settings: {', '.join(sorted(unknown))}")
+    settings = DaemonSettings(**raw)
+    if not isinstance(settings.max_concurrent, int) or settings.max_concurrent < 1:
+        raise ValueError("daemon.max_concurrent must be a positive integer.")
+    return settings
+
+
+@dataclass
+class Scheduling:
+    """Concurrency settings for running backup work in parallel.
+
+    Attributes:
+        workers: Maximum number of sources backed up at the same time.
+        device_limit: Maximum concurrent sources touching the same
+            non-rotational device, such as an SSD or network share.
+        rotational_limit: Maximum concurrent sources touching the same
+            spinning disk. Defaults to 1 so its heads are never thrashed.
+    """
+
+    workers: int = 4
+    device_limit: int = 4
+    rotational_limit: int = 1
+
+
+def _parse_scheduling(raw: dict | None) -> Scheduling:
+    """Parse the top-level ``scheduler`` mapping from the configuration file.
+
+    Args:
+        raw: The mapping as loaded from YAML, or ``None``.
+
+    Returns:
+        The parsed Scheduling settings.
+
+    Raises:
+        ValueError: If a setting is not a positive integer.
+    """
+    raw = raw or {}
+    unknown = set(raw) - {"workers", "device_limit", "rotational_limit"}
+    if unknown:
+        raise ValueError(f"Unknown scheduler settings: {', '.join(sorted(unknown))}")
+    scheduling = Scheduling(**raw)
+    for name in ("workers", "device_limit", "rotational_limit"):
+        value = getattr(scheduling, name)
+        if not isinstance(value, int) or value < 1:
+            raise ValueError(f"scheduler.{name} must be a positive integer.")
+    return scheduling
+
+
+@dataclass
+class ServerSettings:
+    """Settings shared by ``kachi serve`` and the hosts backing up to it.
+
+    Attributes:
+        token: Secret clients present before sending files, or ``None``
+            if the server accepts any client.
+    """
+
+    token: str | None = None
+
+
+def _parse_server(raw: dict | None) -> ServerSettings:
+    """Parse the top-level ``server`` mapping from the configuration file.
+
+    Args:
+        raw: The mapping as loaded from YAML, or ``None``.
+
+    Returns:
+        The parsed ServerSettings.
+
+    Raises:
+        ValueError: If a setting is unknown or the token is empty.
+    """
+    raw = raw or {}
+    unknown = set(raw) - {"token"}
+    if unknown:
+        raise ValueError(f"Unknown server settings: {', '.join(sorted(unknown))}")
+    settings = ServerSettings(**raw)
+    if settings.token is not None and (
+        not isinstance(settings.token, str) or not settings.token
+    ):
+        raise ValueError("server.token must be a non-empty string.")
+    return settings
+
+
+@dataclass(frozen=True)
+class RemoteDestination:
+    """A backup server started with ``kachi serve``.
+
+    Attributes:
+        host: Host name or address of the server.
+        port: TCP port the server listens on.
+        token: Secret sent to the server before any files, or ``None``.
+    """
+
+    host: str
+    port: int = DEFAULT_PORT
+    token: str | None = field(default=None, repr=False, compare=False)
+
+    def __str__(self) -> str:
+        """Return the destination in its ``kachi://host:port`` form."""
+        return f"{REMOTE_SCHEME}{self.host}:{self.port}"
+
+
+def _parse_remote(raw: str) -> RemoteDestination:
+    """Parse a ``kachi://host[:port]`` destination.
+
+    Args:
+        raw: The destination string, including the scheme.
+
+    Returns:
+        The parsed RemoteDestination.
+
+    Raises:
+        ValueError: If the host is missing or the port is not a number.
+    """
+    address = raw[len(REMOTE_SCHEME) :].rstrip("/")
+    host, sep, port = address.rpartition(":")
+    if not sep:
+        host, port = address, str(DEFAULT_PORT)
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid remote destination '{raw}'.")
+    return RemoteDestination(host=host, port=int(port))
+
+
+def _parse_destination(
+    raw: str | list[str],
+) -> Path | RemoteDestination | list[Path]:
+    """Parse a ``backup_destination`` value from the configuration file.
+
+    Args:
+        raw: A single destination, or a list of destinations. A
+            ``kachi://host:port`` destination sends files to a backup
+            server instead of writing them to a local directory.
+
+    Returns:
+        A Path or RemoteDestination, or a list of Paths when a list was
+        given.
+
+    Raises:
+        ValueError: If a remote destination is invalid or is part of a
+            list.
+    """
+    if isinstance(raw, list):
+        if any(str(d).startswith(REMOTE_SCHEME) for d in raw):
+            raise ValueError(
+                "A kachi:// destination cannot be combined with other destinations."
+            )
+        return [Path(d) for d in raw]
+    if str(raw).startswith(REMOTE_SCHEME):
+        return _parse_remote(raw)
+    return Path(raw)
+
+
+def _parse_options(raw: dict, inherited: dict) -> dict:
+    """Parse the optional per-profile settings.
+
+    Args:
+        raw: The profile mapping as loaded from YAML.
+        inherited: Options inherited from the default profile, used for
+            any setting the profile does not declare.
+
+    Returns:
+        Keyword arguments for the optional Profile fields.
+    """
+    options = dict(inherited)
+    if "limits" in raw:
+        options["limits"] = _parse_limits(raw["limits"])
+    if "durable" in raw:
+        options["durable"] = bool(raw["durable"])
+    if "link_duplicates" in raw:
+        options["link_duplicates"] = bool(raw["link_duplicates"])
+    if "compression" in raw:
+        options["compression"] = _parse_compression(raw["compression"])
+    if "fast_scan" in raw:
+        options["fast_scan"] = _parse_fast_scan(raw["fast_scan"])
+    if "dedup" in raw:
+        options["dedup"] = _parse_dedup(raw["dedup"])
+    if "drop_cache" in raw:
+        options["drop_cache"] = _parse_drop_cache(raw["drop_cache"])
+    if "schedule" in raw:
+        options["schedule"] = _parse_schedule(raw["schedule"])
+    return options
+
 
 @dataclass
 class Profile:
@@ -18,13 +514,63 @@ class Profile:
     Attributes:
         name: The profile name as defined in the YAML config.
         sources: Paths to files or directories to back up.
-        backup_destination: Directory where backups are stored,
+        backup_destination: Directory where backups are stored, a list
+            of directories that each receive a full copy, a backup server,
             or ``None`` if unset.
+        limits: I/O rate limits for this profile.
+        durable: Write each file under a temporary name and rename it into
+            place once its data has been flushed to disk, so a crash never
+            leaves a truncated file at the final path.
+        link_duplicates: Store files whose content appears more than once
+            among the sources once, hard linking the other copies to it.
+        compression: Settings for writing compressed copies, or ``None``
+            to copy files as they are.
+        fast_scan: Settings for skipping unchanged directories when
+            walking sources, or ``None`` to walk every directory.
+        dedup: Settings for storing files as deduplicated chunks, or
+            ``None`` to copy files whole.
+        drop_cache: Settings for keeping copied data out of the page
+            cache, or ``None`` to copy through it as usual.
+        schedule: How often ``kachi daemon`` backs up the profile, or
+            ``None`` if the daemon should leave it alone.
     """
 
     name: str
     sources: list[Path]
-    backup_destination: Path | None
+    backup_destination: Path | RemoteDestination | list[Path] | None
+    limits: Limits = field(default_factory=Limits)
+    durable: bool = False
+    link_duplicates: bool = False
+    compression: Compression | None = None
+    fast_scan: FastScan | None = None
+    dedup: Dedup | None = None
+    drop_cache: DropCache | None = None
+    schedule: Schedule | None = None
+
+    @property
+    def destinations(self) -> list[Path | RemoteDestination]:
+        """The backup destinations as a list, empty if none is set."""
+        if self.backup_destination is None:
+            return []
+        if isinstance(self.backup_destination, list):
+            return list(self.backup_destination)
+        return [self.backup_destination]
+
+    @property
+    def targets(self) -> set[Path]:
+        """Local paths the profile's sources are copied to.
+
+        Two runs whose targets overlap write the same files, including the
+        temporary files of durable writes, and must not run at the same
+        time. Backup servers keep each profile's files apart, so only
+        local destinations are included.
+        """
+        return {
+            Path(os.path.abspath(dest / src.name))
+            for dest in self.destinations
+            if isinstance(dest, Path)
+            for src in self.sources
+        }
 
 
 class Settings:
@@ -43,7 +589,12 @@ class Settings:
 
         Applies default-profile inheritance: the default profile's sources
         are appended to every other profile, and its ``backup_destination``
-        is used as a fallback when a profile does not declare one.
+        and optional settings (such as ``limits``) are used as a fallback
+        when a profile does not declare them. Global ``limits`` shared by
+        all profiles are stored on ``self.limits``, the ``scheduler``
+        settings on ``self.scheduling``, the ``daemon`` settings on
+        ``self.daemon`` and the ``server`` settings on ``self.server``.
+        The server token is attached to every ``kachi://`` destination.
 
         Args:
             filepath: Path to the YAML configuration file.
@@ -55,10 +606,15 @@ class Settings:
             self.raw_content = f.read()
 
         parsed_contents = yaml.safe_load(self.raw_content)
+        self.limits = _parse_limits(parsed_contents.get("limits"))
+        self.scheduling = _parse_scheduling(parsed_contents.get("scheduler"))
+        self.daemon = _parse_daemon(parsed_contents.get("daemon"))
+        self.server = _parse_server(parsed_contents.get("server"))
 
         settings = []
         default_sources = []
         default_backup_dest = None
+        default_options = {}
 
         # Apply default-profile inheritance: append its sources to every
         # other profile and use its backup_destination as a fallback.
@@ -68,15 +624,17 @@ class Settings:
                     Path(s) for s in parsed_contents["profiles"]["default"]["sources"]
                 )
             if "backup_destination" in parsed_contents["profiles"]["default"]:
-                default_backup_dest = Path(
+                default_backup_dest = _parse_destination(
                     parsed_contents["profiles"]["default"]["backup_destination"]
                 )
+            default_options = _parse_options(parsed_contents["profiles"]["default"], {})
 
             settings.append(
                 Profile(
                     name="default",
                     sources=default_sources,
                     backup_destination=default_backup_dest,
+                    **default_options,
                 )
             )
 
@@ -88,12 +646,18 @@ class Settings:
                         sources=[*[Path(s) for s in v["sources"]], *default_sources]
                         if "sources" in v
                         else list(default_sources),
-                        backup_destination=Path(v["backup_destination"])
+                        backup_destination=_parse_destination(v["backup_destination"])
                         if "backup_destination" in v
                         else default_backup_dest,
+                        **_parse_options(v, default_options),
                     )
                 )
 
+        for profile in settings:
+            if isinstance(profile.backup_destination, RemoteDestination):
+                profile.backup_destination = replace(
+                    profile.backup_destination, token=self.server.token
+                )
         return settings
 
 
@@ -134,9 +698,23 @@ class Config:
         logger.info(f"Using config path: {filepath}")
         return path
 
+    @property
+    def state_dir(self) -> Path:
+        """Directory holding Kachi's local state, next to the config file."""
+        return self.filepath.parent
+
     def parse(self) -> None:
-        """Parse the configuration file and populate ``self.settings``."""
-        self.settings = Settings(self.filepath).settings
+        """Parse the configuration file and populate ``self.settings``.
+
+        Global options shared by all profiles, such as ``self.limits``,
+        are populated at the same time.
+        """
+        parsed = Settings(self.filepath)
+        self.settings = parsed.settings
+        self.limits = parsed.limits
+        self.scheduling = parsed.scheduling
+        self.daemon = parsed.daemon
+        self.server = parsed.server
 
     def get_profile(self, name: str) -> Profile:
         """Retrieve a profile by name.
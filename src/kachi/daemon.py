@@ -0,0 +1,243 @@
+"""Run profiles on their schedules from a single long-running process.
+
+The daemon keeps the parsed configuration in memory and parses it again
+only when the file changes. Profiles with a ``schedule`` are started when
+they fall due, each in its own thread, up to ``daemon.max_concurrent`` at
+a time. A profile is never started while its previous run is still
+going; a run that overruns its interval simply delays the next one. Nor
+is it started while another profile copies to the same destination path;
+it starts once that run finishes.
+"""
+
+import random
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from kachi import logger
+from kachi.config import Config, Profile, Schedule
+from kachi.engine import Throttle
+
+# Longest time the daemon sleeps before checking the configuration again.
+POLL_SECONDS = 5.0
+
+
+class Daemon:
+    """Start scheduled profiles when they are due."""
+
+    def __init__(
+        self,
+        config: Config,
+        run_profile: Callable[[Config, Profile, Throttle], None],
+        rng: random.Random | None = None,
+    ):
+        """Initialize the daemon. The configuration is parsed on ``reload``.
+
+        Args:
+            config: The configuration to watch.
+            run_profile: Backs up a single profile. Called in a worker
+                thread with the configuration, the profile and the
+                throttle enforcing the global rate limits, which is shared
+                by all runs.
+            rng: Random number generator used for jitter.
+        """
+        self.config = config
+        self.run_profile = run_profile
+        self.rng = rng or random.Random()
+        self.throttle: Throttle | None = None
+        self._signature: tuple[int, int] | None = None
+        self._lock = threading.Lock()
+        self._next: dict[str, float] = {}
+        self._schedules: dict[str, Schedule] = {}
+        self._last_started: dict[str, float] = {}
+        self._running: dict[str, threading.Thread] = {}
+        self._writing: dict[str, set[Path]] = {}
+        self._stopping = threading.Event()
+        self._wake = threading.Event()
+
+    def reload(self) -> bool:
+        """Parse the configuration file again if it has changed.
+
+        A file that fails to parse is reported and the previous
+        configuration stays in use.
+
+        Returns:
+            True if a new configuration was loaded.
+        """
+        try:
+            st = self.config.filepath.stat()
+        except OSError as e:
+            logger.error(f"Unable to read config file: {e}")
+            return False
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            self.config.parse()
+        except Exception as e:
+            if self.throttle is None:
+                raise
+            logger.error(f"Ignoring invalid config file, keeping the previous one: {e}")
+            return False
+
+        with self._lock:
+            self.throttle = Throttle(self.config.limits)
+        scheduled = len(self.scheduled())
+        profile_word = "profile" if scheduled == 1 else "profiles"
+        logger.info(
+            f"Loaded {self.config.filepath}: {scheduled} scheduled {profile_word}"
+        )
+        return True
+
+    def scheduled(self) -> list[Profile]:
+        """Return the profiles that have a schedule."""
+        return [p for p in self.config.settings if p.schedule is not None]
+
+    def _jitter(self, schedule: Schedule) -> float:
+        """Pick a random delay for one run.
+
+        Args:
+            schedule: The profile's schedule.
+
+        Returns:
+            A delay between zero and the schedule's jitter, in seconds.
+        """
+        return self.rng.uniform(0, schedule.jitter) if schedule.jitter else 0.0
+
+    def _update_schedules(self, profiles: list[Profile], now: float) -> None:
+        """Track new, changed and removed schedules. Called with the lock held.
+
+        Args:
+            profiles: The scheduled profiles.
+            now: The current ``time.monotonic`` value.
+        """
+        names = {p.name for p in profiles}
+        for name in list(self._next):
+            if name not in names:
+                del self._next[name]
+                del self._schedules[name]
+
+        for profile in profiles:
+            if self._schedules.get(profile.name) == profile.schedule:
+                continue
+            self._schedules[profile.name] = profile.schedule
+            last = self._last_started.get(profile.name)
+            base = now if last is None else last + profile.schedule.every
+            self._next[profile.name] = base + self._jitter(profile.schedule)
+
+    def tick(self, now: float) -> list[str]:
+        """Start every profile that is due, within the concurrency limit.
+
+        Args:
+            now: The current ``time.monotonic`` value.
+
+        Returns:
+            Names of the profiles that were started.
+        """
+        started = []
+        with self._lock:
+            profiles = self.scheduled()
+            self._update_schedules(profiles, now)
+            for profile in sorted(profiles, key=lambda p: self._next[p.name]):
+                if self._next[profile.name] > now or profile.name in self._running:
+                    continue
+                if len(self._running) >= self.config.daemon.max_concurrent:
+                    break
+                targets = profile.targets
+                if any(targets & busy for busy in self._writing.values()):
+                    continue
+                self._writing[profile.name] = targets
+                thread = threading.Thread(
+                    target=self._run,
+                    args=(profile, now, self.throttle),
+                    name=f"kachi-daemon-{profile.name}",
+                )
+                self._running[profile.name] = thread
+                self._last_started[profile.name] = now
+                started.append(profile.name)
+                thread.start()
+        return started
+
+    def _run(self, profile: Profile, started: float, throttle: Throttle) -> None:
+        """Back up a profile and schedule its next run.
+
+        Args:
+            profile: The profile to back up.
+            started: ``time.monotonic`` value when the run was started.
+            throttle: Throttle enforcing the global rate limits.
+        """
+        logger.info(f"Starting scheduled backup of profile '{profile.name}'")
+        try:
+            self.run_profile(self.config, profile, throttle)
+        except Exception as e:
+            logger.error(f"Scheduled backup of profile '{profile.name}' failed: {e}")
+        finally:
+            with self._lock:
+                del self._running[profile.name]
+                del self._writing[profile.name]
+                schedule = self._schedules.get(profile.name)
+                if schedule is not None:
+                    self._next[profile.name] = (
+                        started + schedule.every + self._jitter(schedule)
+                    )
+            self._wake.set()
+
+    def next_due(self) -> float | None:
+        """Return when the next idle profile is due, if any is scheduled.
+
+        Returns:
+            A ``time.monotonic`` value, or ``None``.
+        """
+        with self._lock:
+            due = [t for name, t in self._next.items() if name not in self._running]
+        return min(due, default=None)
+
+    def running(self) -> list[str]:
+        """Return the names of the profiles currently being backed up."""
+        with self._lock:
+            return list(self._running)
+
+    def join(self) -> None:
+        """Wait for every running backup to finish."""
+        with self._lock:
+            threads = list(self._running.values())
+        for thread in threads:
+            thread.join()
+
+    def stop(self) -> None:
+        """Ask ``run_forever`` to return. Safe to call from signal handlers."""
+        self._stopping.set()
+        self._wake.set()
+
+    def run_forever(self, poll_seconds: float = POLL_SECONDS) -> None:
+        """Run scheduled profiles until ``stop`` is called.
+
+        Backups in progress are allowed to finish before returning.
+
+        Args:
+            poll_seconds: Longest time to sleep between checks for a
+                changed configuration.
+
+        Raises:
+            Exception: If the configuration cannot be parsed on startup.
+        """
+        while not self._stopping.is_set():
+            self.reload()
+            now = time.monotonic()
+            self.tick(now)
+            next_due = self.next_due()
+            # A profile that is due but was not started is waiting for a
+            # free slot; a finished backup wakes the loop early to start it.
+            if next_due is None or next_due <= now:
+                timeout = poll_seconds
+            else:
+                timeout = min(poll_seconds, next_due - now)
+            self._wake.wait(timeout)
+            self._wake.clear()
+        running = self.running()
+        if running:
+            logger.info(f"Waiting for {len(running)} running backups to finish...")
+        self.join()
@@ -0,0 +1,479 @@
+"""Content-defined chunking and a content-addressed chunk store.
+
+Files are split into chunks at positions chosen by their content rather
+than by offset, using a FastCDC-style gear hash, so inserting or removing
+bytes only changes the chunks around the edit. Each chunk is stored once,
+named by its SHA-256 digest, in a store at the root of the destination.
+In place of the file, the backup holds a small JSON recipe listing the
+chunks to join to get the file back.
+
+A chunk already in the store, whether written earlier in the same run or
+by a previous run, is never written again, so identical data across
+files, hosts and runs takes up space only once.
+"""
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+from collections import deque
+from collections.abc import Callable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from kachi.config import Dedup
+
+# Directory at the root of a destination holding the chunks.
+STORE_DIRNAME = ".kachi-chunks"
+
+# Suffix of the recipe written in place of each file.
+RECIPE_SUFFIX = ".kachi-recipe"
+
+RECIPE_VERSION = 1
+
+_MASK_64 = (1 << 64) - 1
+
+# Bytes hashed between reductions of the gear hash to 64 bits. Both masks
+# only test bits below 64, which the shifts and additions in between
+# never change, so the hash can grow past 64 bits for a while.
+_REDUCE_EVERY = 64
+
+# One pseudo-random 64-bit value per byte value. Derived from a hash so
+# every version of Kachi cuts the same data at the same places, which is
+# what lets chunks be shared across runs.
+_GEAR = tuple(
+    int.from_bytes(hashlib.sha256(bytes([b])).digest()[:8], "little")
+    for b in range(256)
+)
+
+
+@dataclass(frozen=True)
+class ChunkSizes:
+    """Chunk size limits and the hash masks that select cut points.
+
+    Attributes:
+        min: Bytes skipped before a cut point is considered.
+        avg: Target average chunk size.
+        max: Size at which a chunk is cut regardless of content.
+        mask_small: Mask tested before ``avg`` bytes. It has more bits
+            than the average calls for, making early cuts less likely.
+        mask_large: Mask tested after ``avg`` bytes. It has fewer bits,
+            making late cuts more likely. Together the two masks keep
+            chunk sizes close to the average.
+    """
+
+    min: int
+    avg: int
+    max: int
+    mask_small: int
+    mask_large: int
+
+    @classmethod
+    def for_average(cls, avg: int) -> "ChunkSizes":
+        """Return the limits for a target average chunk size.
+
+        Args:
+            avg: The average chunk size, a power of two.
+
+        Returns:
+            The chunk size limits.
+        """
+        bits = avg.bit_length() - 1
+
+        def top_bits(n: int) -> int:
+            # The high bits of the gear hash depend on the last 64 bytes,
+            # the low bits only on the last few.
+            return ((1 << n) - 1) << (64 - n)
+
+        return cls(avg // 4, avg, avg * 4, top_bits(bits + 2), top_bits(bits - 2))
+
+
+def cut_point(data: bytes, start: int, end: int, sizes: ChunkSizes) -> int:
+    """Find where the chunk starting at ``start`` ends.
+
+    Args:
+        data: Buffer holding the chunk.
+        start: Offset of the chunk in ``data``.
+        end: End of the data available in ``data``.
+        sizes: Chunk size limits.
+
+    Returns:
+        The offset just past the end of the chunk.
+    """
+    if end - start <= sizes.min:
+        return end
+    stop = min(end, start + sizes.max)
+    normal = min(stop, start + sizes.avg)
+    gear = _GEAR
+    view = memoryview(data)
+    h = 0
+
+    i = start + sizes.min
+    for mask, limit in ((sizes.mask_small, normal), (sizes.mask_large, stop)):
+        while i < limit:
+            for byte in view[i : min(limit, i + _REDUCE_EVERY)]:
+                h = (h << 1) + gear[byte]
+                i += 1
+                if not h & mask:
+                    return i
+            h &= _MASK_64
+    return stop
+
+
+def iter_chunks(f, sizes: ChunkSizes) -> Iterator[bytes]:
+    """Split a file into content-defined chunks.
+
+    Args:
+        f: A file opened for reading in binary mode.
+        sizes: Chunk size limits.
+
+    Yields:
+        The file's chunks, in order.
+    """
+    read_size = max(sizes.max * 4, 4 * 1024 * 1024)
+    buffer = b""
+    eof = False
+    while True:
+        if not eof and len(buffer) < sizes.max:
+            data = f.read(read_size)
+            eof = not data
+            buffer += data
+            continue
+        if not buffer:
+            return
+        pos = 0
+        # Only cut where a full-size chunk fits, unless the file has ended.
+        while pos < len(buffer) and (eof or len(buffer) - pos >= sizes.max):
+            end = cut_point(buffer, pos, len(buffer), sizes)
+            yield buffer[pos:end]
+            pos = end
+        buffer = buffer[pos:]
+
+
+def chunk_path(store: Path, digest: str) -> Path:
+    """Return where a chunk is kept in the store.
+
+    Args:
+        store: The chunk store directory.
+        digest: Hex SHA-256 digest of the chunk.
+
+    Returns:
+        The chunk's path, under a directory named by its first two digits.
+    """
+    return store / digest[:2] / digest
+
+
+def put_chunk(store: Path, digest: str, data: bytes, sync: bool = False) -> bool:
+    """Add a chunk to the store unless it is there already.
+
+    The chunk is written under a unique temporary name and linked into
+    place, so concurrent writers of the same chunk never see a partial
+    file and exactly one of them counts it as new. A stored chunk of the
+    wrong size, such as one cut short by a crash, is replaced rather than
+    trusted.
+
+    Args:
+        store: The chunk store directory.
+        digest: Hex SHA-256 digest of the chunk.
+        data: The chunk's contents.
+        sync: Flush the chunk to disk before linking it into place.
+
+    Returns:
+        True if the chunk was written, False if it was already stored.
+    """
+    path = chunk_path(store, digest)
+    damaged = False
+    try:
+        if path.stat().st_size == len(data):
+            return False
+        damaged = True
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{digest}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            if hasattr(os, "fdatasync"):
+                os.fdatasync(f.fileno())
+            else:
+                os.fsync(f.fileno())
+    try:
+        if damaged:
+            os.replace(tmp, path)
+            return True
+        os.link(tmp, path)
+    except FileExistsError:
+        return False
+    except OSError:
+        # File systems without hard links; the rename is still atomic.
+        os.replace(tmp, path)
+        return True
+    finally:
+        tmp.unlink(missing_ok=True)
+    return True
+
+
+def store_file(
+    src: str, recipe: str, store: str, chunk_size: int, sync: bool = False
+) -> tuple[int, int, int, int, float]:
+    """Store a file's chunks and write its recipe. Runs in a worker process.
+
+    Args:
+        src: Source file path.
+        recipe: Path of the recipe to write.
+        store: The chunk store directory.
+        chunk_size: Average chunk size.
+        sync: Flush each new chunk to disk before it is added to the store.
+
+    Returns:
+        A tuple containing:
+        - Size of the file in bytes.
+        - Number of chunks in the file.
+        - Number of those chunks that were new to the store.
+        - Bytes of new chunk data written.
+        - CPU seconds spent chunking and hashing.
+    """
+    start = time.process_time()
+    sizes = ChunkSizes.for_average(chunk_size)
+    store_path = Path(store)
+    chunks = []
+    size = new_chunks = new_bytes = 0
+    with open(src, "rb") as f:
+        for data in iter_chunks(f, sizes):
+            digest = hashlib.sha256(data).hexdigest()
+            if put_chunk(store_path, digest, data, sync):
+                new_chunks += 1
+                new_bytes += len(data)
+            chunks.append([digest, len(data)])
+            size += len(data)
+
+    with open(recipe, "w", encoding="utf8") as f:
+        json.dump({"version": RECIPE_VERSION, "size": size, "chunks": chunks}, f)
+    shutil.copystat(src, recipe)
+    cpu_seconds = time.process_time() - start
+    return size, len(chunks), new_chunks, new_bytes, cpu_seconds
+
+
+def find_store(path: Path) -> Path | None:
+    """Locate the chunk store a recipe belongs to.
+
+    Args:
+        path: A recipe, or a directory inside a deduplicated backup.
+
+    Returns:
+        The nearest store in ``path`` or one of its parents, or ``None``.
+    """
+    for parent in [path, *path.parents]:
+        candidate = parent / STORE_DIRNAME
+        if candidate.is_dir():
+            return candidate
+    return None
+
+
+def restore_file(recipe: Path, dst: Path, store: Path | None = None) -> int:
+    """Rebuild a file from its recipe, preserving its metadata.
+
+    Args:
+        recipe: The recipe to read.
+        dst: Path of the file to write.
+        store: The chunk store. Found from the recipe's location if omitted.
+
+    Returns:
+        The number of bytes written.
+
+    Raises:
+        FileNotFoundError: If no store is found or a chunk is missing.
+        ValueError: If the recipe is not valid or a chunk is corrupt.
+    """
+    store = store or find_store(recipe.parent)
+    if store is None:
+        raise FileNotFoundError(f"No {STORE_DIRNAME} directory found for {recipe}")
+    try:
+        contents = json.loads(recipe.read_text(encoding="utf8"))
+    except ValueError as e:
+        raise ValueError(f"Invalid recipe {recipe}: {e}") from e
+    chunks = contents.get("chunks") if isinstance(contents, dict) else None
+    if not isinstance(chunks, list):
+        raise ValueError(f"Invalid recipe {recipe}: no chunk list")
+
+    written = 0
+    with open(dst, "wb") as f:
+        for digest, length in chunks:
+            data = chunk_path(store, digest).read_bytes()
+            if len(data) != length or hashlib.sha256(data).hexdigest() != digest:
+                raise ValueError(f"Corrupt chunk {digest} in {recipe}")
+            written += f.write(data)
+    shutil.copystat(recipe, dst)
+    return written
+
+
+def restore_tree(src: Path, dest: Path) -> tuple[int, int]:
+    """Rebuild every file of a deduplicated backup.
+
+    Recipes are restored under their original names; other files are
+    copied as they are.
+
+    Args:
+        src: A backed-up file or directory.
+        dest: Directory to restore into.
+
+    Returns:
+        The number of files and bytes restored.
+
+    Raises:
+        FileNotFoundError: If ``src`` is not inside a deduplicated backup.
+    """
+    store = find_store(src if src.is_dir() else src.parent)
+    if store is None:
+        raise FileNotFoundError(f"No {STORE_DIRNAME} directory found for {src}")
+
+    files = total = 0
+    pairs = [(src, dest / src.name)] if src.is_file() else []
+    if src.is_dir():
+        for root, dirs, names in os.walk(src):
+            dirs[:] = [d for d in dirs if d != STORE_DIRNAME]
+            target = dest / Path(root).relative_to(src.parent)
+            pairs.extend((Path(root) / name, target / name) for name in names)
+
+    for path, target in pairs:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if path.name.endswith(RECIPE_SUFFIX):
+            target = target.with_name(path.name.removesuffix(RECIPE_SUFFIX))
+            total += restore_file(path, target, store)
+        else:
+            shutil.copy2(path, target)
+            total += path.stat().st_size
+        files += 1
+    return files, total
+
+
+@dataclass
+class DedupStats:
+    """Totals for the files handled by a Deduplicator.
+
+    Attributes:
+        files: Number of files stored as chunks.
+        bytes_in: Size of those files.
+        chunks: Number of chunks they were split into.
+        new_chunks: Chunks that were not in the store yet.
+        bytes_stored: Size of the new chunks.
+        cpu_seconds: CPU time spent chunking, summed over workers.
+    """
+
+    files: int = 0
+    bytes_in: int = 0
+    chunks: int = 0
+    new_chunks: int = 0
+    bytes_stored: int = 0
+    cpu_seconds: float = 0.0
+
+    def merge(self, other: "DedupStats") -> None:
+        """Add the totals of another deduplicator to these.
+
+        Args:
+            other: The statistics to add.
+        """
+        self.files += other.files
+        self.bytes_in += other.bytes_in
+        self.chunks += other.chunks
+        self.new_chunks += other.new_chunks
+        self.bytes_stored += other.bytes_stored
+        self.cpu_seconds += other.cpu_seconds
+
+    @property
+    def ratio(self) -> float:
+        """Size of the files per byte of new chunk data stored."""
+        if not self.bytes_stored:
+            return math.inf if self.bytes_in else 1.0
+        return self.bytes_in / self.bytes_stored
+
+
+class Deduplicator:
+    """Chunk and store files on a pool of worker processes.
+
+    At most a few files per worker are in flight at once, so memory use
+    does not grow with the number of files in a run.
+    """
+
+    def __init__(
+        self,
+        settings: Dedup,
+        store: Path,
+        on_done: Callable[[str, str, str, int, Exception | None], None],
+        durable: bool = False,
+    ):
+        """Initialize the deduplicator. The pool is started on first use.
+
+        Args:
+            settings: The profile's dedup settings.
+            store: The chunk store directory.
+            on_done: Called in the submitting thread once a file has been
+                stored, with the source path, the path written, the final
+                recipe path, the bytes of new chunk data and the error, if
+                any.
+            durable: Flush new chunks to disk before adding them to the
+                store, so a crash cannot leave a damaged chunk that other
+                recipes refer to.
+        """
+        self.settings = settings
+        self.store = store
+        self.durable = durable
+        self.stats = DedupStats()
+        self._on_done = on_done
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: deque[tuple[str, str, str, Future]] = deque()
+        self._max_pending = 4 * (settings.workers or os.cpu_count() or 1)
+
+    def submit(self, src, write_path: str, final_path: str) -> None:
+        """Queue a file to be chunked.
+
+        Blocks until an earlier file finishes when too many are in flight.
+
+        Args:
+            src: Source file path.
+            write_path: Path the worker writes the recipe to.
+            final_path: Path the recipe ends up at. Differs from
+                ``write_path`` when it is renamed into place afterwards.
+        """
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.settings.workers)
+        future = self._pool.submit(
+            store_file,
+            str(src),
+            write_path,
+            str(self.store),
+            self.settings.chunk_size,
+            self.durable,
+        )
+        self._pending.append((str(src), write_path, final_path, future))
+        while len(self._pending) > self._max_pending:
+            self._finish_oldest()
+
+    def drain(self) -> None:
+        """Wait for every pending file and shut the pool down."""
+        while self._pending:
+            self._finish_oldest()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _finish_oldest(self) -> None:
+        """Wait for the oldest pending file and report its result."""
+        src, write_path, final_path, future = self._pending.popleft()
+        try:
+            size, chunks, new_chunks, new_bytes, cpu_seconds = future.result()
+        except Exception as e:
+            Path(write_path).unlink(missing_ok=True)
+            self._on_done(src, write_path, final_path, 0, e)
+            return
+        self.stats.files += 1
+        self.stats.bytes_in += size
+        self.stats.chunks += chunks
+        self.stats.new_chunks += new_chunks
+        self.stats.bytes_stored += new_bytes
+        self.stats.cpu_seconds += cpu_seconds
+        self._on_done(src, write_path, final_path, new_bytes, None)
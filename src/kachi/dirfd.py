@@ -0,0 +1,315 @@
+"""Directory tree copies relative to open directory file descriptors.
+
+``shutil.copytree`` hands full paths to every call, so the kernel
+resolves each component of the source and destination paths again for
+every ``open``, ``stat``, ``mkdir`` and ``utime``. On deep trees of small
+files that lookup, and the ``Path`` objects built for it, costs more than
+copying the data. Here the source and destination directories stay open
+while their contents are copied and every call is made relative to them,
+so only the final name is resolved.
+
+Two descriptors are held per directory level, so the depth of a tree is
+limited by the process's open file limit rather than by path length.
+"""
+
+import errno
+import os
+import shutil
+import stat
+from collections.abc import Callable
+
+# Largest number of bytes requested from a single copy_file_range call.
+_COPY_RANGE_MAX = 1 << 30
+
+# Size of the buffer used when the kernel cannot copy between the files.
+_BUFFER_SIZE = 1024 * 1024
+
+_DIR_FLAGS = os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+_READ_FLAGS = os.O_RDONLY | getattr(os, "O_CLOEXEC", 0)
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_CLOEXEC", 0)
+
+# Whether the platform can open, stat, create and touch files relative to
+# a directory descriptor. Windows cannot, and falls back to full paths.
+HAVE_DIR_FD = (
+    hasattr(os, "O_DIRECTORY")
+    and {os.open, os.stat, os.mkdir, os.unlink, os.utime} <= os.supports_dir_fd
+    and os.utime in os.supports_fd
+)
+
+# Copy errors collected while walking, as ``(src, dst, reason)`` tuples.
+CopyErrors = list[tuple[str, str, str]]
+
+# Copies one file: (src_dir_fd, dst_dir_fd, name, src, dst, st).
+CopyAtFunction = Callable[[int, int, str, str, str, os.stat_result], object]
+
+# Told about entries that failed outside the copy function: (src, dst, reason).
+ErrorFunction = Callable[[str, str, str], object]
+
+
+def _copy_data(fsrc: int, fdst: int, size: int) -> None:
+    """Copy the contents of one open file to another.
+
+    Uses ``copy_file_range`` where available so the data does not pass
+    through user space, and a read/write loop otherwise. Some file
+    systems, such as procfs, sysfs and some FUSE and overlay mounts,
+    report end of file to ``copy_file_range`` before their real end, so
+    the loop also picks up whatever it did not copy.
+
+    Args:
+        fsrc: Descriptor of the source, positioned at its start.
+        fdst: Descriptor of the empty destination.
+        size: Size of the source according to ``stat``.
+    """
+    if hasattr(os, "copy_file_range"):
+        copied = 0
+        try:
+            while n := os.copy_file_range(fsrc, fdst, _COPY_RANGE_MAX):
+                copied += n
+            if copied and copied >= size:
+                return
+        except OSError as e:
+            # Some file systems and kernels refuse the call outright;
+            # anything else, or a failure partway through, is a real error.
+            if copied or e.errno not in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+            ):
+                raise
+
+    # Both offsets have advanced past anything already copied.
+    while chunk := os.read(fsrc, _BUFFER_SIZE):
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(fdst, view) :]
+
+
+def break_link(name: str | os.PathLike, dir_fd: int | None = None) -> None:
+    """Remove a file that is hard linked elsewhere before it is rewritten.
+
+    Copies write into an existing destination file in place. When that
+    file is a hard link, e.g. one made for an identical file, writing
+    through it would change the other copies too.
+
+    Args:
+        name: The destination path, relative to ``dir_fd`` if given.
+        dir_fd: Descriptor of the directory holding the file.
+    """
+    try:
+        st = os.stat(name, dir_fd=dir_fd, follow_symlinks=False)
+    except FileNotFoundError:
+        return
+    if st.st_nlink > 1 and stat.S_ISREG(st.st_mode):
+        os.unlink(name, dir_fd=dir_fd)
+
+
+def _copy_xattrs(fsrc: int, fdst: int) -> None:
+    """Copy the extended attributes of one open file to another.
+
+    Follows ``shutil._copyxattr``: attributes the destination's file
+    system does not support, or that the process may not set, are skipped.
+
+    Args:
+        fsrc: Descriptor of the source.
+        fdst: Descriptor of the destination.
+    """
+    try:
+        names = os.listxattr(fsrc)
+    except OSError as e:
+        if e.errno not in (errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+            raise
+        return
+    for name in names:
+        try:
+            os.setxattr(fdst, name, os.getxattr(fsrc, name))
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+                raise
+
+
+def copy_at(src_dir_fd: int, dst_dir_fd: int, name: str, st: os.stat_result) -> None:
+    """Copy a file between two open directories, preserving metadata.
+
+    Like ``shutil.copy2`` the permission bits, access time, modification
+    time and, where the platform has them, extended attributes are copied.
+
+    Args:
+        src_dir_fd: Descriptor of the directory holding the source.
+        dst_dir_fd: Descriptor of the directory to write the copy to.
+        name: Name of the file in both directories.
+        st: ``stat`` result of the source.
+    """
+    fsrc = os.open(name, _READ_FLAGS, dir_fd=src_dir_fd)
+    try:
+        break_link(name, dst_dir_fd)
+        fdst = os.open(name, _WRITE_FLAGS, 0o666, dir_fd=dst_dir_fd)
+        try:
+            _copy_data(fsrc, fdst, st.st_size)
+            if hasattr(os, "listxattr"):
+                # Before the mode, which may make the copy read-only.
+                _copy_xattrs(fsrc, fdst)
+            os.chmod(fdst, stat.S_IMODE(st.st_mode))
+            os.utime(fdst, ns=(st.st_atime_ns, st.st_mtime_ns))
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+
+
+def _copy_dir_stat(src_fd: int, dst_fd: int) -> None:
+    """Copy the permission bits and times of an open directory.
+
+    Args:
+        src_fd: Descriptor of the source directory.
+        dst_fd: Descriptor of the destination directory.
+    """
+    st = os.fstat(src_fd)
+    os.chmod(dst_fd, stat.S_IMODE(st.st_mode))
+    os.utime(dst_fd, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def _record(
+    errors: CopyErrors,
+    on_error: ErrorFunction | None,
+    src: str,
+    dst: str,
+    reason: str,
+) -> None:
+    """Record an entry that failed before reaching the copy function.
+
+    Args:
+        errors: List the error is appended to.
+        on_error: Called with the error as well, if given.
+        src: Source path of the entry.
+        dst: Destination path of the entry.
+        reason: Why it failed.
+    """
+    errors.append((src, dst, reason))
+    if on_error is not None:
+        on_error(src, dst, reason)
+
+
+def _copy_dir(
+    src_fd: int,
+    dst_fd: int,
+    src: str,
+    dst: str,
+    copy_function: CopyAtFunction,
+    errors: CopyErrors,
+    on_error: ErrorFunction | None,
+) -> None:
+    """Copy the contents of one open directory into another.
+
+    Args:
+        src_fd: Descriptor of the source directory.
+        dst_fd: Descriptor of the destination directory.
+        src: Path of the source directory, used in errors and events.
+        dst: Path of the destination directory, used in errors and events.
+        copy_function: Copies a single file.
+        errors: List the errors are appended to.
+        on_error: Called for errors not raised by ``copy_function``.
+    """
+    with os.scandir(src_fd) as it:
+        entries = list(it)
+
+    subdirs = []
+    for entry in entries:
+        src_path = os.path.join(src, entry.name)
+        dst_path = os.path.join(dst, entry.name)
+        try:
+            # Symbolic links are followed, as shutil.copytree does by default.
+            st = entry.stat()
+        except OSError as e:
+            _record(errors, on_error, src_path, dst_path, str(e))
+            continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(entry.name)
+        elif stat.S_ISREG(st.st_mode):
+            try:
+                copy_function(src_fd, dst_fd, entry.name, src_path, dst_path, st)
+            except OSError as e:
+                # The copy function reports its own failures.
+                errors.append((src_path, dst_path, str(e)))
+        else:
+            # Opening a FIFO would block until a writer appears.
+            reason = f"{src_path} is not a regular file"
+            _record(errors, on_error, src_path, dst_path, reason)
+
+    for name in subdirs:
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        try:
+            try:
+                os.mkdir(name, dir_fd=dst_fd)
+            except FileExistsError:
+                pass
+            child_src = os.open(name, _DIR_FLAGS, dir_fd=src_fd)
+            try:
+                child_dst = os.open(name, _DIR_FLAGS, dir_fd=dst_fd)
+                try:
+                    _copy_dir(
+                        child_src,
+                        child_dst,
+                        src_path,
+                        dst_path,
+                        copy_function,
+                        errors,
+                        on_error,
+                    )
+                    # After the contents, so a read-only mode or the
+                    # writes themselves do not get in the way.
+                    _copy_dir_stat(child_src, child_dst)
+                finally:
+                    os.close(child_dst)
+            finally:
+                os.close(child_src)
+        except OSError as e:
+            _record(errors, on_error, src_path, dst_path, str(e))
+
+
+def copy_tree_at(
+    src: os.PathLike,
+    dest: os.PathLike,
+    copy_function: CopyAtFunction,
+    on_error: ErrorFunction | None = None,
+) -> None:
+    """Recursively copy a directory tree, like ``shutil.copytree``.
+
+    Existing files in ``dest`` are overwritten and directories merged, as
+    with ``dirs_exist_ok=True``.
+
+    Args:
+        src: The directory to copy.
+        dest: The directory to copy it to. Created if missing.
+        copy_function: Called as ``copy_function(src_dir_fd, dst_dir_fd,
+            name, src, dst, st)`` for each file, where ``src`` and ``dst``
+            are the file's full paths and ``st`` its ``stat`` result.
+        on_error: Called as ``on_error(src, dst, reason)`` for entries that
+            fail outside ``copy_function``, such as broken symbolic links,
+            special files and directories that cannot be opened.
+
+    Raises:
+        FileNotFoundError: If ``src`` does not exist.
+        PermissionError: If ``src`` or ``dest`` cannot be opened.
+        shutil.Error: If any file or subdirectory could not be copied,
+            after copying everything else.
+    """
+    src, dest = os.fspath(src), os.fspath(dest)
+    errors: CopyErrors = []
+    src_fd = os.open(src, _DIR_FLAGS)
+    try:
+        os.makedirs(dest, exist_ok=True)
+        dst_fd = os.open(dest, _DIR_FLAGS)
+        try:
+            _copy_dir(src_fd, dst_fd, src, dest, copy_function, errors, on_error)
+            try:
+                _copy_dir_stat(src_fd, dst_fd)
+            except OSError as e:
+                _record(errors, on_error, src, dest, str(e))
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    if errors:
+        raise shutil.Error(errors)
@@ -0,0 +1,733 @@
+"""Copy engine used by Kachi backup operations."""
+
+import errno
+import os
+import shutil
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from kachi.cache import copy_uncached
+from kachi.compression import SUFFIXES, Compressor
+from kachi.config import Compression, Dedup, DropCache, FastScan, Limits
+from kachi.dedup import RECIPE_SUFFIX, Deduplicator
+from kachi.dirfd import break_link, copy_at
+from kachi.events import FileCopied, FileEvent, FileFailed
+from kachi.links import DuplicateIndex
+
+# Size of the buffer used when a file has to be copied chunk by chunk.
+CHUNK_SIZE = 1024 * 1024
+
+# Durable writes are committed once a batch reaches either limit.
+DURABLE_BATCH_FILES = 256
+DURABLE_BATCH_BYTES = 256 * 1024 * 1024
+
+TEMP_SUFFIX = ".kachi-tmp"
+
+
+class RateLimiter:
+    """A thread-safe token bucket.
+
+    Tokens refill continuously at ``rate`` per second up to ``capacity``.
+    Consuming more tokens than are available puts the bucket into debt and
+    the caller sleeps until the debt is paid off, so large requests never
+    have to be split up to fit the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        """Initialize a full bucket.
+
+        Args:
+            rate: Tokens added per second.
+            capacity: Maximum number of tokens the bucket holds. Defaults
+                to one second's worth of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: float) -> float:
+        """Take tokens from the bucket, sleeping if the rate is exceeded.
+
+        Args:
+            amount: Number of tokens to take.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class Throttle:
+    """Byte and file rate limiters built from a Limits configuration."""
+
+    def __init__(self, limits: Limits):
+        """Initialize the limiters that are configured in ``limits``.
+
+        Args:
+            limits: The limits to enforce.
+        """
+        self.limits = limits
+        self.bytes = (
+            RateLimiter(limits.bytes_per_second) if limits.bytes_per_second else None
+        )
+        self.files = (
+            RateLimiter(limits.files_per_second, capacity=1.0)
+            if limits.files_per_second
+            else None
+        )
+
+
+def is_sparse(st: os.stat_result) -> bool:
+    """Whether a file has holes that a plain copy would fill in.
+
+    Args:
+        st: ``stat`` result of the file.
+
+    Returns:
+        True if the file allocates fewer blocks than its size requires and
+        the platform can locate its data extents.
+    """
+    blocks = getattr(st, "st_blocks", None)
+    return hasattr(os, "SEEK_DATA") and blocks is not None and blocks * 512 < st.st_size
+
+
+def data_extents(fd: int, size: int) -> Iterator[tuple[int, int]]:
+    """Yield the regions of a sparse file that contain data.
+
+    Uses ``SEEK_DATA``/``SEEK_HOLE``; on file systems without hole
+    detection the whole file is reported as a single extent.
+
+    Args:
+        fd: An open file descriptor for the file.
+        size: Size of the file in bytes.
+
+    Yields:
+        ``(offset, length)`` tuples for each data extent.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a trailing hole remains.
+                return
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        if end > start:
+            yield start, end - start
+        offset = end
+
+
+def temp_path(dst: str | os.PathLike) -> str:
+    """Return the temporary name a file is written to before its rename.
+
+    The name is hidden and fixed per destination, so a temporary file left
+    behind by a crash is overwritten by the next run.
+
+    Args:
+        dst: Final destination path.
+
+    Returns:
+        The temporary path in the same directory.
+    """
+    path = Path(dst)
+    return str(path.with_name(f".{path.name}{TEMP_SUFFIX}"))
+
+
+def _fsync_file(path: str) -> None:
+    """Flush a file's data to disk.
+
+    On macOS ``fsync`` only hands the data to the drive, so ``F_FULLFSYNC``
+    is used there to flush the drive's cache too.
+
+    Args:
+        path: The file to flush.
+    """
+    # Windows only flushes handles opened for writing.
+    fd = os.open(path, os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+    try:
+        if sys.platform == "darwin":
+            import fcntl
+
+            fcntl.fcntl(fd, fcntl.F_FULLFSYNC)
+        elif hasattr(os, "fdatasync"):
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_dir(path: Path) -> None:
+    """Flush a directory entry to disk so renames inside it are durable.
+
+    Directories cannot be opened for syncing on Windows, where this is a
+    no-op.
+
+    Args:
+        path: The directory to flush.
+    """
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DurableBatch:
+    """Commit files written under temporary names in crash-safe batches.
+
+    Committing flushes the data of every pending file, renames each one
+    into place, then flushes each affected directory once. Only the
+    pending files are flushed, so other programs' writes to the same
+    file systems are left alone.
+    """
+
+    def __init__(
+        self,
+        max_files: int = DURABLE_BATCH_FILES,
+        max_bytes: int = DURABLE_BATCH_BYTES,
+    ):
+        """Initialize an empty batch.
+
+        Args:
+            max_files: Number of pending files that fills the batch.
+            max_bytes: Number of pending bytes that fills the batch.
+        """
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._pending: list[tuple[str, str]] = []
+        self._bytes = 0
+
+    def add(self, tmp: str, dst: str, size: int) -> bool:
+        """Add a fully written temporary file to the batch.
+
+        Args:
+            tmp: The temporary path the data was written to.
+            dst: The final path to rename it to.
+            size: Size of the file in bytes.
+
+        Returns:
+            True if the batch is full and should be committed.
+        """
+        self._pending.append((tmp, dst))
+        self._bytes += size
+        return len(self._pending) >= self.max_files or self._bytes >= self.max_bytes
+
+    def commit(self) -> None:
+        """Flush, rename and sync every pending file.
+
+        Raises:
+            OSError: If a file could not be flushed or renamed. Temporary
+                files that were not renamed are removed.
+        """
+        pending, self._pending, self._bytes = self._pending, [], 0
+        if not pending:
+            return
+
+        directories = set()
+        try:
+            for tmp, _ in pending:
+                _fsync_file(tmp)
+            while pending:
+                tmp, dst = pending[0]
+                os.replace(tmp, dst)
+                directories.add(Path(dst).parent)
+                pending.pop(0)
+        finally:
+            for tmp, _ in pending:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+        for directory in directories:
+            _fsync_dir(directory)
+
+
+@dataclass
+class TransferStats:
+    """Running totals for the data copied by a CopyEngine.
+
+    Attributes:
+        files: Number of files copied.
+        bytes: Logical size of the files copied.
+        physical_bytes: Bytes actually written. Lower than ``bytes`` when
+            holes in sparse files were skipped or files were linked.
+        throttled_seconds: Time spent waiting on rate limits.
+        linked_files: Files written as hard links to an identical copy.
+        linked_bytes: Size of the linked files, which was not written.
+        uncached_bytes: Bytes copied without leaving them in the page
+            cache.
+    """
+
+    files: int = 0
+    bytes: int = 0
+    physical_bytes: int = 0
+    throttled_seconds: float = 0.0
+    linked_files: int = 0
+    linked_bytes: int = 0
+    uncached_bytes: int = 0
+
+    def merge(self, other: "TransferStats") -> None:
+        """Add the totals of another run to these.
+
+        Args:
+            other: The statistics to add.
+        """
+        self.files += other.files
+        self.bytes += other.bytes
+        self.physical_bytes += other.physical_bytes
+        self.throttled_seconds += other.throttled_seconds
+        self.linked_files += other.linked_files
+        self.linked_bytes += other.linked_bytes
+        self.uncached_bytes += other.uncached_bytes
+
+
+@dataclass
+class SourceStats:
+    """Time taken and data copied for one source of a profile.
+
+    Attributes:
+        seconds: Wall-clock time spent copying the source. Compression and
+            dedup finishing in the background afterwards is not included.
+        files: Number of files copied.
+        bytes: Logical size of the files copied.
+    """
+
+    seconds: float = 0.0
+    files: int = 0
+    bytes: int = 0
+
+
+class CopyEngine:
+    """Copy individual files and record what was transferred.
+
+    Set ``listener`` to a callable to receive a ``FileEvent`` for every
+    file the engine copies or fails to copy. Set ``links`` to an index of
+    identical source files to hard link each duplicate to the first copy
+    of its content instead of writing it again.
+    """
+
+    def __init__(
+        self,
+        throttles: list[Throttle] | None = None,
+        durable: bool = False,
+        compression: Compression | None = None,
+        fast_scan: FastScan | None = None,
+        scan_dir: Path | None = None,
+        dedup: Dedup | None = None,
+        chunk_store: Path | None = None,
+        drop_cache: DropCache | None = None,
+    ):
+        """Initialize the engine with empty transfer statistics.
+
+        Args:
+            throttles: Rate limits to apply to every copy. A file is only
+                written as fast as the strictest throttle allows. Throttles
+                may be shared between engines to enforce a global limit.
+            durable: Write files under a temporary name and rename them into
+                place in batches, and flush new dedup chunks to disk.
+                ``flush`` must be called once copying is done to commit the
+                final batch.
+            compression: Write compressed copies using a pool of worker
+                processes. ``flush`` must be called once copying is done
+                to wait for the remaining files.
+            fast_scan: Skip listing directories that have not changed since
+                the previous run when copying directory trees.
+            scan_dir: Directory holding the state fast scans compare
+                against. Fast scans are only used when it is set.
+            dedup: Store files as content-defined chunks plus a recipe,
+                using a pool of worker processes. Takes precedence over
+                compression. ``flush`` must be called once copying is done
+                to wait for the remaining files.
+            chunk_store: Directory holding the chunks. Deduplication is
+                only used when it is set.
+            drop_cache: Drop copied data from the page cache as each chunk
+                is written, so a backup does not evict the data running
+                programs rely on.
+        """
+        self.stats = TransferStats()
+        self.sources: dict[Path, SourceStats] = {}
+        self.fast_scan = fast_scan if scan_dir is not None else None
+        self.scan_dir = scan_dir
+        self.throttles = throttles or []
+        self.batch = DurableBatch() if durable else None
+        self.drop_cache = drop_cache
+        self.compressor = (
+            Compressor(compression, self._worker_done) if compression else None
+        )
+        self.deduplicator = (
+            Deduplicator(dedup, chunk_store, self._worker_done, durable)
+            if dedup and chunk_store is not None
+            else None
+        )
+        self._errors: list[tuple[str, str, str]] = []
+        self._submitted: dict[str, tuple[int, float]] = {}
+        self.listener: Callable[[FileEvent], None] | None = None
+        self.links: DuplicateIndex | None = None
+        self._byte_limiters = [t.bytes for t in self.throttles if t.bytes]
+        self._file_limiters = [t.files for t in self.throttles if t.files]
+
+    def wait_for_file(self) -> None:
+        """Wait until the file rate limits allow another file to be copied."""
+        for limiter in self._file_limiters:
+            self.stats.throttled_seconds += limiter.consume(1)
+
+    def wait_for_bytes(self, amount: int) -> None:
+        """Wait until the byte rate limits allow ``amount`` more bytes.
+
+        Args:
+            amount: Number of bytes about to be written.
+        """
+        for limiter in self._byte_limiters:
+            self.stats.throttled_seconds += limiter.consume(amount)
+
+    @property
+    def throttles_bytes(self) -> bool:
+        """Whether any byte rate limit applies to this engine."""
+        return bool(self._byte_limiters)
+
+    def copy_file(self, src, dst):
+        """Copy a single file, preserving metadata.
+
+        The signature matches ``shutil.copy2`` so the method can be used as
+        the ``copy_function`` of ``shutil.copytree``.
+
+        Args:
+            src: Source file path.
+            dst: Destination file path. When a byte rate limit is set or
+                durable writes are enabled, this must be the full path of
+                the file to write.
+
+        Returns:
+            The path of the written file.
+        """
+        self.wait_for_file()
+        started = time.perf_counter()
+
+        try:
+            st = os.stat(src)
+            if self.deduplicator:
+                return self._submit_deduped(src, dst, st, started)
+            if self.compressor:
+                choice = self.compressor.choose(src)
+                if choice is not None:
+                    return self._submit_compressed(src, dst, st, started, *choice)
+
+            group = self.links.group_of(st) if self.links is not None else None
+            first = self.links.first_copy(group) if group is not None else None
+            if first is not None:
+                linked = self._link_duplicate(src, dst, st, started, first)
+                if linked is not None:
+                    return linked
+
+            sparse = is_sparse(st)
+            target = temp_path(dst) if self.batch else dst
+            try:
+                if not self.batch:
+                    # Never write through a link into another file's copy.
+                    break_link(target)
+                if self.drop_cache and not sparse:
+                    # Rate limits are applied chunk by chunk here too.
+                    written_bytes = self._copy_uncached(src, target, st)
+                    written = target
+                elif sparse or self.throttles_bytes:
+                    written_bytes = self._copy_chunked(src, target, st, sparse)
+                    written = target
+                else:
+                    written = shutil.copy2(src, target)
+                    written_bytes = st.st_size
+            except OSError:
+                if self.batch:
+                    Path(target).unlink(missing_ok=True)
+                raise
+        except OSError as e:
+            self.emit(FileFailed(Path(src), Path(dst), str(e)))
+            raise
+        self.stats.files += 1
+        self.stats.bytes += st.st_size
+        self.stats.physical_bytes += written_bytes
+        if group is not None:
+            self.links.add_copy(group, os.fspath(target), os.fspath(dst))
+
+        if self.batch:
+            written = os.fspath(dst)
+            if self.batch.add(target, written, written_bytes):
+                self.batch.commit()
+        self.emit(
+            FileCopied(
+                Path(src), Path(written), st.st_size, time.perf_counter() - started
+            )
+        )
+        return written
+
+    def copy_file_at(
+        self,
+        src_dir_fd: int,
+        dst_dir_fd: int,
+        name: str,
+        src: str,
+        dst: str,
+        st: os.stat_result,
+    ):
+        """Copy a file named relative to open source and destination directories.
+
+        Used as the ``copy_function`` of ``copy_tree_at``. Files that need
+        linking, deduplication, compression, durable writes, byte rate limits,
+        hole detection or cache dropping are copied by ``copy_file`` using
+        their full paths instead.
+
+        Args:
+            src_dir_fd: Descriptor of the directory holding the source.
+            dst_dir_fd: Descriptor of the directory to write the copy to.
+            name: Name of the file in both directories.
+            src: Full source path, used for fallbacks and events.
+            dst: Full destination path, used for fallbacks and events.
+            st: ``stat`` result of the source.
+
+        Returns:
+            The path of the written file.
+        """
+        if (
+            self.links is not None
+            or self.deduplicator
+            or self.compressor
+            or self.batch
+            or self.throttles_bytes
+            or self.drop_cache
+            or is_sparse(st)
+        ):
+            return self.copy_file(src, dst)
+
+        self.wait_for_file()
+        started = time.perf_counter()
+        try:
+            copy_at(src_dir_fd, dst_dir_fd, name, st)
+        except OSError as e:
+            self.emit(FileFailed(Path(src), Path(dst), str(e)))
+            raise
+        self.stats.files += 1
+        self.stats.bytes += st.st_size
+        self.stats.physical_bytes += st.st_size
+        if self.listener is not None:
+            self.emit(
+                FileCopied(
+                    Path(src), Path(dst), st.st_size, time.perf_counter() - started
+                )
+            )
+        return dst
+
+    def _link_duplicate(
+        self, src, dst, st: os.stat_result, started: float, first: tuple[str, str]
+    ) -> str | None:
+        """Hard link a file to the copy already written of its content.
+
+        The link shares the first copy's permissions and times.
+
+        Args:
+            src: Source file path.
+            dst: Destination file path.
+            st: ``stat`` result of the source.
+            started: ``time.perf_counter`` value when the copy started.
+            first: The ``(written, final)`` paths of the first copy of the
+                source's content.
+
+        Returns:
+            The path of the link, or ``None`` if the file system refused
+            the link and the file should be copied instead.
+        """
+        first_written, first_final = first
+        # With durable writes the first copy may still be waiting under
+        # its temporary name.
+        source = first_written if Path(first_written).exists() else first_final
+        final = os.fspath(dst)
+        target = temp_path(final) if self.batch else final
+        try:
+            Path(target).unlink(missing_ok=True)
+            os.link(source, target)
+        except OSError:
+            return None
+
+        self.stats.files += 1
+        self.stats.bytes += st.st_size
+        self.stats.linked_files += 1
+        self.stats.linked_bytes += st.st_size
+        if self.batch and self.batch.add(target, final, 0):
+            self.batch.commit()
+        self.emit(
+            FileCopied(
+                Path(src), Path(final), st.st_size, time.perf_counter() - started
+            )
+        )
+        return final
+
+    def emit(self, event: FileEvent) -> None:
+        """Pass a per-file event to the listener, if there is one.
+
+        Args:
+            event: The event to report.
+        """
+        if self.listener is not None:
+            self.listener(event)
+
+    def flush(self) -> None:
+        """Finish compression and dedup and commit durable writes still pending.
+
+        Raises:
+            shutil.Error: If any file failed to compress or deduplicate.
+            OSError: If the pending durable writes could not be committed.
+        """
+        if self.deduplicator:
+            self.deduplicator.drain()
+        if self.compressor:
+            self.compressor.drain()
+        if self.batch:
+            self.batch.commit()
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise shutil.Error(errors)
+
+    def _submit_compressed(
+        self, src, dst, st: os.stat_result, started: float, codec, level
+    ) -> str:
+        """Queue a file for compression on the worker pool.
+
+        Args:
+            src: Source file path.
+            dst: Destination file path, without the compression suffix.
+            st: ``stat`` result of the source.
+            started: ``time.perf_counter`` value when the copy started.
+            codec: Codec chosen for the file.
+            level: Compression level chosen for the file.
+
+        Returns:
+            The path the compressed file will be written to.
+        """
+        self.wait_for_bytes(st.st_size)
+        final = f"{os.fspath(dst)}{SUFFIXES[codec]}"
+        write = temp_path(final) if self.batch else final
+        self.compressor.submit(src, write, final, codec, level)
+        self._submitted[final] = (st.st_size, started)
+        self.stats.files += 1
+        self.stats.bytes += st.st_size
+        return final
+
+    def _worker_done(
+        self, src: str, write: str, final: str, size: int, error: Exception | None
+    ) -> None:
+        """Record a file that a compression or dedup worker finished.
+
+        Args:
+            src: Source file path.
+            write: Path the worker wrote to.
+            final: Final path of the compressed file or recipe.
+            size: Bytes written to the destination.
+            error: The error raised by the worker, if any.
+        """
+        src_size, started = self._submitted.pop(final)
+        if error is not None:
+            self._errors.append((src, final, str(error)))
+            self.emit(FileFailed(Path(src), Path(final), str(error)))
+            return
+        self.emit(
+            FileCopied(Path(src), Path(final), src_size, time.perf_counter() - started)
+        )
+        self.stats.physical_bytes += size
+        if self.batch and self.batch.add(write, final, size):
+            self.batch.commit()
+
+    def _submit_deduped(self, src, dst, st: os.stat_result, started: float) -> str:
+        """Queue a file to be stored as chunks on the worker pool.
+
+        Args:
+            src: Source file path.
+            dst: Destination file path, without the recipe suffix.
+            st: ``stat`` result of the source.
+            started: ``time.perf_counter`` value when the copy started.
+
+        Returns:
+            The path the recipe will be written to.
+        """
+        self.wait_for_bytes(st.st_size)
+        final = f"{os.fspath(dst)}{RECIPE_SUFFIX}"
+        write = temp_path(final) if self.batch else final
+        self.deduplicator.submit(src, write, final)
+        self._submitted[final] = (st.st_size, started)
+        self.stats.files += 1
+        self.stats.bytes += st.st_size
+        return final
+
+    def _copy_chunked(self, src, dst, st: os.stat_result, sparse: bool) -> int:
+        """Copy a file chunk by chunk, honouring rate limits and holes.
+
+        For sparse sources only the data extents are written and the holes
+        are recreated by extending the destination to the source size.
+
+        Args:
+            src: Source file path.
+            dst: Destination file path.
+            st: ``stat`` result of the source.
+            sparse: Whether to copy only the source's data extents.
+
+        Returns:
+            The number of bytes written.
+        """
+        written = 0
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            if sparse:
+                for offset, length in data_extents(fsrc.fileno(), st.st_size):
+                    fsrc.seek(offset)
+                    fdst.seek(offset)
+                    while length > 0:
+                        chunk = fsrc.read(min(CHUNK_SIZE, length))
+                        if not chunk:
+                            break
+                        self.wait_for_bytes(len(chunk))
+                        written += fdst.write(chunk)
+                        length -= len(chunk)
+                fdst.truncate(st.st_size)
+            else:
+                while chunk := fsrc.read(CHUNK_SIZE):
+                    self.wait_for_bytes(len(chunk))
+                    written += fdst.write(chunk)
+        shutil.copystat(src, dst)
+        return written
+
+    def _copy_uncached(self, src, dst, st: os.stat_result) -> int:
+        """Copy a file without leaving its data in the page cache.
+
+        Args:
+            src: Source file path.
+            dst: Destination file path.
+            st: ``stat`` result of the source.
+
+        Returns:
+            The number of bytes written.
+        """
+        min_size = self.drop_cache.direct_io_min_size
+        direct = min_size is not None and st.st_size >= min_size
+        written = copy_uncached(src, dst, self.wait_for_bytes, direct=direct)
+        shutil.copystat(src, dst)
+        self.stats.uncached_bytes += written
+        return written
@@ -4,6 +4,13 @@ from pathlib import Path
 from typing import Protocol
 
 
+class DestinationError(Exception):
+    """Raised when a profile has no destination it can back up to.
+
+    The reason has already been logged by the time it is raised.
+    """
+
+
 class ErrorLogger(Protocol):
     """Protocol for logging errors."""
 
@@ -65,3 +72,24 @@ class BackupErrorHandler:
             destination: The invalid destination path.
         """
         self.logger.error(f"Destination is not a directory: {str(destination)}")
+
+    def handle_unreachable_server(self, destination, error: Exception) -> None:
+        """Handle a backup server that cannot be connected to.
+
+        Args:
+            destination: The unreachable server.
+            error: The error raised while connecting.
+        """
+        self.logger.error(f"Unable to connect to {str(destination)}: {str(error)}")
+
+    def handle_destination_errors(self, destination: Path, failed: int) -> None:
+        """Summarize the sources that failed for one of several destinations.
+
+        Args:
+            destination: The destination that had failures.
+            failed: Number of sources not fully backed up to it.
+        """
+        source_word = "source" if failed == 1 else "sources"
+        self.logger.warning(
+            f"{failed} {source_word} not fully backed up to {str(destination)}"
+        )
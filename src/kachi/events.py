@@ -0,0 +1,58 @@
+"""Per-file events reported while a backup runs.
+
+Copy engines pass one event per file to their listener, if they have one.
+The events are small and immutable so they can be handed between threads.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+
+
+@dataclass(frozen=True, slots=True)
+class FileCopied:
+    """A file was written to the destination.
+
+    Attributes:
+        src: The source file.
+        dst: The path of the copy.
+        bytes: Size of the source file.
+        seconds: Time taken to copy the file.
+    """
+
+    src: Path
+    dst: Path
+    bytes: int
+    seconds: float
+
+
+@dataclass(frozen=True, slots=True)
+class FileSkipped:
+    """A file was left alone because its copy is up to date.
+
+    Attributes:
+        src: The source file.
+        dst: The path of the existing copy.
+        bytes: Size of the source file.
+    """
+
+    src: Path
+    dst: Path
+    bytes: int
+
+
+@dataclass(frozen=True, slots=True)
+class FileFailed:
+    """A file could not be copied.
+
+    Attributes:
+        src: The source file.
+        dst: The path the copy was to be written to.
+        error: Description of the error.
+    """
+
+    src: Path
+    dst: Path
+    error: str
+
+
+FileEvent = FileCopied | FileSkipped | FileFailed
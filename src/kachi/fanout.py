@@ -0,0 +1,373 @@
+"""Write each source file to several backup destinations in one read.
+
+The reader walks a source once and hands every chunk it reads to one
+writer thread per destination. Each writer has its own bounded queue and
+records its own failures, so a broken destination is skipped without
+affecting the others, and a slow one only holds the reader back once its
+queue is full. A destination whose queue stays full for too long is
+detached: its copies are marked failed and the others carry on without it.
+"""
+
+import os
+import queue
+import shutil
+import stat
+import threading
+import time
+from pathlib import Path, PurePath
+
+from kachi.engine import (
+    CHUNK_SIZE,
+    CopyEngine,
+    DurableBatch,
+    data_extents,
+    is_sparse,
+    temp_path,
+)
+from kachi.events import FileCopied, FileFailed
+
+# Chunks buffered per destination before the reader waits for a writer.
+MAX_PENDING_CHUNKS = 64
+
+# Seconds the reader waits for a full queue before detaching its writer.
+STALL_TIMEOUT = 60.0
+
+_STOP = object()
+
+
+class _DestinationWriter(threading.Thread):
+    """Apply write operations for a single destination root."""
+
+    def __init__(self, root: Path, durable: bool = False):
+        """Initialize the writer.
+
+        Args:
+            root: The destination directory all relative paths are under.
+            durable: Write files under a temporary name and commit them in
+                batches, as ``CopyEngine`` does.
+        """
+        super().__init__(name=f"kachi-writer-{root}", daemon=True)
+        self.root = root
+        self.queue = queue.Queue(maxsize=MAX_PENDING_CHUNKS)
+        self.failures: list[tuple[Path, Exception]] = []
+        self.batch = DurableBatch() if durable else None
+        self._path: Path | None = None
+        self._target: Path | None = None
+        self._file = None
+        self._size = 0
+        self.detached: TimeoutError | None = None
+
+    def run(self) -> None:
+        """Process queued operations until stopped or detached."""
+        while True:
+            op = self.queue.get()
+            try:
+                if op is _STOP:
+                    return
+                if self.detached:
+                    self._discard()
+                    return
+                self._apply(*op)
+            finally:
+                self.queue.task_done()
+
+    def detach(self, timeout: float) -> None:
+        """Stop sending operations to this writer after it stalled.
+
+        The file being written is marked failed and, once the writer
+        catches up, removed along with everything still queued.
+
+        Args:
+            timeout: How long the reader waited, for the error message.
+        """
+        self.detached = TimeoutError(
+            f"Destination {self.root} stalled for {timeout:g}s and was skipped"
+        )
+        self.failures.append((self._path or self.root, self.detached))
+
+    def _apply(self, kind: str, *args) -> None:
+        """Apply a single operation, recording rather than raising errors.
+
+        Args:
+            kind: The operation: ``mkdir``, ``begin``, ``data``, ``end``
+                or ``abort``. ``data`` carries an optional offset and
+                ``end`` an optional final size, used to recreate the holes
+                of sparse files.
+            *args: The operation's arguments.
+        """
+        if kind == "mkdir":
+            path = self.root / args[0]
+            try:
+                path.mkdir(parents=True, exist_ok=True)
+            except OSError as e:
+                self.failures.append((path, e))
+        elif kind == "begin":
+            self._path = self.root / args[0]
+            self._target = Path(temp_path(self._path)) if self.batch else self._path
+            self._size = 0
+            try:
+                self._file = open(self._target, "wb")
+            except OSError as e:
+                self._fail(e)
+        elif self._file is None:
+            # The current file already failed; drop its remaining data.
+            return
+        elif kind == "data":
+            chunk, offset = args
+            try:
+                if offset is not None:
+                    self._file.seek(offset)
+                self._size += self._file.write(chunk)
+            except OSError as e:
+                self._fail(e)
+        elif kind == "end":
+            src, size = args
+            try:
+                if size is not None:
+                    self._file.truncate(size)
+                self._file.close()
+                self._file = None
+                shutil.copystat(src, self._target)
+                if self.batch and self.batch.add(
+                    str(self._target), str(self._path), self._size
+                ):
+                    self.batch.commit()
+            except OSError as e:
+                self._fail(e)
+        elif kind == "abort":
+            self._file.close()
+            self._file = None
+            self._target.unlink(missing_ok=True)
+
+    def commit(self) -> None:
+        """Commit pending durable writes, recording any failure."""
+        if self.batch:
+            try:
+                self.batch.commit()
+            except OSError as e:
+                self.failures.append((self.root, e))
+
+    def _discard(self) -> None:
+        """Close and remove the partial copy of the current file, if any."""
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            self._target.unlink(missing_ok=True)
+        except OSError:
+            pass
+        self._file = None
+
+    def _fail(self, error: Exception) -> None:
+        """Record a failure for the current file and remove the partial copy.
+
+        Args:
+            error: The error that occurred.
+        """
+        self.failures.append((self._path, error))
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+        try:
+            self._target.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+class FanOut:
+    """Copy sources to several destinations while reading them only once.
+
+    Use as a context manager so the writer threads are always stopped.
+    """
+
+    def __init__(
+        self,
+        engine: CopyEngine,
+        roots: list[Path],
+        stall_timeout: float = STALL_TIMEOUT,
+    ):
+        """Initialize the fan-out.
+
+        Args:
+            engine: Engine whose statistics and throttles apply to the
+                data read from the sources.
+            roots: Destination directories that each receive a copy.
+            stall_timeout: Seconds to wait for a destination whose queue is
+                full before detaching it, so a slow or hung destination
+                does not hold back the others.
+        """
+        self.engine = engine
+        self.stall_timeout = stall_timeout
+        durable = engine.batch is not None
+        self.writers = [_DestinationWriter(root, durable) for root in roots]
+
+    def __enter__(self) -> "FanOut":
+        """Start one writer thread per destination."""
+        for writer in self.writers:
+            writer.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Stop the writer threads once their queues are drained.
+
+        Detached writers are not waited for; they exit on their own once
+        the destination responds.
+        """
+        attached = [w for w in self.writers if not w.detached]
+        for writer in attached:
+            writer.queue.put(_STOP)
+        for writer in attached:
+            writer.join()
+
+    def _send(self, *op) -> None:
+        """Queue an operation for every destination still attached.
+
+        Args:
+            *op: The operation and its arguments.
+        """
+        for writer in self.writers:
+            if writer.detached:
+                continue
+            try:
+                writer.queue.put(op, timeout=self.stall_timeout)
+            except queue.Full:
+                writer.detach(self.stall_timeout)
+
+    def copy_file(self, src: Path, rel: PurePath) -> None:
+        """Read a file once and queue its contents for every destination.
+
+        Args:
+            src: Source file path.
+            rel: Path of the copy relative to each destination root.
+
+        Raises:
+            OSError: If the source cannot be read. Partial copies are
+                removed from every destination.
+        """
+        engine = self.engine
+        engine.wait_for_file()
+        started = time.perf_counter()
+        try:
+            size = self._copy_file(src, rel)
+        except OSError as e:
+            engine.emit(FileFailed(src, Path(rel), str(e)))
+            raise
+        engine.emit(FileCopied(src, Path(rel), size, time.perf_counter() - started))
+
+    def _copy_file(self, src: Path, rel: PurePath) -> int:
+        """Read a file and queue its contents, without reporting events.
+
+        Args:
+            src: Source file path.
+            rel: Path of the copy relative to each destination root.
+
+        Returns:
+            The size of the source file.
+        """
+        engine = self.engine
+        with open(src, "rb") as fsrc:
+            st = os.fstat(fsrc.fileno())
+            sparse = is_sparse(st)
+            self._send("begin", rel)
+            try:
+                if sparse:
+                    for offset, length in data_extents(fsrc.fileno(), st.st_size):
+                        fsrc.seek(offset)
+                        while length > 0:
+                            chunk = fsrc.read(min(CHUNK_SIZE, length))
+                            if not chunk:
+                                break
+                            self._send_chunk(chunk, offset)
+                            offset += len(chunk)
+                            length -= len(chunk)
+                else:
+                    while chunk := fsrc.read(CHUNK_SIZE):
+                        self._send_chunk(chunk, None)
+            except OSError:
+                self._send("abort")
+                raise
+        self._send("end", src, st.st_size if sparse else None)
+        engine.stats.files += 1
+        engine.stats.bytes += st.st_size
+        return st.st_size
+
+    def _send_chunk(self, chunk: bytes, offset: int | None) -> None:
+        """Queue a chunk of file data for every destination.
+
+        Args:
+            chunk: The data read from the source.
+            offset: Position to write the chunk at, or ``None`` to append.
+        """
+        self.engine.wait_for_bytes(len(chunk))
+        self._send("data", chunk, offset)
+        self.engine.stats.physical_bytes += len(chunk)
+
+    def copy_tree(self, src: Path, rel: PurePath) -> None:
+        """Recursively copy a directory to every destination.
+
+        Like ``shutil.copytree``, symlinks are followed and a file that
+        cannot be read does not stop the rest of the tree from being
+        copied. Special files such as FIFOs and sockets are reported as
+        errors rather than read.
+
+        Args:
+            src: Source directory path.
+            rel: Path of the copy relative to each destination root.
+
+        Raises:
+            OSError: If the source directory itself cannot be listed.
+            shutil.Error: If any entries could not be read, after the rest
+                of the tree has been copied.
+        """
+        self._send("mkdir", rel)
+        with os.scandir(src) as it:
+            entries = list(it)
+
+        errors = []
+        for entry in entries:
+            try:
+                mode = entry.stat().st_mode
+                if stat.S_ISDIR(mode):
+                    self.copy_tree(Path(entry.path), rel / entry.name)
+                elif stat.S_ISREG(mode):
+                    self.copy_file(Path(entry.path), rel / entry.name)
+                else:
+                    # Opening a FIFO would block until a writer appears.
+                    errors.append(
+                        (
+                            entry.path,
+                            str(rel / entry.name),
+                            f"{entry.path} is not a regular file",
+                        )
+                    )
+            except shutil.Error as e:
+                errors.extend(e.args[0])
+            except OSError as e:
+                errors.append((entry.path, str(rel / entry.name), str(e)))
+        if errors:
+            raise shutil.Error(errors)
+
+    def wait(self) -> dict[Path, list[tuple[Path, Exception]]]:
+        """Wait for all queued writes and collect failures since the last call.
+
+        A detached destination is not waited for and reports a failure on
+        every call, as nothing is written to it any more.
+
+        Returns:
+            A mapping of each destination root to the ``(path, error)``
+            failures it recorded.
+        """
+        results = {}
+        for writer in self.writers:
+            if writer.detached:
+                failures, writer.failures = writer.failures, []
+                results[writer.root] = failures or [(writer.root, writer.detached)]
+                continue
+            writer.queue.join()
+            writer.commit()
+            results[writer.root] = writer.failures
+            writer.failures = []
+        return results
@@ -0,0 +1,301 @@
+"""Local run history used to estimate and track backup performance.
+
+Runs that ended with errors are recorded with their error count but left
+out of estimates and comparisons, as a partial run says little about how
+long a full one takes.
+"""
+
+import sqlite3
+import statistics
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+HISTORY_FILENAME = "history.db"
+
+# A measurement of a run or source: (seconds, files, bytes).
+Sample = tuple[float, int, int]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    profile TEXT NOT NULL,
+    started REAL NOT NULL,
+    seconds REAL NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL,
+    errors INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sources (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    source TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sources_run_id ON sources (run_id);
+"""
+
+
+@dataclass
+class Trend:
+    """How the latest run of a profile or source compares with earlier runs.
+
+    Attributes:
+        name: The profile name or source path.
+        seconds: Duration of the latest run.
+        files: Files copied by the latest run.
+        bytes: Bytes copied by the latest run.
+        previous_runs: Number of earlier runs the baseline is taken from.
+        baseline_seconds: Median duration of the earlier runs, or ``None``
+            without earlier runs.
+        baseline_bytes: Median bytes copied by the earlier runs, or
+            ``None`` without earlier runs.
+    """
+
+    name: str
+    seconds: float
+    files: int
+    bytes: int
+    previous_runs: int = 0
+    baseline_seconds: float | None = None
+    baseline_bytes: float | None = None
+
+    @property
+    def time_growth(self) -> float | None:
+        """Latest duration as a multiple of the baseline, if there is one."""
+        if not self.baseline_seconds:
+            return None
+        return self.seconds / self.baseline_seconds
+
+    @property
+    def size_growth(self) -> float | None:
+        """Latest bytes copied as a multiple of the baseline, if there is one."""
+        if not self.baseline_bytes:
+            return None
+        return self.bytes / self.baseline_bytes
+
+    def slower(self, threshold: float, min_seconds: float = 1.0) -> bool:
+        """Whether the latest run took longer than a threshold allows.
+
+        Args:
+            threshold: Growth factor over the baseline that counts as a
+                regression, e.g. ``1.5`` for 50% more.
+            min_seconds: Runs shorter than this are never flagged, as short
+                runs vary too much to compare.
+
+        Returns:
+            True if the duration grew beyond the threshold.
+        """
+        growth = self.time_growth
+        return growth is not None and self.seconds >= min_seconds and growth > threshold
+
+    def larger(self, threshold: float) -> bool:
+        """Whether the latest run copied more data than a threshold allows.
+
+        Args:
+            threshold: Growth factor over the baseline that counts as a
+                regression.
+
+        Returns:
+            True if the bytes copied grew beyond the threshold.
+        """
+        return self.size_growth is not None and self.size_growth > threshold
+
+
+def _trend(name: str, rows: list[Sample]) -> Trend:
+    """Compare the first of a list of samples with the rest.
+
+    Args:
+        name: The profile name or source path.
+        rows: ``(seconds, files, bytes)`` tuples, latest first.
+
+    Returns:
+        The trend of the samples.
+    """
+    (seconds, files, bytes_copied), earlier = rows[0], rows[1:]
+    trend = Trend(name, seconds, files, bytes_copied, previous_runs=len(earlier))
+    if earlier:
+        trend.baseline_seconds = statistics.median(r[0] for r in earlier)
+        trend.baseline_bytes = statistics.median(r[2] for r in earlier)
+    return trend
+
+
+class HistoryStore:
+    """Record completed backup runs in a small SQLite database."""
+
+    def __init__(self, path: Path):
+        """Initialize the store.
+
+        Args:
+            path: Path to the SQLite database file. It is created on
+                first write.
+        """
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the database and ensure the schema exists.
+
+        Returns:
+            An open SQLite connection.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.executescript(_SCHEMA)
+        # Databases written before errors were recorded lack the column.
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(runs)")}
+        if "errors" not in columns:
+            with conn:
+                conn.execute(
+                    "ALTER TABLE runs ADD COLUMN errors INTEGER NOT NULL DEFAULT 0"
+                )
+        return conn
+
+    def record_run(
+        self,
+        profile: str,
+        seconds: float,
+        files: int,
+        bytes_copied: int,
+        sources: dict[Path, Sample] | None = None,
+        errors: int = 0,
+    ) -> None:
+        """Record a completed profile run.
+
+        Args:
+            profile: Name of the profile that was backed up.
+            seconds: Wall-clock duration of the run.
+            files: Number of files copied.
+            bytes_copied: Number of bytes copied.
+            sources: ``(seconds, files, bytes)`` of each source.
+            errors: Number of errors the run ended with. Runs with errors
+                are not used for estimates or trends.
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO runs (profile, started, seconds, files, bytes, "
+                    "errors) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        profile,
+                        time.time() - seconds,
+                        seconds,
+                        files,
+                        bytes_copied,
+                        errors,
+                    ),
+                )
+                conn.executemany(
+                    "INSERT INTO sources (run_id, source, seconds, files, bytes) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (cursor.lastrowid, str(src), *sample)
+                        for src, sample in (sources or {}).items()
+                    ],
+                )
+        finally:
+            conn.close()
+
+    def profiles(self) -> list[str]:
+        """Return the names of the profiles with recorded runs.
+
+        Returns:
+            The profile names, sorted.
+        """
+        if not self.path.exists():
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT DISTINCT profile FROM runs ORDER BY profile"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [profile for (profile,) in rows]
+
+    def trends(self, profile: str, runs: int = 10) -> tuple[Trend | None, list[Trend]]:
+        """Compare a profile's latest run with the runs before it.
+
+        Only runs without errors are compared.
+
+        Args:
+            profile: Name of the profile.
+            runs: Number of most recent runs to look at, including the
+                latest.
+
+        Returns:
+            The trend of the whole profile, or ``None`` if it has no
+            recorded runs without errors, and the trend of each source
+            backed up by the latest run, in the order they were recorded.
+        """
+        if not self.path.exists():
+            return None, []
+
+        conn = self._connect()
+        try:
+            recent = conn.execute(
+                "SELECT id, seconds, files, bytes FROM runs "
+                "WHERE profile = ? AND errors = 0 ORDER BY id DESC LIMIT ?",
+                (profile, runs),
+            ).fetchall()
+            if not recent:
+                return None, []
+            ids = [row[0] for row in recent]
+            placeholders = ", ".join("?" * len(ids))
+            samples = conn.execute(
+                f"SELECT run_id, source, seconds, files, bytes FROM sources "
+                f"WHERE run_id IN ({placeholders}) ORDER BY rowid",
+                ids,
+            ).fetchall()
+        finally:
+            conn.close()
+
+        by_source: dict[str, dict[int, Sample]] = {}
+        for run_id, source, seconds, files, bytes_copied in samples:
+            by_source.setdefault(source, {})[run_id] = (seconds, files, bytes_copied)
+        sources = [
+            _trend(source, [rows[i] for i in ids if i in rows])
+            for source, rows in by_source.items()
+            if ids[0] in rows
+        ]
+        return _trend(profile, [row[1:] for row in recent]), sources
+
+    def throughput(self, profile: str | None = None, runs: int = 5) -> float | None:
+        """Return the measured copy throughput from recent runs without errors.
+
+        Args:
+            profile: Limit the measurement to this profile. When ``None``,
+                or when the profile has no usable history, runs from all
+                profiles are used.
+            runs: Number of most recent runs to average over.
+
+        Returns:
+            Throughput in bytes per second, or ``None`` if no run copied
+            any data yet.
+        """
+        if not self.path.exists():
+            return None
+
+        query = (
+            "SELECT SUM(bytes), SUM(seconds) FROM ("
+            "SELECT bytes, seconds FROM runs "
+            "WHERE bytes > 0 AND seconds > 0 AND errors = 0 {where}"
+            "ORDER BY started DESC LIMIT ?)"
+        )
+        conn = self._connect()
+        try:
+            row = (None, None)
+            if profile is not None:
+                row = conn.execute(
+                    query.format(where="AND profile = ? "), (profile, runs)
+                ).fetchone()
+            if not row[0]:
+                row = conn.execute(query.format(where=""), (runs,)).fetchone()
+        finally:
+            conn.close()
+
+        total_bytes, total_seconds = row
+        if not total_bytes or not total_seconds:
+            return None
+        return total_bytes / total_seconds
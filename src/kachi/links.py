@@ -0,0 +1,178 @@
+"""Find identical files among a profile's sources so copies can be linked.
+
+The same content often turns up under several sources, such as a
+``.bashrc`` in every home directory. Before copying, candidate files are
+grouped by size and then by a hash of their content. During the copy the
+first file of each group is written as usual and the others are hard
+links to it, so the content is stored once. Files that share their size
+are read twice: once to hash them here, and again to copy them.
+
+When a profile's sources are backed up in parallel, their engines share
+one index, so a duplicate can be linked to a copy written by another
+source.
+"""
+
+import hashlib
+import os
+import stat
+import threading
+from collections import defaultdict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Source files are identified by device and inode, so a file reached
+# through two sources or a symlink is recognized wherever it is copied from.
+FileKey = tuple[int, int]
+
+
+def _walk_files(sources: list[Path]) -> Iterator[tuple[Path, os.stat_result]]:
+    """Yield every regular file under the sources, following symlinks.
+
+    Files and directories that cannot be read are skipped; the copy
+    reports them.
+
+    Args:
+        sources: Files and directories to walk.
+
+    Yields:
+        ``(path, stat_result)`` tuples.
+    """
+    pending = list(reversed(sources))
+    while pending:
+        path = pending.pop()
+        try:
+            st = path.stat()
+            if stat.S_ISDIR(st.st_mode):
+                pending.extend(path.iterdir())
+                continue
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode):
+            yield path, st
+
+
+def _hash_file(path: Path) -> str:
+    """Return the hex SHA-256 digest of a file's content.
+
+    Args:
+        path: The file to hash.
+
+    Returns:
+        The digest.
+    """
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+@dataclass
+class DuplicateIndex:
+    """Groups of identical source files and the copies written for them.
+
+    The index may be shared by engines copying in several threads, so
+    ``written`` is only accessed through ``first_copy`` and ``add_copy``.
+
+    Attributes:
+        groups: Maps each source file with duplicates to its content
+            digest, size and modification time when it was hashed.
+        written: Maps each digest to the paths of the first copy written,
+            as a ``(written, final)`` tuple. They differ when the copy
+            waits under a temporary name to be renamed into place.
+    """
+
+    groups: dict[FileKey, tuple[str, int, int]] = field(default_factory=dict)
+    written: dict[str, tuple[str, str]] = field(default_factory=dict)
+    _lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    def first_copy(self, digest: str) -> tuple[str, str] | None:
+        """Return the first copy written of some content.
+
+        Args:
+            digest: The content digest.
+
+        Returns:
+            The ``(written, final)`` paths of the copy, or ``None`` if no
+            copy has been written yet.
+        """
+        with self._lock:
+            return self.written.get(digest)
+
+    def add_copy(self, digest: str, written: str, final: str) -> None:
+        """Record a copy of some content for later duplicates to link to.
+
+        Args:
+            digest: The content digest.
+            written: Path the copy was written to.
+            final: Path the copy ends up at.
+        """
+        with self._lock:
+            self.written[digest] = (written, final)
+
+    def group_of(self, st: os.stat_result) -> str | None:
+        """Return the digest of a source file that has duplicates.
+
+        Args:
+            st: ``stat`` result of the source file.
+
+        Returns:
+            The file's content digest, or ``None`` if it has no duplicates
+            or has changed since it was hashed.
+        """
+        entry = self.groups.get((st.st_dev, st.st_ino))
+        if entry is None:
+            return None
+        digest, size, mtime_ns = entry
+        if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+            return None
+        return digest
+
+    def __len__(self) -> int:
+        """Return the number of source files that have duplicates."""
+        return len(self.groups)
+
+
+def find_duplicates(sources: list[Path]) -> DuplicateIndex:
+    """Find the source files whose content appears more than once.
+
+    Empty files are ignored, as linking them saves nothing. Only files
+    that share their size with another file are hashed.
+
+    Args:
+        sources: The profile's sources.
+
+    Returns:
+        The groups of identical files.
+    """
+    by_size: dict[int, dict[FileKey, tuple[Path, os.stat_result]]] = defaultdict(dict)
+    seen: dict[FileKey, int] = defaultdict(int)
+    for path, st in _walk_files(sources):
+        if st.st_size == 0:
+            continue
+        key = (st.st_dev, st.st_ino)
+        by_size[st.st_size][key] = (path, st)
+        seen[key] += 1
+
+    index = DuplicateIndex()
+    for files in by_size.values():
+        if len(files) == 1:
+            [(key, (path, st))] = files.items()
+            if seen[key] > 1:
+                # The same file reached through two sources.
+                digest = f"inode:{key[0]}:{key[1]}"
+                index.groups[key] = (digest, st.st_size, st.st_mtime_ns)
+            continue
+
+        by_digest: dict[str, list[FileKey]] = defaultdict(list)
+        for key, (path, st) in files.items():
+            try:
+                by_digest[_hash_file(path)].append(key)
+            except OSError:
+                continue
+        for digest, keys in by_digest.items():
+            if len(keys) > 1 or seen[keys[0]] > 1:
+                for key in keys:
+                    _, st = files[key]
+                    index.groups[key] = (digest, st.st_size, st.st_mtime_ns)
+    return index
@@ -0,0 +1,246 @@
+"""Dry-run planning for Kachi profiles.
+
+A plan describes what a backup run would copy without writing anything.
+It is built from stat-only directory walks, so it stays cheap on large
+trees: no file contents are read.
+"""
+
+import os
+import stat
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from kachi.config import Profile, RemoteDestination
+
+
+@dataclass
+class SourcePlan:
+    """What a backup run would copy for a single source.
+
+    Attributes:
+        source: The source path from the profile.
+        files: Number of files that would be copied.
+        bytes: Total size of those files.
+        new: Files that do not exist in the destination yet.
+        changed: Files whose size or modification time differ from the
+            existing copy in the destination.
+        errors: Entries that could not be read, such as broken symlinks
+            or unreadable directories.
+    """
+
+    source: Path
+    files: int = 0
+    bytes: int = 0
+    new: int = 0
+    changed: int = 0
+    errors: int = 0
+
+    @property
+    def unchanged(self) -> int:
+        """Number of files whose destination copy is already up to date."""
+        return self.files - self.new - self.changed
+
+
+@dataclass
+class ProfilePlan:
+    """What a backup run would copy for a whole profile.
+
+    Attributes:
+        profile: Name of the planned profile.
+        destination: The profile's backup destination. Plans for a backup
+            server count every file as new.
+        sources: One plan per source that exists.
+        not_found: Sources that could not be located.
+    """
+
+    profile: str
+    destination: Path | RemoteDestination | None
+    sources: list[SourcePlan] = field(default_factory=list)
+    not_found: list[Path] = field(default_factory=list)
+
+    @property
+    def destination_valid(self) -> bool:
+        """Whether the destination exists and is a directory.
+
+        A backup server is assumed to be valid, since checking it would
+        require connecting to it.
+        """
+        if isinstance(self.destination, RemoteDestination):
+            return True
+        return self.destination is not None and self.destination.is_dir()
+
+    @property
+    def files(self) -> int:
+        """Total number of files that would be copied."""
+        return sum(s.files for s in self.sources)
+
+    @property
+    def bytes(self) -> int:
+        """Total number of bytes that would be copied."""
+        return sum(s.bytes for s in self.sources)
+
+    @property
+    def new(self) -> int:
+        """Total number of files not present in the destination."""
+        return sum(s.new for s in self.sources)
+
+    @property
+    def changed(self) -> int:
+        """Total number of files that differ from the destination copy."""
+        return sum(s.changed for s in self.sources)
+
+    @property
+    def errors(self) -> int:
+        """Total number of entries that could not be read."""
+        return sum(s.errors for s in self.sources)
+
+    def estimate_seconds(self, throughput: float | None) -> float | None:
+        """Estimate how long the run would take.
+
+        Args:
+            throughput: Measured throughput in bytes per second, or ``None``
+                if no measurement is available.
+
+        Returns:
+            The estimated duration in seconds, or ``None`` when there is no
+            throughput to base the estimate on.
+        """
+        if not throughput:
+            return None
+        return self.bytes / throughput
+
+
+def _tally(plan: SourcePlan, src_stat: os.stat_result, dest_stat) -> None:
+    """Add a single file to a source plan.
+
+    Args:
+        plan: The plan to update.
+        src_stat: ``stat`` result of the source file.
+        dest_stat: ``stat`` result of the existing destination copy, or
+            ``None`` if there is none.
+    """
+    plan.files += 1
+    plan.bytes += src_stat.st_size
+    if dest_stat is None:
+        plan.new += 1
+    elif (
+        dest_stat.st_size != src_stat.st_size
+        or dest_stat.st_mtime_ns != src_stat.st_mtime_ns
+    ):
+        plan.changed += 1
+
+
+def _list_dest(dest_dir: str | None) -> tuple[dict, dict]:
+    """List a destination directory with a single ``scandir`` call.
+
+    Args:
+        dest_dir: The destination directory, or ``None`` if it does not
+            exist.
+
+    Returns:
+        A tuple containing:
+        - Mapping of regular file name to its ``stat`` result.
+        - Mapping of subdirectory name to its path.
+    """
+    files = {}
+    dirs = {}
+    if dest_dir is None:
+        return files, dirs
+    try:
+        with os.scandir(dest_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs[entry.name] = entry.path
+                elif entry.is_file(follow_symlinks=False):
+                    files[entry.name] = entry.stat()
+    except OSError:
+        pass
+    return files, dirs
+
+
+def _scan_dir(plan: SourcePlan, src_dir: str, dest_dir: str | None) -> None:
+    """Recursively tally a source directory against its destination copy.
+
+    Args:
+        plan: The plan to update.
+        src_dir: Source directory to walk.
+        dest_dir: Matching destination directory, or ``None`` if it does
+            not exist yet.
+    """
+    existing_files, existing_dirs = _list_dest(dest_dir)
+    subdirs = []
+    try:
+        with os.scandir(src_dir) as it:
+            for entry in it:
+                try:
+                    # Follow symlinks, matching shutil.copytree's default
+                    # behaviour.
+                    entry_stat = entry.stat()
+                except OSError:
+                    # A broken symlink or an entry that vanished; the copy
+                    # reports it as an error too.
+                    plan.errors += 1
+                    continue
+                if stat.S_ISDIR(entry_stat.st_mode):
+                    subdirs.append(entry)
+                else:
+                    _tally(plan, entry_stat, existing_files.get(entry.name))
+    except OSError:
+        plan.errors += 1
+
+    for entry in subdirs:
+        _scan_dir(plan, entry.path, existing_dirs.get(entry.name))
+
+
+def plan_source(src: Path, dest: Path | None) -> SourcePlan:
+    """Plan the backup of a single existing source.
+
+    Args:
+        src: Source file or directory.
+        dest: Destination directory the source would be copied into.
+
+    Returns:
+        The plan for the source.
+    """
+    plan = SourcePlan(source=src)
+    dest_dir = str(dest) if dest is not None and dest.is_dir() else None
+
+    if src.is_file():
+        dest_stat = None
+        if dest_dir is not None:
+            try:
+                dest_stat = (dest / src.name).stat()
+            except OSError:
+                pass
+        try:
+            _tally(plan, src.stat(), dest_stat)
+        except OSError:
+            plan.errors += 1
+    else:
+        target = None
+        if dest_dir is not None and (dest / src.name).is_dir():
+            target = str(dest / src.name)
+        _scan_dir(plan, str(src), target)
+    return plan
+
+
+def plan_profile(profile: Profile) -> ProfilePlan:
+    """Build a dry-run plan for a profile without writing anything.
+
+    Args:
+        profile: The profile to plan.
+
+    Returns:
+        The plan for every source in the profile.
+    """
+    # With several destinations, each source is still read once, so the
+    # plan is compared against the first (primary) destination.
+    dest = profile.destinations[0] if profile.destinations else None
+    plan = ProfilePlan(profile=profile.name, destination=dest)
+    local_dest = dest if isinstance(dest, Path) else None
+    for src in profile.sources:
+        if src.is_file() or src.is_dir():
+            plan.sources.append(plan_source(src, local_dest))
+        else:
+            plan.not_found.append(src)
+    return plan
@@ -0,0 +1,740 @@
+"""Back up to a Kachi server over TCP.
+
+``kachi serve`` accepts files from any number of hosts and writes them to
+its store, one directory per profile. Clients keep a small pool of
+persistent connections per server, so a run does not pay for a new
+connection per source. Requests are pipelined: the client keeps sending
+while a reader thread collects the server's replies, and small files are
+sent together in batches rather than one request each.
+
+Every message is a length-prefixed JSON header, followed by the file data
+it describes. The server answers each message with a header listing the
+files it failed to write. The first message on every connection is a
+greeting carrying the client's token, which the server checks before
+accepting any files when it was started with one.
+"""
+
+import hmac
+import json
+import os
+import re
+import shutil
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath, PureWindowsPath
+
+from kachi import logger
+from kachi.config import RemoteDestination
+from kachi.engine import CHUNK_SIZE, CopyEngine, temp_path
+from kachi.events import FileCopied, FileFailed
+from kachi.units import format_bytes
+
+# Files up to this size are sent in batches instead of one request each.
+SMALL_FILE_SIZE = 64 * 1024
+
+# A batch is sent once it reaches either limit.
+BATCH_FILES = 128
+BATCH_BYTES = 1024 * 1024
+
+# Requests sent on a connection before waiting for the server to reply.
+PIPELINE_DEPTH = 32
+
+# Persistent connections kept open per server.
+POOL_SIZE = 4
+
+CONNECT_TIMEOUT = 10
+
+# Largest message header accepted. File data is streamed after the header
+# and does not count towards it.
+MAX_HEADER_SIZE = 4 * 1024 * 1024
+
+_HEADER = struct.Struct("!I")
+_PROFILE_NAME = re.compile(r"[\w.-]+")
+
+
+def _write_frame(write: Callable[[bytes], object], header: dict) -> None:
+    """Write a length-prefixed JSON header.
+
+    Args:
+        write: Function that writes all of the given bytes.
+        header: The header to send.
+    """
+    data = json.dumps(header, separators=(",", ":")).encode()
+    write(_HEADER.pack(len(data)) + data)
+
+
+def _read_frame(rfile) -> dict | None:
+    """Read a length-prefixed JSON header.
+
+    Args:
+        rfile: Binary file object wrapping the socket.
+
+    Returns:
+        The header, or ``None`` if the peer closed the connection cleanly.
+
+    Raises:
+        ConnectionError: If the connection closed in the middle of a frame.
+        ValueError: If the header is larger than ``MAX_HEADER_SIZE``.
+    """
+    prefix = rfile.read(_HEADER.size)
+    if not prefix:
+        return None
+    if len(prefix) < _HEADER.size:
+        raise ConnectionError("Connection closed in the middle of a message")
+    (length,) = _HEADER.unpack(prefix)
+    if length > MAX_HEADER_SIZE:
+        raise ValueError(f"Message header of {format_bytes(length)} is too large")
+    data = rfile.read(length)
+    if len(data) < length:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return json.loads(data)
+
+
+class _Connection:
+    """A persistent connection with pipelined requests."""
+
+    def __init__(self, sock: socket.socket):
+        """Wrap a connected socket and start reading replies.
+
+        Args:
+            sock: The connected socket.
+        """
+        self.sock = sock
+        self.broken = False
+        self._rfile = sock.makefile("rb")
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._errors: list[tuple[str, str]] = []
+        self._failure: Exception | None = None
+        self._reader = threading.Thread(
+            target=self._read_replies, name="kachi-remote-reader", daemon=True
+        )
+        self._reader.start()
+
+    def _read_replies(self) -> None:
+        """Collect replies until the connection closes."""
+        try:
+            while reply := _read_frame(self._rfile):
+                with self._cond:
+                    self._in_flight -= 1
+                    self._errors.extend(tuple(e) for e in reply["errors"])
+                    self._cond.notify_all()
+            failure = ConnectionError("Server closed the connection")
+        except Exception as e:
+            failure = e
+        with self._cond:
+            self._failure = failure
+            self._cond.notify_all()
+
+    def _wait(self, in_flight: int) -> None:
+        """Wait until at most ``in_flight`` requests await a reply.
+
+        Args:
+            in_flight: Number of unanswered requests to wait for.
+
+        Raises:
+            ConnectionError: If the connection failed first.
+        """
+        with self._cond:
+            while self._in_flight > in_flight:
+                if self._failure is not None:
+                    self.broken = True
+                    raise ConnectionError(f"Lost connection to server: {self._failure}")
+                self._cond.wait()
+
+    def request(self, header: dict, body: Iterable[bytes] = ()) -> None:
+        """Send a request without waiting for its reply.
+
+        Args:
+            header: The request header.
+            body: Chunks of data sent after the header. Their total size
+                must match the size announced in the header.
+
+        Raises:
+            OSError: If the request could not be sent. The connection can
+                no longer be used.
+        """
+        self._wait(PIPELINE_DEPTH - 1)
+        self.broken = True
+        with self._cond:
+            self._in_flight += 1
+        _write_frame(self.sock.sendall, header)
+        for chunk in body:
+            self.sock.sendall(chunk)
+        self.broken = False
+
+    def drain(self) -> list[tuple[str, str]]:
+        """Wait for every reply and collect the errors they reported.
+
+        Returns:
+            The ``(path, error)`` pairs reported since the last call.
+        """
+        self._wait(0)
+        with self._cond:
+            errors, self._errors = self._errors, []
+        return errors
+
+    def close(self) -> None:
+        """Close the connection."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._rfile.close()
+
+
+class ConnectionPool:
+    """Persistent connections to a single backup server."""
+
+    def __init__(self, destination: RemoteDestination, size: int = POOL_SIZE):
+        """Initialize an empty pool. Connections are opened on demand.
+
+        Args:
+            destination: The server to connect to.
+            size: Maximum number of connections open at once.
+        """
+        self.destination = destination
+        self._idle: list[_Connection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self) -> Iterator[_Connection]:
+        """Borrow a connection, opening one if none is idle.
+
+        The connection returns to the pool afterwards unless it broke.
+
+        Yields:
+            A connection with no unanswered requests.
+
+        Raises:
+            OSError: If the server cannot be reached.
+            PermissionError: If the server rejected the token.
+        """
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                conn.close()
+                raise
+            if conn.broken:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+
+    def _connect(self) -> _Connection:
+        """Open a connection and greet the server with the token.
+
+        Returns:
+            The new connection.
+
+        Raises:
+            OSError: If the server cannot be reached.
+            PermissionError: If the server rejected the token.
+        """
+        sock = socket.create_connection(
+            (self.destination.host, self.destination.port),
+            timeout=CONNECT_TIMEOUT,
+        )
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn = _Connection(sock)
+        try:
+            conn.request({"op": "hello", "token": self.destination.token})
+            errors = conn.drain()
+        except BaseException:
+            conn.close()
+            raise
+        if errors:
+            conn.close()
+            raise PermissionError(
+                f"{self.destination} refused the connection: {errors[0][1]}"
+            )
+        return conn
+
+    def close(self) -> None:
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools: dict[RemoteDestination, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(destination: RemoteDestination) -> ConnectionPool:
+    """Return the shared connection pool for a server.
+
+    Args:
+        destination: The server to connect to.
+
+    Returns:
+        The pool, created on first use.
+    """
+    with _pools_lock:
+        if destination not in _pools:
+            _pools[destination] = ConnectionPool(destination)
+        return _pools[destination]
+
+
+def close_pools() -> None:
+    """Close the idle connections of every pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class RemoteSender:
+    """Send files for one profile over a connection."""
+
+    def __init__(self, conn: _Connection, profile: str, engine: CopyEngine):
+        """Initialize the sender.
+
+        Args:
+            conn: The connection to send on.
+            profile: Name of the profile, which selects the directory the
+                server writes to.
+            engine: Engine whose statistics and throttles apply.
+        """
+        self.conn = conn
+        self.profile = profile
+        self.engine = engine
+        self._batch: list[dict] = []
+        self._batch_data: list[bytes] = []
+        self._batch_bytes = 0
+
+    def send_file(self, src: Path, rel: PurePosixPath) -> None:
+        """Send a single file.
+
+        Args:
+            src: Source file path.
+            rel: Path of the copy within the profile's directory.
+
+        Raises:
+            OSError: If the source cannot be read or the connection fails.
+        """
+        self.engine.wait_for_file()
+        started = time.perf_counter()
+        try:
+            size = self._send_file(src, rel)
+        except OSError as e:
+            self.engine.emit(FileFailed(src, Path(rel), str(e)))
+            raise
+        self.engine.emit(
+            FileCopied(src, Path(rel), size, time.perf_counter() - started)
+        )
+
+    def _send_file(self, src: Path, rel: PurePosixPath) -> int:
+        """Send or batch a single file, without reporting events.
+
+        Args:
+            src: Source file path.
+            rel: Path of the copy within the profile's directory.
+
+        Returns:
+            The number of bytes sent.
+        """
+        with open(src, "rb") as f:
+            st = os.fstat(f.fileno())
+            meta = {
+                "path": str(rel),
+                "size": st.st_size,
+                "mode": stat.S_IMODE(st.st_mode),
+                "mtime_ns": st.st_mtime_ns,
+            }
+            if st.st_size <= SMALL_FILE_SIZE:
+                data = f.read()
+                meta["size"] = len(data)
+                self.engine.wait_for_bytes(len(data))
+                self._add_to_batch(meta, data)
+            else:
+                header = {"op": "file", "profile": self.profile, **meta}
+                self.conn.request(header, self._read_chunks(f, src, st.st_size))
+        self.engine.stats.files += 1
+        self.engine.stats.bytes += meta["size"]
+        self.engine.stats.physical_bytes += meta["size"]
+        return meta["size"]
+
+    def _read_chunks(self, f, src: Path, size: int) -> Iterator[bytes]:
+        """Read exactly ``size`` bytes of a file, chunk by chunk.
+
+        Args:
+            f: The open source file.
+            src: Source file path, for error messages.
+            size: Number of bytes announced to the server.
+
+        Yields:
+            Chunks of the file.
+
+        Raises:
+            OSError: If the file shrank while it was being sent.
+        """
+        remaining = size
+        while remaining:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise OSError(f"{src} changed size while being sent")
+            self.engine.wait_for_bytes(len(chunk))
+            remaining -= len(chunk)
+            yield chunk
+
+    def _add_to_batch(self, meta: dict, data: bytes) -> None:
+        """Queue a small file, sending the batch once it is full.
+
+        Args:
+            meta: The file's path and metadata.
+            data: The file's contents.
+        """
+        self._batch.append(meta)
+        self._batch_data.append(data)
+        self._batch_bytes += len(data)
+        if len(self._batch) >= BATCH_FILES or self._batch_bytes >= BATCH_BYTES:
+            self.flush()
+
+    def flush(self) -> None:
+        """Send the files batched so far."""
+        if not self._batch:
+            return
+        header = {"op": "batch", "profile": self.profile, "files": self._batch}
+        self.conn.request(header, self._batch_data)
+        self._batch, self._batch_data, self._batch_bytes = [], [], 0
+
+    def send_tree(self, src: Path, rel: PurePosixPath) -> None:
+        """Recursively send a directory.
+
+        Like ``shutil.copytree``, symlinks are followed and a file that
+        cannot be read does not stop the rest of the tree from being sent.
+        Entries that are neither files nor directories, such as FIFOs, are
+        reported as errors instead of being read.
+
+        Args:
+            src: Source directory path.
+            rel: Path of the copy within the profile's directory.
+
+        Raises:
+            OSError: If the source directory itself cannot be listed, or
+                the connection fails.
+            shutil.Error: If any entries could not be read, after the rest
+                of the tree has been sent.
+        """
+        with os.scandir(src) as it:
+            entries = list(it)
+
+        errors = []
+        for entry in entries:
+            try:
+                mode = entry.stat().st_mode
+                if stat.S_ISDIR(mode):
+                    self.send_tree(Path(entry.path), rel / entry.name)
+                elif stat.S_ISREG(mode):
+                    self.send_file(Path(entry.path), rel / entry.name)
+                else:
+                    # Opening a FIFO would block until a writer appears.
+                    reason = f"{entry.path} is not a regular file"
+                    self.engine.emit(
+                        FileFailed(Path(entry.path), Path(rel / entry.name), reason)
+                    )
+                    errors.append((entry.path, str(rel / entry.name), reason))
+            except shutil.Error as e:
+                errors.extend(e.args[0])
+            except ConnectionError:
+                raise
+            except OSError as e:
+                if self.conn.broken:
+                    raise
+                errors.append((entry.path, str(rel / entry.name), str(e)))
+        if errors:
+            raise shutil.Error(errors)
+
+    def finish(self) -> list[tuple[str, str]]:
+        """Send the last batch and wait for the server to write every file.
+
+        Returns:
+            The ``(path, error)`` pairs of files the server failed to
+            write.
+        """
+        self.flush()
+        return self.conn.drain()
+
+
+def ping(destination: RemoteDestination) -> None:
+    """Check that a server is reachable, leaving a connection in the pool.
+
+    Args:
+        destination: The server to check.
+
+    Raises:
+        OSError: If the server cannot be reached.
+    """
+    with get_pool(destination).connection() as conn:
+        conn.request({"op": "ping"})
+        conn.drain()
+
+
+class RemoteStore:
+    """The directory a backup server writes received files to."""
+
+    def __init__(self, root: Path, token: str | None = None):
+        """Initialize the store.
+
+        Args:
+            root: Directory holding one subdirectory per profile.
+            token: Secret clients must greet the server with, or ``None``
+                to accept any client.
+        """
+        self.root = root
+        self.token = token
+
+    def accepts(self, header: dict) -> bool:
+        """Check the greeting a client opens its connection with.
+
+        Args:
+            header: The first request of the connection.
+
+        Returns:
+            ``True`` if it is a greeting with the expected token.
+        """
+        if header.get("op") != "hello":
+            return False
+        if self.token is None:
+            return True
+        token = header.get("token")
+        if not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token.encode(), self.token.encode())
+
+    def target(self, profile: str, path: str) -> Path:
+        """Resolve the path a received file is written to.
+
+        Args:
+            profile: The profile the file belongs to.
+            path: The file's path within the profile's directory.
+
+        Returns:
+            The resolved path inside the store.
+
+        Raises:
+            ValueError: If the profile name or path would escape the store.
+        """
+        rel = PurePosixPath(path)
+        if not _PROFILE_NAME.fullmatch(profile) or profile in (".", ".."):
+            raise ValueError(f"Invalid profile name '{profile}'")
+        if rel.is_absolute() or not rel.parts:
+            raise ValueError(f"Invalid path '{path}'")
+        # Separators and drives that only Windows recognises would let a
+        # single part escape the store once it is turned into a local path.
+        for part in rel.parts:
+            if (
+                part == ".."
+                or "\\" in part
+                or ":" in part
+                or PureWindowsPath(part).anchor
+            ):
+                raise ValueError(f"Invalid path '{path}'")
+        root = (self.root / profile).resolve()
+        target = root.joinpath(*rel.parts).resolve()
+        if target == root or not target.is_relative_to(root):
+            raise ValueError(f"Invalid path '{path}'")
+        return target
+
+    def receive(self, header: dict, rfile) -> list[tuple[str, str]]:
+        """Handle a single request.
+
+        Args:
+            header: The request header.
+            rfile: Binary file object the request's data is read from.
+
+        Returns:
+            The ``(path, error)`` pairs of files that could not be
+            written.
+
+        Raises:
+            ConnectionError: If the connection closed mid-request.
+            ValueError: If the request is not understood.
+        """
+        op = header.get("op")
+        if op in ("ping", "hello"):
+            return []
+        if op == "file":
+            return self._receive_file(header["profile"], header, rfile)
+        if op == "batch":
+            errors = []
+            for meta in header["files"]:
+                errors.extend(self._receive_file(header["profile"], meta, rfile))
+            return errors
+        raise ValueError(f"Unknown request '{op}'")
+
+    def _receive_file(self, profile: str, meta: dict, rfile) -> list:
+        """Write a single received file under a temporary name.
+
+        The file's data is always read in full, even when it cannot be
+        written, so the next request starts at the right position.
+
+        Args:
+            profile: The profile the file belongs to.
+            meta: The file's path, size, mode and modification time.
+            rfile: Binary file object the data is read from.
+
+        Returns:
+            A list with the file's ``(path, error)`` pair if it could not
+            be written, otherwise an empty list.
+
+        Raises:
+            ConnectionError: If the connection closed mid-file.
+        """
+        error = None
+        f = None
+        tmp = None
+        done = False
+        try:
+            target = self.target(profile, meta["path"])
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = Path(temp_path(target))
+            f = open(tmp, "wb")
+        except OSError as e:
+            error = e
+        except ValueError as e:
+            error = e
+
+        try:
+            remaining = meta["size"]
+            while remaining:
+                chunk = rfile.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ConnectionError("Connection closed in the middle of a file")
+                remaining -= len(chunk)
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                    except OSError as e:
+                        error = e
+                        f.close()
+                        f = None
+            if f is not None:
+                f.close()
+                f = None
+                os.chmod(tmp, meta["mode"])
+                os.utime(tmp, ns=(meta["mtime_ns"], meta["mtime_ns"]))
+                os.replace(tmp, target)
+                done = True
+        except ConnectionError:
+            raise
+        except OSError as e:
+            error = e
+        finally:
+            if f is not None:
+                f.close()
+            if not done and tmp is not None:
+                tmp.unlink(missing_ok=True)
+
+        if error is not None:
+            return [(meta["path"], str(error))]
+        return []
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Serve the requests of a single client connection."""
+
+    def handle(self) -> None:
+        """Apply requests and reply to each until the client disconnects."""
+        store: RemoteStore = self.server.store
+        client = f"{self.client_address[0]}:{self.client_address[1]}"
+        files = 0
+        received = 0
+        try:
+            header = _read_frame(self.rfile)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Connection from {client} failed: {e}")
+            return
+        if header is None:
+            return
+        if not store.accepts(header):
+            logger.warning(f"Rejected connection from {client}: invalid token")
+            try:
+                _write_frame(self.wfile.write, {"errors": [["", "Invalid token"]]})
+            except OSError:
+                pass
+            return
+        try:
+            _write_frame(self.wfile.write, {"errors": []})
+        except OSError:
+            return
+        while True:
+            try:
+                header = _read_frame(self.rfile)
+                if header is None:
+                    break
+                errors = store.receive(header, self.rfile)
+            except OSError as e:
+                logger.warning(f"Connection from {client} failed: {e}")
+                break
+            except ValueError as e:
+                logger.warning(f"Invalid request from {client}: {e}")
+                break
+            except KeyError as e:
+                logger.warning(f"Invalid request from {client}: missing {e}")
+                break
+            for error in errors:
+                logger.error(f"Unable to write {error[0]} from {client}: {error[1]}")
+            if header.get("op") == "file":
+                files += 1
+                received += header["size"]
+            elif header.get("op") == "batch":
+                files += len(header["files"])
+                received += sum(m["size"] for m in header["files"])
+            try:
+                _write_frame(self.wfile.write, {"errors": errors})
+            except OSError:
+                break
+        if files:
+            logger.info(
+                f"Received {files} files ({format_bytes(received)}) from {client}"
+            )
+
+
+class BackupServer(socketserver.ThreadingTCPServer):
+    """A TCP server that writes the files clients send to a store.
+
+    Each client connection is served by its own thread. Without a token
+    any client that can connect may write to the store, so the server
+    should then only listen on trusted networks.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(
+        self,
+        root: Path,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        token: str | None = None,
+    ):
+        """Bind the server.
+
+        Args:
+            root: Directory received files are stored under, one
+                subdirectory per profile.
+            host: Address to listen on.
+            port: TCP port to listen on. ``0`` picks a free port.
+            token: Secret clients must present before sending files, or
+                ``None`` to accept any client.
+        """
+        self.store = RemoteStore(root, token)
+        super().__init__((host, port), _RequestHandler)
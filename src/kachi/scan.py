@@ -0,0 +1,387 @@
+"""Incremental directory walks that skip unchanged directories.
+
+Listing directories dominates the cost of walking a large tree that has
+barely changed. A fast scan records each directory's modification time,
+link count and contents at the end of a run. Creating, removing or
+renaming an entry updates a directory's modification time, so on the next
+run a directory whose metadata is unchanged is not listed again. Its files
+are still stat'ed, because writing to a file in place does not touch its
+directory. Every few runs a full rescan lists every directory again, in
+case a file system does not update directory times reliably, and checks
+every file's copy in the destination so a deleted or damaged copy is
+replaced.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import stat
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from kachi.compression import SUFFIXES
+from kachi.config import FastScan
+from kachi.dedup import RECIPE_SUFFIX
+
+# Subdirectory of the state directory holding one folder per profile.
+SCAN_DIRNAME = "scan"
+
+STATE_VERSION = 1
+
+
+@dataclass
+class ScanStats:
+    """Work done by a fast scan of one source tree.
+
+    Attributes:
+        full: Whether every directory was listed.
+        dirs_listed: Directories whose entries were listed.
+        dirs_reused: Directories whose entries were taken from the state.
+        files: Files checked for changes.
+        copied: Files copied because they were new or had changed.
+    """
+
+    full: bool = False
+    dirs_listed: int = 0
+    dirs_reused: int = 0
+    files: int = 0
+    copied: int = 0
+
+
+class ScanState:
+    """Directory listings of one source tree, recorded by the previous run."""
+
+    def __init__(self, path: Path):
+        """Initialize an empty state.
+
+        Args:
+            path: The JSON file the state is loaded from and saved to.
+        """
+        self.path = path
+        self.runs_since_full = 0
+        self.dirs: dict[str, dict] = {}
+
+    @classmethod
+    def for_source(cls, scan_dir: Path, src: Path, dest: Path) -> "ScanState":
+        """Create the state for copying a source to a destination.
+
+        Args:
+            scan_dir: Directory holding the profile's scan states.
+            src: The source directory.
+            dest: The directory the source is copied to.
+
+        Returns:
+            An empty state whose file is unique to the source and
+            destination pair.
+        """
+        key = f"{src.absolute()}\0{dest.absolute()}".encode()
+        return cls(scan_dir / f"{hashlib.sha1(key).hexdigest()}.json")
+
+    def load(self) -> bool:
+        """Load the state recorded by the previous run.
+
+        Returns:
+            True if a usable state was loaded, False if there was none or
+            it could not be read.
+        """
+        try:
+            data = json.loads(self.path.read_text(encoding="utf8"))
+        except OSError:
+            return False
+        except ValueError:
+            return False
+        if data.get("version") != STATE_VERSION:
+            return False
+        self.runs_since_full = data["runs_since_full"]
+        self.dirs = data["dirs"]
+        return True
+
+    def save(self) -> None:
+        """Write the state, replacing the previous file atomically."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        data = {
+            "version": STATE_VERSION,
+            "runs_since_full": self.runs_since_full,
+            "dirs": self.dirs,
+        }
+        tmp.write_text(json.dumps(data, separators=(",", ":")), encoding="utf8")
+        os.replace(tmp, self.path)
+
+
+def _copy_intact(dest: Path, file_stat: os.stat_result) -> bool:
+    """Whether the destination holds an up-to-date copy of a file.
+
+    Compressed copies and dedup recipes are looked for under their suffixed
+    names. Their size differs from the source, so only the modification
+    time is compared for them.
+
+    Args:
+        dest: The path the file is copied to.
+        file_stat: ``stat`` result of the source file.
+
+    Returns:
+        True if a copy with the source's modification time, and for plain
+        copies its size, exists.
+    """
+    for suffix in ("", *SUFFIXES.values(), RECIPE_SUFFIX):
+        try:
+            dest_stat = os.stat(f"{dest}{suffix}")
+        except OSError:
+            continue
+        if dest_stat.st_mtime_ns != file_stat.st_mtime_ns:
+            return False
+        return bool(suffix) or dest_stat.st_size == file_stat.st_size
+    return False
+
+
+class _TreeWalk:
+    """Copy new and changed files of a tree, reusing unchanged listings."""
+
+    def __init__(
+        self,
+        copy_function: Callable,
+        previous: dict,
+        full: bool,
+        on_skip: Callable[[Path, Path, int], None] | None = None,
+    ):
+        """Initialize the walk.
+
+        Args:
+            copy_function: Called with the source and destination path of
+                every file that needs copying.
+            previous: Directory records from the previous run.
+            full: List every directory, ignoring the recorded metadata.
+            on_skip: Called with the source path, destination path and
+                size of every file that is already up to date.
+        """
+        self.copy_function = copy_function
+        self.on_skip = on_skip
+        self.previous = previous
+        self.stats = ScanStats(full=full)
+        self.dirs: dict[str, dict] = {}
+        self.errors: list[tuple[str, str, str]] = []
+        self.copied: dict[str, tuple[str, str]] = {}
+
+    def walk(self, rel: str, src_dir: Path, dest_dir: Path) -> None:
+        """Copy the changes in a directory and its subdirectories.
+
+        Args:
+            rel: Path of the directory relative to the source root, in
+                POSIX form. The root is ``"."``.
+            src_dir: The source directory.
+            dest_dir: The matching destination directory.
+        """
+        try:
+            dir_stat = os.stat(src_dir)
+        except OSError as e:
+            self.errors.append((str(src_dir), str(dest_dir), str(e)))
+            return
+
+        prev = self.previous.get(rel)
+        entries = None
+        if (
+            prev is not None
+            and not self.stats.full
+            and prev["mtime"] == dir_stat.st_mtime_ns
+            and prev["nlink"] == dir_stat.st_nlink
+        ):
+            entries = self._reuse(src_dir, prev)
+        listed = entries is None
+        if listed:
+            entries = self._list(src_dir, dest_dir)
+            if entries is None:
+                return
+        else:
+            self.stats.dirs_reused += 1
+        files, subdirs = entries
+
+        known = prev["files"] if prev is not None else {}
+        record = {
+            "mtime": dir_stat.st_mtime_ns,
+            "nlink": dir_stat.st_nlink,
+            "files": {},
+            "dirs": subdirs,
+        }
+        for name, file_stat in files.items():
+            self.stats.files += 1
+            key = [file_stat.st_size, file_stat.st_mtime_ns]
+            if known.get(name) != key or (
+                self.stats.full and not _copy_intact(dest_dir / name, file_stat)
+            ):
+                try:
+                    self.copy_function(str(src_dir / name), str(dest_dir / name))
+                except OSError as e:
+                    # Record the file without its metadata so it is retried.
+                    self.errors.append(
+                        (str(src_dir / name), str(dest_dir / name), str(e))
+                    )
+                    key = None
+                else:
+                    self.stats.copied += 1
+                    self.copied[str(src_dir / name)] = (rel, name)
+            elif self.on_skip is not None:
+                self.on_skip(src_dir / name, dest_dir / name, file_stat.st_size)
+            record["files"][name] = key
+        self.dirs[rel] = record
+
+        for name in subdirs:
+            child = name if rel == "." else f"{rel}/{name}"
+            self.walk(child, src_dir / name, dest_dir / name)
+
+        if listed:
+            # Like shutil.copytree, copy the directory's metadata once its
+            # contents are written, so a read-only mode cannot block them.
+            try:
+                shutil.copystat(src_dir, dest_dir)
+            except OSError as e:
+                self.errors.append((str(src_dir), str(dest_dir), str(e)))
+
+    def forget(self, errors: list[tuple[str, str, str]]) -> None:
+        """Drop the recorded metadata of copies that failed after the walk.
+
+        Args:
+            errors: ``(src, dst, reason)`` tuples for the failed files.
+        """
+        for src, _, _ in errors:
+            if src in self.copied:
+                rel, name = self.copied[src]
+                self.dirs[rel]["files"][name] = None
+
+    def _reuse(self, src_dir: Path, prev: dict) -> tuple[dict, list] | None:
+        """Stat the files of an unchanged directory without listing it.
+
+        Args:
+            src_dir: The source directory.
+            prev: The directory's record from the previous run.
+
+        Returns:
+            The files and subdirectories, as returned by ``_list``, or
+            ``None`` if a recorded file has gone or is no longer a regular
+            file, and the directory must be listed after all.
+        """
+        files = {}
+        for name in prev["files"]:
+            try:
+                files[name] = os.stat(src_dir / name)
+            except FileNotFoundError:
+                return None
+            if not stat.S_ISREG(files[name].st_mode):
+                return None
+        return files, prev["dirs"]
+
+    def _list(self, src_dir: Path, dest_dir: Path) -> tuple[dict, list] | None:
+        """List a directory and create its destination.
+
+        Symlinks are followed, matching ``shutil.copytree``. Entries that
+        are neither files nor directories, such as FIFOs, are recorded as
+        errors rather than copied, as opening them could block forever.
+
+        Args:
+            src_dir: The source directory.
+            dest_dir: The matching destination directory.
+
+        Returns:
+            A tuple containing:
+            - Mapping of regular file name to its ``stat`` result.
+            - Names of the subdirectories.
+            ``None`` is returned if the directory could not be listed.
+        """
+        files = {}
+        subdirs = []
+        try:
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            with os.scandir(src_dir) as it:
+                entries = list(it)
+        except OSError as e:
+            self.errors.append((str(src_dir), str(dest_dir), str(e)))
+            return None
+        self.stats.dirs_listed += 1
+
+        for entry in entries:
+            try:
+                entry_stat = entry.stat()
+            except OSError as e:
+                self.errors.append((entry.path, str(dest_dir / entry.name), str(e)))
+                continue
+            if stat.S_ISDIR(entry_stat.st_mode):
+                subdirs.append(entry.name)
+            elif stat.S_ISREG(entry_stat.st_mode):
+                files[entry.name] = entry_stat
+            else:
+                self.errors.append(
+                    (
+                        entry.path,
+                        str(dest_dir / entry.name),
+                        f"{entry.path} is not a regular file",
+                    )
+                )
+        return files, sorted(subdirs)
+
+
+def fast_copy_tree(
+    src: Path,
+    dest: Path,
+    copy_function: Callable,
+    scan_dir: Path,
+    settings: FastScan,
+    on_skip: Callable[[Path, Path, int], None] | None = None,
+    flush: Callable[[], None] | None = None,
+) -> ScanStats:
+    """Copy the new and changed files of a directory tree.
+
+    Only files whose size or modification time differ from the previous
+    run are copied. Files deleted from the source are left in the
+    destination, as with ``shutil.copytree``.
+
+    Args:
+        src: Source directory.
+        dest: Directory the source is copied to.
+        copy_function: Called with the source and destination path of
+            every file that needs copying.
+        scan_dir: Directory holding the profile's scan states.
+        settings: The profile's fast scan settings.
+        on_skip: Called with the source path, destination path and size of
+            every file that is already up to date.
+        flush: Called before the state is saved to finish copies that
+            ``copy_function`` only queued, such as compressed or durable
+            writes. Files it reports as failed, by raising
+            ``shutil.Error``, are retried on the next run. If it raises
+            any other ``OSError`` the state is not saved at all.
+
+    Returns:
+        What the scan did.
+
+    Raises:
+        shutil.Error: If any entries could not be copied, after the rest
+            of the tree has been copied and the state saved.
+    """
+    state = ScanState.for_source(scan_dir, src, dest)
+    # Without a previous copy in the destination, every file is copied.
+    loaded = state.load() and dest.is_dir()
+    full = not loaded or state.runs_since_full + 1 >= settings.full_rescan_every
+
+    tree = _TreeWalk(copy_function, state.dirs if loaded else {}, full, on_skip)
+    tree.walk(".", src, dest)
+
+    if flush is not None:
+        try:
+            flush()
+        except shutil.Error as e:
+            tree.forget(e.args[0])
+            tree.errors.extend(e.args[0])
+        except OSError as e:
+            # Which queued copies were committed is unknown, so keep the
+            # previous state and check them all again next run.
+            tree.errors.append((str(src), str(dest), str(e)))
+            raise shutil.Error(tree.errors)
+
+    state.dirs = tree.dirs
+    state.runs_since_full = 0 if full else state.runs_since_full + 1
+    state.save()
+
+    if tree.errors:
+        raise shutil.Error(tree.errors)
+    return tree.stats
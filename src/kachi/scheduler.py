@@ -0,0 +1,413 @@
+"""Device-aware parallel scheduling of backup work.
+
+Every source of every profile becomes a work item tagged with the devices
+(``st_dev``) it reads from and writes to. Items run in parallel as long as
+each of their devices has spare capacity: spinning disks take one item at
+a time by default, other devices a few. Independent disks therefore stay
+busy without two profiles thrashing a disk they share. Items that copy to
+the same destination path, such as two profiles inheriting the default
+profile's sources and destination, never run at the same time. When a
+profile links duplicate files, its items share a single index of the
+duplicates across all of its sources.
+"""
+
+import dataclasses
+import os
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from kachi import logger
+from kachi.backup import backup_profile
+from kachi.compression import CompressionStats
+from kachi.config import Profile, Scheduling
+from kachi.dedup import DedupStats
+from kachi.engine import CopyEngine, SourceStats, Throttle, TransferStats
+from kachi.errors import DestinationError
+from kachi.links import DuplicateIndex, find_duplicates
+
+
+def device_of(path: Path) -> int | None:
+    """Return the device a path lives on.
+
+    Args:
+        path: The path to look up.
+
+    Returns:
+        The ``st_dev`` of the path, or ``None`` if it does not exist.
+    """
+    try:
+        return path.stat().st_dev
+    except OSError:
+        return None
+
+
+def is_rotational(device: int) -> bool | None:
+    """Whether a device is a spinning disk.
+
+    Only Linux exposes this, through ``/sys/dev/block``. Partitions are
+    resolved to the disk they belong to.
+
+    Args:
+        device: A device number as returned by ``device_of``.
+
+    Returns:
+        True or False on Linux for block devices, otherwise ``None``.
+    """
+    # Windows has no major and minor device numbers.
+    if not hasattr(os, "major"):
+        return None
+    block = Path(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+    for queue in (block / "queue", block / ".." / "queue"):
+        try:
+            return (queue / "rotational").read_text().strip() == "1"
+        except OSError:
+            continue
+    return None
+
+
+@dataclass
+class DeviceStats:
+    """Throughput of a single device over a scheduled run.
+
+    Attributes:
+        device: The device number.
+        label: A path on the device, for display.
+        limit: Maximum number of concurrent work items on the device.
+        rotational: Whether the device is a spinning disk, if known.
+        files: Files copied from or to the device.
+        bytes: Bytes copied from or to the device.
+        busy_seconds: Time during which at least one item used the device.
+    """
+
+    device: int
+    label: str
+    limit: int
+    rotational: bool | None = None
+    files: int = 0
+    bytes: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second while the device was busy."""
+        return self.bytes / self.busy_seconds if self.busy_seconds else 0.0
+
+
+@dataclass
+class ProfileRun:
+    """Combined results of the work items of one profile.
+
+    Attributes:
+        profile: The profile that was backed up.
+        stats: Transfer statistics summed over all items.
+        compression: Compression statistics, if the profile compresses.
+        dedup: Dedup statistics, if the profile stores chunks.
+        sources: Time taken and data copied for each source backed up.
+        not_found: Sources that could not be located.
+        success: Number of sources backed up.
+        errors: Number of errors encountered.
+        aborted: Whether the profile had no valid destination.
+        started: ``time.perf_counter`` value when the first item started.
+        finished: ``time.perf_counter`` value when the last item finished.
+    """
+
+    profile: Profile
+    stats: TransferStats = field(default_factory=TransferStats)
+    compression: CompressionStats | None = None
+    dedup: DedupStats | None = None
+    sources: dict[Path, SourceStats] = field(default_factory=dict)
+    not_found: list[Path] = field(default_factory=list)
+    success: int = 0
+    errors: int = 0
+    aborted: bool = False
+    started: float | None = None
+    finished: float | None = None
+
+    @property
+    def seconds(self) -> float:
+        """Wall-clock time from the first item starting to the last ending."""
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+class _SharedLinks:
+    """Duplicate index of a profile, built once for all of its work items."""
+
+    def __init__(self, profile: Profile):
+        """Initialize without building the index yet.
+
+        Args:
+            profile: The profile whose sources are indexed.
+        """
+        self.profile = profile
+        self._lock = threading.Lock()
+        self._index: DuplicateIndex | None = None
+
+    def get(self) -> DuplicateIndex:
+        """Return the index, building it on first use.
+
+        Returns:
+            The duplicates among all of the profile's sources.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = find_duplicates(self.profile.sources)
+                logger.debug(
+                    f"Found {len(self._index)} source files with identical "
+                    f"content for profile '{self.profile.name}'"
+                )
+            return self._index
+
+
+@dataclass
+class _WorkItem:
+    """A single source of a profile, with the devices it touches."""
+
+    run: ProfileRun
+    profile: Profile
+    devices: tuple[int, ...]
+    targets: set[Path] = field(default_factory=set)
+    links: _SharedLinks | None = None
+    throttle: Throttle | None = None
+
+
+class DeviceScheduler:
+    """Run profile sources in parallel with one concurrency limit per device."""
+
+    def __init__(
+        self,
+        scheduling: Scheduling,
+        make_engine: Callable[[Profile, Throttle], CopyEngine],
+    ):
+        """Initialize the scheduler.
+
+        Args:
+            scheduling: Worker and per-device concurrency limits.
+            make_engine: Returns a new copy engine for a profile, given the
+                throttle enforcing the profile's rate limits. Each work
+                item gets its own engine, but the items of a profile share
+                one throttle, so the profile's limits hold however many of
+                its sources run at once.
+        """
+        self.scheduling = scheduling
+        self.make_engine = make_engine
+        self.devices: dict[int, DeviceStats] = {}
+        self._cond = threading.Condition()
+        self._in_use: Counter[int] = Counter()
+        self._busy_since: dict[int, float] = {}
+        self._writing: set[Path] = set()
+        self._running = 0
+
+    def _register(self, path: Path) -> int | None:
+        """Look up the device of a path and track it.
+
+        Args:
+            path: A source or destination path.
+
+        Returns:
+            The device number, or ``None`` if the path does not exist.
+        """
+        device = device_of(path)
+        if device is not None and device not in self.devices:
+            rotational = is_rotational(device)
+            limit = (
+                self.scheduling.rotational_limit
+                if rotational
+                else self.scheduling.device_limit
+            )
+            self.devices[device] = DeviceStats(
+                device=device, label=str(path), limit=limit, rotational=rotational
+            )
+        return device
+
+    def plan(self, profiles: list[Profile]) -> list[_WorkItem]:
+        """Split profiles into per-source work items tagged with devices.
+
+        Args:
+            profiles: The profiles to back up.
+
+        Returns:
+            The work items, in configuration order.
+        """
+        items = []
+        for profile in profiles:
+            run = ProfileRun(profile=profile)
+            dest_devices = {
+                self._register(d) for d in profile.destinations if isinstance(d, Path)
+            }
+            # Duplicates are only linked within a single local destination.
+            links = (
+                _SharedLinks(profile)
+                if profile.link_duplicates
+                and isinstance(profile.backup_destination, Path)
+                else None
+            )
+            throttle = Throttle(profile.limits)
+            for src in profile.sources:
+                devices = dest_devices | {self._register(src)}
+                devices.discard(None)
+                item_profile = dataclasses.replace(profile, sources=[src])
+                items.append(
+                    _WorkItem(
+                        run=run,
+                        profile=item_profile,
+                        devices=tuple(sorted(devices)),
+                        targets=item_profile.targets,
+                        links=links,
+                        throttle=throttle,
+                    )
+                )
+        return items
+
+    def run(self, profiles: list[Profile]) -> list[ProfileRun]:
+        """Back up the profiles, running independent devices in parallel.
+
+        Args:
+            profiles: The profiles to back up.
+
+        Returns:
+            One combined result per profile, in the order given.
+        """
+        items = self.plan(profiles)
+        runs = list({id(item.run): item.run for item in items}.values())
+        runs.extend(ProfileRun(profile=p) for p in profiles if not p.sources)
+
+        pending = list(items)
+        self._running = 0
+        with ThreadPoolExecutor(max_workers=self.scheduling.workers) as executor:
+            with self._cond:
+                while pending or self._running:
+                    item = None
+                    if self._running < self.scheduling.workers:
+                        item = next((i for i in pending if self._has_room(i)), None)
+                    if item is None:
+                        self._cond.wait()
+                        continue
+                    pending.remove(item)
+                    self._acquire(item)
+                    self._running += 1
+                    executor.submit(self._run_item, item)
+
+        order = {id(p): i for i, p in enumerate(profiles)}
+        return sorted(runs, key=lambda r: order[id(r.profile)])
+
+    def _has_room(self, item: _WorkItem) -> bool:
+        """Whether every device of an item has spare capacity.
+
+        An item also waits while another item copies to the same path.
+
+        Args:
+            item: The work item to check.
+
+        Returns:
+            True if the item can start now.
+        """
+        if item.targets & self._writing:
+            return False
+        return all(self._in_use[d] < self.devices[d].limit for d in item.devices)
+
+    def _acquire(self, item: _WorkItem) -> None:
+        """Mark an item's devices as in use. Called with the lock held.
+
+        Args:
+            item: The work item that is starting.
+        """
+        now = time.perf_counter()
+        self._writing |= item.targets
+        for device in item.devices:
+            if self._in_use[device] == 0:
+                self._busy_since[device] = now
+            self._in_use[device] += 1
+
+    def _release(self, item: _WorkItem) -> None:
+        """Free an item's devices. Called with the lock held.
+
+        Args:
+            item: The work item that finished.
+        """
+        now = time.perf_counter()
+        self._writing -= item.targets
+        for device in item.devices:
+            self._in_use[device] -= 1
+            if self._in_use[device] == 0:
+                self.devices[device].busy_seconds += now - self._busy_since[device]
+
+    def _run_item(self, item: _WorkItem) -> None:
+        """Back up a single work item and record its results.
+
+        Args:
+            item: The work item to run.
+        """
+        not_found, success, errors, aborted = [], 0, 1, False
+        engine = None
+        started = time.perf_counter()
+        try:
+            engine = self.make_engine(item.run.profile, item.throttle)
+            if item.links is not None and not (
+                engine.compressor or engine.deduplicator
+            ):
+                engine.links = item.links.get()
+            not_found, success, errors = backup_profile(item.profile, engine)
+        except DestinationError:
+            aborted = True
+        except Exception as e:
+            logger.error(f"Unexpected error backing up {item.profile.sources[0]}: {e}")
+        finally:
+            self._finish(item, engine, started, not_found, success, errors, aborted)
+
+    def _finish(
+        self,
+        item: _WorkItem,
+        engine: CopyEngine | None,
+        started: float,
+        not_found: list[Path],
+        success: int,
+        errors: int,
+        aborted: bool,
+    ) -> None:
+        """Record the results of a work item and free its devices.
+
+        Args:
+            item: The work item that finished.
+            engine: The engine the item used, if it was created.
+            started: ``time.perf_counter`` value when the item started.
+            not_found: Sources that could not be located.
+            success: Number of sources backed up.
+            errors: Number of errors encountered.
+            aborted: Whether the profile had no valid destination.
+        """
+        finished = time.perf_counter()
+        with self._cond:
+            run = item.run
+            run.not_found.extend(not_found)
+            run.success += success
+            run.errors += errors
+            run.aborted = run.aborted or aborted
+            run.started = started if run.started is None else min(run.started, started)
+            run.finished = (
+                finished if run.finished is None else max(run.finished, finished)
+            )
+            if engine is not None:
+                run.stats.merge(engine.stats)
+                run.sources.update(engine.sources)
+                if engine.compressor:
+                    if run.compression is None:
+                        run.compression = CompressionStats()
+                    run.compression.merge(engine.compressor.stats)
+                if engine.deduplicator:
+                    if run.dedup is None:
+                        run.dedup = DedupStats()
+                    run.dedup.merge(engine.deduplicator.stats)
+                for device in item.devices:
+                    self.devices[device].files += engine.stats.files
+                    self.devices[device].bytes += engine.stats.bytes
+
+            self._release(item)
+            self._running -= 1
+            self._cond.notify()
@@ -0,0 +1,107 @@
+"""Helpers for formatting and parsing byte sizes and durations."""
+
+import re
+
+_SIZE_UNITS = ["B", "KB", "MB", "GB", "TB", "PB"]
+_SIZE_PATTERN = re.compile(
+    r"^\s*(\d+(?:\.\d+)?)\s*([KMGTP]?)(?:i?B)?\s*$", re.IGNORECASE
+)
+_DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+_DURATION_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$", re.IGNORECASE)
+
+
+def format_bytes(num_bytes: float) -> str:
+    """Format a byte count as a human-readable string.
+
+    Args:
+        num_bytes: The number of bytes to format.
+
+    Returns:
+        The size using binary multiples, e.g. ``"1.5 MB"``.
+    """
+    size = float(num_bytes)
+    for unit in _SIZE_UNITS:
+        if abs(size) < 1024 or unit == _SIZE_UNITS[-1]:
+            if unit == "B":
+                return f"{int(size)} {unit}"
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} {_SIZE_UNITS[-1]}"  # pragma: no cover
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration in seconds as a human-readable string.
+
+    Args:
+        seconds: The duration to format.
+
+    Returns:
+        The duration, e.g. ``"2m 05s"`` or ``"0.4s"``.
+    """
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, secs = divmod(int(round(seconds)), 60)
+    if minutes < 60:
+        return f"{minutes}m {secs:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+def parse_size(value: int | float | str) -> int:
+    """Parse a byte size from the configuration file.
+
+    Plain numbers are taken as bytes. Strings may carry a unit suffix such
+    as ``"512K"``, ``"10MB"`` or ``"1.5GiB"``; units are binary multiples,
+    matching ``format_bytes``.
+
+    Args:
+        value: The size to parse.
+
+    Returns:
+        The size in bytes.
+
+    Raises:
+        ValueError: If the value is not a valid, non-negative size.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid size: {value!r}")
+    if isinstance(value, (int, float)):
+        if value < 0:
+            raise ValueError(f"Invalid size: {value!r}")
+        return int(value)
+
+    match = _SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value!r}")
+    number, unit = match.groups()
+    exponent = _SIZE_UNITS.index(f"{unit.upper()}B") if unit else 0
+    return int(float(number) * 1024**exponent)
+
+
+def parse_duration(value: int | float | str) -> float:
+    """Parse a duration from the configuration file.
+
+    Plain numbers are taken as seconds. Strings may carry a unit suffix:
+    ``s``, ``m``, ``h`` or ``d``, e.g. ``"90s"``, ``"15m"`` or ``"6h"``.
+
+    Args:
+        value: The duration to parse.
+
+    Returns:
+        The duration in seconds.
+
+    Raises:
+        ValueError: If the value is not a valid, non-negative duration.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid duration: {value!r}")
+    if isinstance(value, (int, float)):
+        if value < 0:
+            raise ValueError(f"Invalid duration: {value!r}")
+        return float(value)
+
+    match = _DURATION_PATTERN.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid duration: {value!r}")
+    number, unit = match.groups()
+    return float(number) * _DURATION_UNITS[unit.lower()]
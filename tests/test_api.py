@@ -0,0 +1,104 @@
+"""Tests for the streaming backup API."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.api import BackupResult, backup_events
+from kachi.config import FastScan, Profile
+from kachi.dirfd import copy_at
+from kachi.engine import CopyEngine
+from kachi.events import FileCopied, FileFailed, FileSkipped
+
+
+def _run(events) -> tuple[list, BackupResult]:
+    """Consume an event generator, returning its events and result."""
+    seen = []
+    while True:
+        try:
+            seen.append(next(events))
+        except StopIteration as stop:
+            return seen, stop.value
+
+
+@pytest.fixture
+def profile(tmp_path: Path) -> Profile:
+    """Create a profile with a directory of three files and a destination."""
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ("a.txt", "b.txt", "c.txt"):
+        (src / name).write_text(name)
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    return Profile(name="p", sources=[src], backup_destination=dest)
+
+
+class TestBackupEvents:
+    """Tests for backup_events."""
+
+    def test_yields_an_event_per_file(self, profile: Profile, tmp_path: Path):
+        """Test that every copied file is reported and summarized."""
+        events, result = _run(backup_events(profile))
+
+        assert len(events) == 3
+        assert all(isinstance(e, FileCopied) for e in events)
+        assert {e.dst for e in events} == {
+            tmp_path / "dest" / "src" / n for n in ("a.txt", "b.txt", "c.txt")
+        }
+        assert result.copied == 3
+        assert result.bytes == 15
+        assert (result.success, result.errors) == (1, 0)
+
+    def test_reports_failed_files(self, profile: Profile):
+        """Test that a file that cannot be copied yields a FileFailed event."""
+        real_copy_at = copy_at
+
+        def fail_b(src_dir_fd, dst_dir_fd, name, st):
+            if name == "b.txt":
+                raise PermissionError("denied")
+            return real_copy_at(src_dir_fd, dst_dir_fd, name, st)
+
+        with patch("kachi.engine.copy_at", side_effect=fail_b):
+            events, result = _run(backup_events(profile))
+
+        failed = [e for e in events if isinstance(e, FileFailed)]
+        assert [e.src.name for e in failed] == ["b.txt"]
+        assert result.failed == 1
+        assert result.copied == 2
+        assert result.errors == 1
+
+    def test_reports_skipped_files(self, profile: Profile, tmp_path: Path):
+        """Test that fast scans report files that are already up to date."""
+
+        def make_engine() -> CopyEngine:
+            return CopyEngine(fast_scan=FastScan(), scan_dir=tmp_path / "scan")
+
+        _run(backup_events(profile, make_engine()))
+        events, result = _run(backup_events(profile, make_engine()))
+
+        assert all(isinstance(e, FileSkipped) for e in events)
+        assert result.skipped == 3
+        assert result.copied == 0
+
+    def test_closing_early_stops_the_backup(self, profile: Profile):
+        """Test that closing the generator cancels the remaining files."""
+        src = profile.sources[0]
+        for i in range(50):
+            (src / f"extra{i}.txt").write_text("x")
+        events = backup_events(profile, max_pending=1)
+
+        first = next(events)
+        events.close()
+
+        assert isinstance(first, FileCopied)
+        assert len(list(first.dst.parent.iterdir())) < 53
+
+    def test_invalid_destination_aborts(self, profile: Profile, tmp_path: Path):
+        """Test that a run without a valid destination is marked aborted."""
+        profile.backup_destination = tmp_path / "missing"
+
+        events, result = _run(backup_events(profile))
+
+        assert events == []
+        assert result.aborted
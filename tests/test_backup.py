@@ -6,8 +6,9 @@ from unittest.mock import patch
 import pytest
 import typer
 
-from src.kachi.backup import backup_dir, backup_file, backup_profile, log_not_found
-from src.kachi.config import Profile
+from kachi.backup import backup_dir, backup_file, backup_profile, log_not_found
+from kachi.config import FastScan, Profile
+from kachi.errors import DestinationError
 
 
 class TestBackupFunctions:
@@ -70,7 +71,7 @@ class TestBackupFunctions:
             backup_destination=tmp_path / "invalid-dir",
         )
 
-        with pytest.raises(Exception):
+        with pytest.raises(DestinationError):
             backup_profile(profile)
 
     def test_invalid_source_in_profile(self, tmp_path: Path):
@@ -234,3 +235,101 @@ class TestBackupFunctions:
         assert len(nf) == 1
         assert success_count == 1
         assert error_count == 1
+
+    def test_backup_profile_multiple_destinations(self, tmp_path: Path):
+        """Test that every destination receives a copy of each source."""
+        src_dir = tmp_path / "test-dir"
+        src_dir.mkdir()
+        (src_dir / "test-file-1.txt").write_text("test content")
+        src_file = tmp_path / "test-file-2.txt"
+        src_file.write_text("more content")
+        dests = [tmp_path / "backup-1", tmp_path / "backup-2"]
+        for dest in dests:
+            dest.mkdir()
+
+        nf, success_count, error_count = backup_profile(
+            Profile(
+                name="test_profile",
+                sources=[src_dir, src_file],
+                backup_destination=dests,
+            )
+        )
+
+        assert nf == []
+        assert success_count == 2
+        assert error_count == 0
+        for dest in dests:
+            assert (dest / "test-dir" / "test-file-1.txt").read_text() == (
+                "test content"
+            )
+            assert (dest / "test-file-2.txt").read_text() == "more content"
+
+    def test_backup_profile_multiple_destinations_warns_about_fast_scan(
+        self, tmp_path: Path, caplog: pytest.LogCaptureFixture
+    ):
+        """Test that fast scans are reported as not applied to a fan-out."""
+        src_file = tmp_path / "test-file.txt"
+        src_file.write_text("test content")
+        dests = [tmp_path / "backup-1", tmp_path / "backup-2"]
+        for dest in dests:
+            dest.mkdir()
+
+        backup_profile(
+            Profile(
+                name="test_profile",
+                sources=[src_file],
+                backup_destination=dests,
+                fast_scan=FastScan(),
+            )
+        )
+
+        assert "fast scans are not applied" in caplog.text
+
+    def test_backup_profile_skips_invalid_destination_of_several(
+        self, tmp_path: Path, caplog: pytest.LogCaptureFixture
+    ):
+        """Test that one invalid destination does not stop the others."""
+        src_file = tmp_path / "test-file.txt"
+        src_file.write_text("test content")
+        good = tmp_path / "backup-1"
+        good.mkdir()
+        missing = tmp_path / "missing"
+
+        nf, success_count, error_count = backup_profile(
+            Profile(
+                name="test_profile",
+                sources=[src_file],
+                backup_destination=[good, missing],
+            )
+        )
+
+        assert (good / "test-file.txt").exists()
+        assert success_count == 1
+        assert error_count == 1
+        assert str(missing) in caplog.text
+
+    def test_backup_profile_reports_failing_destination(
+        self, tmp_path: Path, caplog: pytest.LogCaptureFixture
+    ):
+        """Test that a destination failing mid-run is reported on its own."""
+        src_dir = tmp_path / "test-dir"
+        src_dir.mkdir()
+        (src_dir / "test-file.txt").write_text("test content")
+        good = tmp_path / "backup-1"
+        broken = tmp_path / "backup-2"
+        good.mkdir()
+        broken.mkdir()
+        (broken / "test-dir").write_text("not a directory")
+
+        nf, success_count, error_count = backup_profile(
+            Profile(
+                name="test_profile",
+                sources=[src_dir],
+                backup_destination=[good, broken],
+            )
+        )
+
+        assert (good / "test-dir" / "test-file.txt").exists()
+        assert success_count == 0
+        assert error_count == 1
+        assert f"1 source not fully backed up to {broken}" in caplog.text
@@ -0,0 +1,192 @@
+"""Tests for copies that keep data out of the page cache."""
+
+import errno
+import io
+import os
+import random
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.cache import CHUNK_SIZE, CacheSnapshot, cache_snapshot, copy_uncached
+from kachi.config import DropCache
+from kachi.engine import CopyEngine
+
+
+class TestCacheSnapshot:
+    """Tests for cache_snapshot."""
+
+    def test_reads_meminfo(self, tmp_path: Path):
+        """Test that the Cached and Dirty fields are read in bytes."""
+        meminfo = tmp_path / "meminfo"
+        meminfo.write_text(
+            "MemTotal:       16318480 kB\n"
+            "Cached:          2048000 kB\n"
+            "SwapCached:            0 kB\n"
+            "Dirty:               512 kB\n"
+        )
+
+        assert cache_snapshot(meminfo) == CacheSnapshot(
+            cached=2048000 * 1024, dirty=512 * 1024
+        )
+
+    def test_missing_meminfo(self, tmp_path: Path):
+        """Test that platforms without /proc/meminfo give None."""
+        assert cache_snapshot(tmp_path / "missing") is None
+
+
+class TestCopyUncached:
+    """Tests for copy_uncached."""
+
+    @pytest.mark.parametrize("direct", [False, True])
+    def test_copies_data(self, tmp_path: Path, direct: bool):
+        """Test that whole chunks and an unaligned tail are copied exactly."""
+        data = random.Random(0).randbytes(2 * CHUNK_SIZE + 12345)
+        src = tmp_path / "src.bin"
+        src.write_bytes(data)
+        chunks = []
+
+        copied = copy_uncached(src, tmp_path / "dst.bin", chunks.append, direct)
+
+        assert copied == len(data)
+        assert sum(chunks) == len(data)
+        assert (tmp_path / "dst.bin").read_bytes() == data
+
+    def test_opens_files_in_binary_mode(self, tmp_path: Path):
+        """Test that O_BINARY is passed where the platform defines it."""
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"line\r\n")
+        # A stand-in bit on platforms without O_BINARY, removed before the
+        # real open so the kernel never sees it.
+        stand_in = 0 if hasattr(os, "O_BINARY") else 1 << 30
+        binary = getattr(os, "O_BINARY", stand_in)
+        real_open = os.open
+        flags = []
+
+        def recording_open(path, flag, mode=0o777):
+            flags.append(flag)
+            return real_open(path, flag & ~stand_in, mode)
+
+        with (
+            patch.object(os, "O_BINARY", binary, create=True),
+            patch("kachi.cache.os.open", side_effect=recording_open),
+        ):
+            copy_uncached(src, tmp_path / "dst.bin", lambda n: None, False)
+
+        assert len(flags) == 2
+        assert all(flag & binary for flag in flags)
+        assert (tmp_path / "dst.bin").read_bytes() == b"line\r\n"
+
+    @pytest.mark.skipif(
+        not hasattr(os, "posix_fadvise"), reason="posix_fadvise not available"
+    )
+    def test_drops_both_files(self, tmp_path: Path):
+        """Test that each chunk is dropped from the source and destination."""
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"x" * (CHUNK_SIZE + 1))
+
+        with patch("kachi.cache.os.posix_fadvise") as fadvise:
+            copy_uncached(src, tmp_path / "dst.bin", lambda n: None)
+
+        advice = [call.args[3] for call in fadvise.call_args_list]
+        assert advice[0] == os.POSIX_FADV_SEQUENTIAL
+        assert advice.count(os.POSIX_FADV_DONTNEED) == 5
+
+
+class TestDirectFallback:
+    """Tests for O_DIRECT that the file system accepts but then refuses."""
+
+    @pytest.fixture
+    def cleared(self) -> list[int]:
+        """Pretend O_DIRECT is on and record descriptors it is cleared for."""
+        cleared = []
+
+        def open_direct(path, flags, direct):
+            return os.open(path, flags, 0o666), direct
+
+        with (
+            patch("kachi.cache._open", open_direct),
+            patch("kachi.cache._clear_direct", cleared.append),
+        ):
+            yield cleared
+
+    @pytest.fixture
+    def src(self, tmp_path: Path) -> Path:
+        """Create a source a little over one chunk in size."""
+        src = tmp_path / "src.bin"
+        src.write_bytes(random.Random(0).randbytes(CHUNK_SIZE + 12345))
+        return src
+
+    def test_refused_read_is_retried(
+        self, tmp_path: Path, src: Path, cleared: list[int]
+    ):
+        """Test that EINVAL on a direct read falls back to the cache."""
+
+        class Reader(io.FileIO):
+            def __init__(self, fd, mode, buffering, closefd):
+                super().__init__(fd, mode, closefd=closefd)
+
+            def readinto(self, buffer):
+                if self.fileno() not in cleared:
+                    raise OSError(errno.EINVAL, "Invalid argument")
+                return super().readinto(buffer)
+
+        with patch("kachi.cache.open", Reader, create=True):
+            copy_uncached(src, tmp_path / "dst.bin", lambda n: None, direct=True)
+
+        assert (tmp_path / "dst.bin").read_bytes() == src.read_bytes()
+        assert len(cleared) == 2
+
+    def test_refused_write_is_retried(
+        self, tmp_path: Path, src: Path, cleared: list[int]
+    ):
+        """Test that EINVAL on a direct write falls back to the cache."""
+        write = os.write
+
+        def refuse_direct(fd, data):
+            if fd not in cleared:
+                raise OSError(errno.EINVAL, "Invalid argument")
+            return write(fd, data)
+
+        with patch("kachi.cache.os.write", refuse_direct):
+            copy_uncached(src, tmp_path / "dst.bin", lambda n: None, direct=True)
+
+        assert (tmp_path / "dst.bin").read_bytes() == src.read_bytes()
+
+    def test_short_write_clears_direct(
+        self, tmp_path: Path, src: Path, cleared: list[int]
+    ):
+        """Test that the rest of a short direct write goes through the cache."""
+        write = os.write
+        calls = []
+
+        def short_first_write(fd, data):
+            calls.append(list(cleared))
+            if len(calls) == 1:
+                return write(fd, data[:100])
+            return write(fd, data)
+
+        with patch("kachi.cache.os.write", short_first_write):
+            copy_uncached(src, tmp_path / "dst.bin", lambda n: None, direct=True)
+
+        assert (tmp_path / "dst.bin").read_bytes() == src.read_bytes()
+        assert calls[0] == [] and calls[1] != []
+
+
+class TestDropCacheEngine:
+    """Tests for copying through the engine with drop_cache set."""
+
+    def test_counts_uncached_bytes(self, tmp_path: Path):
+        """Test that copies keep metadata and are reported as uncached."""
+        src = tmp_path / "notes.txt"
+        src.write_text("hello")
+        os.utime(src, (1_000_000, 1_000_000))
+        engine = CopyEngine(drop_cache=DropCache(direct_io_min_size=1))
+
+        engine.copy_file(src, tmp_path / "copy.txt")
+
+        assert (tmp_path / "copy.txt").read_text() == "hello"
+        assert (tmp_path / "copy.txt").stat().st_mtime == 1_000_000
+        assert engine.stats.uncached_bytes == 5
+        assert engine.stats.physical_bytes == 5
@@ -7,7 +7,9 @@ from pathlib import Path
 from typer.testing import CliRunner
 
 from kachi import __version__
-from kachi.cli import app
+from kachi.cli import _log_devices, app
+from kachi.history import HistoryStore
+from kachi.scheduler import DeviceStats
 
 runner = CliRunner()
 
@@ -115,3 +117,216 @@ class TestCli:
                 app, ["--quiet", "--verbose", "backup", "--config", str(config_file)]
             )
             assert result.exit_code == 1
+
+    def test_backup_invalid_destination_exits_with_error(self):
+        """Test that a profile without a valid destination exits with code 1."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            test_file = Path(tmpdir) / "test.txt"
+            test_file.write_text("test content")
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text(
+                f"profiles:\n"
+                f"  default:\n"
+                f"    sources:\n"
+                f"      - {test_file}\n"
+                f"    backup_destination: {Path(tmpdir) / 'missing'}\n"
+            )
+
+            result = runner.invoke(app, ["backup", "--config", str(config_file)])
+            assert result.exit_code == 1
+
+    def test_aborted_parallel_run_is_not_recorded(self):
+        """Test that a profile without a valid destination leaves no history."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            test_file = Path(tmpdir) / "test.txt"
+            test_file.write_text("test content")
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text(
+                f"profiles:\n"
+                f"  default:\n"
+                f"    sources:\n"
+                f"      - {test_file}\n"
+                f"    backup_destination: {Path(tmpdir) / 'missing'}\n"
+            )
+
+            result = runner.invoke(
+                app, ["backup", "--config", str(config_file), "--parallel"]
+            )
+
+            assert result.exit_code == 1
+            store = HistoryStore(Path(tmpdir) / "history.db")
+            assert store.profiles() == []
+
+    def test_backup_dry_run_does_not_copy(self):
+        """Test that --dry-run reports a plan without copying anything."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            test_file = Path(tmpdir) / "test.txt"
+            test_file.write_text("test content")
+            backup_dir = Path(tmpdir) / "backup"
+            backup_dir.mkdir()
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text(
+                f"profiles:\n"
+                f"  default:\n"
+                f"    sources:\n"
+                f"      - {test_file}\n"
+                f"    backup_destination: {backup_dir}\n"
+            )
+
+            result = runner.invoke(
+                app, ["backup", "--config", str(config_file), "--dry-run"]
+            )
+            assert result.exit_code == 0
+            assert not (backup_dir / "test.txt").exists()
+            assert not (Path(tmpdir) / "history.db").exists()
+
+    def test_backup_records_run_history(self):
+        """Test that a backup run records its throughput in the history store."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            test_file = Path(tmpdir) / "test.txt"
+            test_file.write_text("test content")
+            backup_dir = Path(tmpdir) / "backup"
+            backup_dir.mkdir()
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text(
+                f"profiles:\n"
+                f"  default:\n"
+                f"    sources:\n"
+                f"      - {test_file}\n"
+                f"    backup_destination: {backup_dir}\n"
+            )
+
+            result = runner.invoke(app, ["backup", "--config", str(config_file)])
+            assert result.exit_code == 0
+
+            store = HistoryStore(Path(tmpdir) / "history.db")
+            assert store.throughput("default") is not None
+            _, sources = store.trends("default")
+            assert [(s.name, s.files) for s in sources] == [(str(test_file), 1)]
+
+    def test_history_flags_grown_sources(self, caplog):
+        """Test that history warns about a source that copied far more data."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text("profiles: {}\n")
+            store = HistoryStore(Path(tmpdir) / "history.db")
+            for size in (100, 110, 400):
+                store.record_run(
+                    "home",
+                    1.0,
+                    1,
+                    size,
+                    {Path("/home/alice"): (1.0, 1, size)},
+                )
+
+            with caplog.at_level(logging.INFO):
+                result = runner.invoke(
+                    app, ["history", "--config", str(config_file), "--threshold", "2"]
+                )
+
+            assert result.exit_code == 0
+            assert "Source /home/alice copied 400 B" in caplog.text
+
+    def test_history_without_runs(self, caplog):
+        """Test that history reports when nothing has been recorded."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text("profiles: {}\n")
+
+            with caplog.at_level(logging.INFO):
+                result = runner.invoke(app, ["history", "--config", str(config_file)])
+
+            assert result.exit_code == 0
+            assert "No backup runs recorded yet." in caplog.text
+
+    def test_backup_parallel(self):
+        """Test that --parallel backs up every profile."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            test_file = Path(tmpdir) / "test.txt"
+            test_file.write_text("test content")
+            backup_dir = Path(tmpdir) / "backup"
+            backup_dir.mkdir()
+            other_dir = Path(tmpdir) / "other"
+            other_dir.mkdir()
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text(
+                f"scheduler:\n"
+                f"  workers: 2\n"
+                f"profiles:\n"
+                f"  default:\n"
+                f"    sources:\n"
+                f"      - {test_file}\n"
+                f"    backup_destination: {backup_dir}\n"
+                f"  other:\n"
+                f"    backup_destination: {other_dir}\n"
+            )
+
+            result = runner.invoke(
+                app, ["backup", "--config", str(config_file), "--parallel"]
+            )
+            assert result.exit_code == 0
+            assert (backup_dir / "test.txt").exists()
+            assert (other_dir / "test.txt").exists()
+
+    def test_serve_requires_existing_root(self):
+        """Test that serve exits when the store directory does not exist."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result = runner.invoke(app, ["serve", str(Path(tmpdir) / "missing")])
+            assert result.exit_code == 1
+
+    def test_daemon_exits_on_invalid_config(self):
+        """Test that daemon exits when the config cannot be parsed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = Path(tmpdir) / "config.yaml"
+            config_file.write_text("profiles:\n  default:\n    schedule: often\n")
+
+            result = runner.invoke(app, ["daemon", "--config", str(config_file)])
+            assert result.exit_code == 1
+
+    def test_backup_dedup_and_restore(self):
+        """Test that a deduplicated backup is restored by kachi restore."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = Path(tmpdir)
+            src = tmp / "src"
+            src.mkdir()
+            (src / "a.txt").write_text("same content")
+            (src / "b.txt").write_text("same content")
+            backup_dir = tmp / "backup"
+            backup_dir.mkdir()
+            config_file = tmp / "config.yaml"
+            config_file.write_text(
+                f"profiles:\n"
+                f"  default:\n"
+                f"    sources:\n"
+                f"      - {src}\n"
+                f"    backup_destination: {backup_dir}\n"
+                f"    dedup:\n"
+                f"      workers: 1\n"
+            )
+
+            result = runner.invoke(app, ["backup", "--config", str(config_file)])
+            assert result.exit_code == 0
+            assert (backup_dir / "src" / "a.txt.kachi-recipe").exists()
+
+            result = runner.invoke(
+                app, ["restore", str(backup_dir / "src"), str(tmp / "restored")]
+            )
+            assert result.exit_code == 0
+            assert (tmp / "restored" / "src" / "b.txt").read_text() == "same content"
+
+    def test_restore_requires_existing_source(self):
+        """Test that restore exits when the source does not exist."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result = runner.invoke(
+                app, ["restore", str(Path(tmpdir) / "missing"), tmpdir]
+            )
+            assert result.exit_code == 1
+
+    def test_log_devices_without_device_numbers(self, caplog, monkeypatch):
+        """Test that devices are logged by st_dev where major/minor are missing."""
+        monkeypatch.delattr("os.major", raising=False)
+
+        with caplog.at_level(logging.INFO):
+            _log_devices([DeviceStats(device=1234, label="C:\\", limit=4)])
+
+        assert "Device 1234 (C:\\, unknown type, limit 4)" in caplog.text
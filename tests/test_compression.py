@@ -0,0 +1,112 @@
+"""Tests for the compression module."""
+
+import gzip
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+from kachi.backup import backup_profile
+from kachi.compression import choose_codec, sample_entropy
+from kachi.config import Compression, Profile
+from kachi.engine import CopyEngine
+
+
+class TestCodecSelection:
+    """Tests for sample_entropy and choose_codec."""
+
+    def test_entropy_of_repetitive_and_random_data(self, tmp_path: Path):
+        """Test that entropy separates redundant from random content."""
+        text = tmp_path / "text.txt"
+        text.write_bytes(b"abab" * 1000)
+        noise = tmp_path / "noise.bin"
+        noise.write_bytes(os.urandom(64 * 1024))
+
+        assert sample_entropy(text) == 1.0
+        assert sample_entropy(noise) > 7.9
+
+    def test_skips_compressed_extensions(self, tmp_path: Path):
+        """Test that already-compressed formats are stored as they are."""
+        photo = tmp_path / "photo.JPG"
+        photo.write_bytes(b"a" * 100)
+
+        assert choose_codec(photo, 100, Compression()) is None
+
+    def test_skips_high_entropy_content(self, tmp_path: Path):
+        """Test that incompressible content is detected by sampling."""
+        blob = tmp_path / "blob.dat"
+        blob.write_bytes(os.urandom(64 * 1024))
+
+        assert choose_codec(blob, 64 * 1024, Compression()) is None
+
+    def test_auto_codec_by_size_and_entropy(self, tmp_path: Path):
+        """Test that auto picks xz for large redundant files, gzip otherwise."""
+        small = tmp_path / "small.log"
+        small.write_bytes(b"line\n" * 100)
+
+        assert choose_codec(small, 500, Compression()) == ("gzip", 6)
+        assert choose_codec(small, 2 * 1024 * 1024, Compression()) == ("xz", 6)
+        assert choose_codec(small, 500, Compression(codec="bz2", level=9)) == (
+            "bz2",
+            9,
+        )
+
+
+class TestCompressedCopies:
+    """Tests for compressed copies through the copy engine."""
+
+    def test_engine_compresses_in_worker_pool(self, tmp_path: Path):
+        """Test that compressible files are written compressed after flush."""
+        src = tmp_path / "notes.txt"
+        src.write_bytes(b"kachi backups\n" * 2000)
+        photo = tmp_path / "photo.jpg"
+        photo.write_bytes(b"jpeg data")
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        engine = CopyEngine(compression=Compression(workers=2))
+
+        written = engine.copy_file(src, dest / src.name)
+        engine.copy_file(photo, dest / photo.name)
+        engine.flush()
+
+        assert written == str(dest / "notes.txt.gz")
+        assert gzip.decompress((dest / "notes.txt.gz").read_bytes()) == (
+            src.read_bytes()
+        )
+        assert (dest / "photo.jpg").read_bytes() == b"jpeg data"
+        stats = engine.compressor.stats
+        assert stats.files == 1
+        assert stats.stored == 1
+        assert stats.ratio < 0.1
+        assert engine.stats.physical_bytes < engine.stats.bytes
+
+    def test_durable_compressed_copy(self, tmp_path: Path):
+        """Test that compressed files are renamed into place when durable."""
+        src = tmp_path / "notes.txt"
+        src.write_bytes(b"durable\n" * 1000)
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        engine = CopyEngine(durable=True, compression=Compression(workers=1))
+
+        engine.copy_file(src, dest / src.name)
+        engine.flush()
+
+        assert [p.name for p in dest.iterdir()] == ["notes.txt.gz"]
+
+    def test_worker_failure_fails_its_source(self, tmp_path: Path):
+        """Test that a copy failing in a worker counts against its source."""
+        sources = []
+        for name in ("docs", "music"):
+            src = tmp_path / name
+            src.mkdir()
+            (src / "a.txt").write_text(name)
+            sources.append(src)
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        failure = shutil.Error([(str(sources[1] / "a.txt"), "a.txt.gz", "boom")])
+        profile = Profile(name="p", sources=sources, backup_destination=dest)
+
+        with patch.object(CopyEngine, "flush", side_effect=failure):
+            _, success, errors = backup_profile(profile, CopyEngine())
+
+        assert (success, errors) == (1, 1)
@@ -4,7 +4,22 @@ from pathlib import Path
 
 import pytest
 
-from src.kachi.config import DEFAULT_CONFIG_PATH, Config, Profile, Settings
+from kachi.config import (
+    DEFAULT_CONFIG_PATH,
+    DEFAULT_PORT,
+    Compression,
+    Config,
+    DaemonSettings,
+    Dedup,
+    DropCache,
+    FastScan,
+    Limits,
+    Profile,
+    RemoteDestination,
+    Schedule,
+    Scheduling,
+    Settings,
+)
 
 
 @pytest.fixture
@@ -87,3 +102,333 @@ class TestConfig:
         config.parse()
         with pytest.raises(ValueError):
             config.get_profile("invalid_profile")
+
+    def test_limits_are_parsed_and_inherited(self, tmp_path: Path):
+        """Test that per-profile and global limits follow default inheritance."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "limits:\n"
+            "  bytes_per_second: 100MB\n"
+            "profiles:\n"
+            "  default:\n"
+            "    sources: []\n"
+            "    limits:\n"
+            "      files_per_second: 50\n"
+            "  inherits: {}\n"
+            "  overrides:\n"
+            "    limits:\n"
+            "      bytes_per_second: 1024\n"
+        )
+
+        config = Config(config_file)
+        config.parse()
+
+        assert config.limits == Limits(bytes_per_second=100 * 1024**2)
+        assert config.get_profile("default").limits == Limits(files_per_second=50)
+        assert config.get_profile("inherits").limits == Limits(files_per_second=50)
+        assert config.get_profile("overrides").limits == Limits(bytes_per_second=1024)
+
+    def test_invalid_limits_raise_value_error(self, tmp_path: Path):
+        """Test that a non-positive limit is rejected."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n  default:\n    limits:\n      files_per_second: 0\n"
+        )
+
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_backup_destination_list(self, tmp_path: Path):
+        """Test that a list of destinations is parsed and inherited."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    backup_destination:\n"
+            "      - /mnt/local\n"
+            "      - /mnt/share\n"
+            "  other:\n"
+            "    sources: []\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert settings[1].backup_destination == [
+            Path("/mnt/local"),
+            Path("/mnt/share"),
+        ]
+        assert settings[1].destinations == [Path("/mnt/local"), Path("/mnt/share")]
+
+    def test_profile_destinations_property(self):
+        """Test that destinations always returns a list."""
+        assert Profile("p", [], None).destinations == []
+        assert Profile("p", [], Path("/backup")).destinations == [Path("/backup")]
+
+    def test_durable_option_is_inherited(self, tmp_path: Path):
+        """Test that the durable setting falls back to the default profile."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    durable: true\n"
+            "  inherits:\n"
+            "    sources: []\n"
+            "  overrides:\n"
+            "    durable: false\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert [p.durable for p in settings] == [True, True, False]
+
+    def test_link_duplicates_inherited(self, tmp_path: Path):
+        """Test that link_duplicates is inherited from the default profile."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    link_duplicates: true\n"
+            "  homes:\n"
+            "    sources: []\n"
+            "  single:\n"
+            "    link_duplicates: false\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert [p.link_duplicates for p in settings] == [True, True, False]
+
+    def test_compression_settings(self, tmp_path: Path):
+        """Test that compression accepts true, a mapping, or false."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    compression: true\n"
+            "  tuned:\n"
+            "    compression:\n"
+            "      codec: xz\n"
+            "      level: 9\n"
+            "      workers: 2\n"
+            "  plain:\n"
+            "    compression: false\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert settings[0].compression == Compression()
+        assert settings[1].compression == Compression(codec="xz", level=9, workers=2)
+        assert settings[2].compression is None
+
+    @pytest.mark.parametrize(
+        "codec, level", [("gzip", 10), ("bz2", 0), ("auto", -1), ("xz", "max")]
+    )
+    def test_invalid_compression_level(self, tmp_path: Path, codec, level):
+        """Test that a level the codec does not accept raises ValueError."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n  default:\n    compression:\n"
+            f"      codec: {codec}\n      level: {level}\n"
+        )
+
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_unknown_compression_codec(self, tmp_path: Path):
+        """Test that an unknown codec raises ValueError."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n  default:\n    compression:\n      codec: zip\n"
+        )
+
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_dedup_settings(self, tmp_path: Path):
+        """Test that dedup accepts true or a mapping with a chunk size."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    dedup: true\n"
+            "  tuned:\n"
+            "    dedup:\n"
+            "      chunk_size: 1MiB\n"
+            "      workers: 2\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert settings[0].dedup == Dedup()
+        assert settings[1].dedup == Dedup(chunk_size=1024 * 1024, workers=2)
+
+    def test_invalid_dedup_chunk_size(self, tmp_path: Path):
+        """Test that a chunk size that is not a power of two is rejected."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n  default:\n    dedup:\n      chunk_size: 100K\n"
+        )
+
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_drop_cache_settings(self, tmp_path: Path):
+        """Test that drop_cache accepts true or a direct I/O threshold."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    drop_cache: true\n"
+            "  large:\n"
+            "    drop_cache:\n"
+            "      direct_io_min_size: 1GiB\n"
+            "  plain:\n"
+            "    drop_cache: false\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert settings[0].drop_cache == DropCache()
+        assert settings[1].drop_cache == DropCache(direct_io_min_size=1024**3)
+        assert settings[2].drop_cache is None
+
+        config_file.write_text(
+            "profiles:\n  default:\n    drop_cache:\n      direct_io_min_size: 0\n"
+        )
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_scheduler_settings(self, tmp_path: Path):
+        """Test that top-level scheduler settings are parsed and validated."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "scheduler:\n  workers: 8\n  rotational_limit: 2\nprofiles: {}\n"
+        )
+        assert Settings(config_file).scheduling == Scheduling(
+            workers=8, rotational_limit=2
+        )
+
+        config_file.write_text("scheduler:\n  workers: 0\nprofiles: {}\n")
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+        config_file.write_text("scheduler:\n  threads: 2\nprofiles: {}\n")
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_fast_scan_settings(self, tmp_path: Path):
+        """Test that fast_scan accepts true or a mapping and is validated."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    fast_scan: true\n"
+            "  tuned:\n"
+            "    fast_scan:\n"
+            "      full_rescan_every: 3\n"
+            "  plain:\n"
+            "    fast_scan: false\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert settings[0].fast_scan == FastScan()
+        assert settings[1].fast_scan == FastScan(full_rescan_every=3)
+        assert settings[2].fast_scan is None
+
+        config_file.write_text(
+            "profiles:\n  default:\n    fast_scan:\n      full_rescan_every: 0\n"
+        )
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_remote_destination(self, tmp_path: Path):
+        """Test that kachi:// destinations are parsed, with a default port."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    backup_destination: kachi://storage.local:9000\n"
+            "  fallback:\n"
+            "    backup_destination: kachi://storage.local\n"
+        )
+
+        settings = Settings(config_file).settings
+
+        assert settings[0].backup_destination == RemoteDestination(
+            "storage.local", 9000
+        )
+        assert settings[1].backup_destination == RemoteDestination(
+            "storage.local", DEFAULT_PORT
+        )
+        assert str(settings[0].backup_destination) == "kachi://storage.local:9000"
+
+    def test_server_token_is_attached_to_remote_destinations(self, tmp_path: Path):
+        """Test that server.token is sent to every kachi:// destination."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "server:\n"
+            "  token: secret\n"
+            "profiles:\n"
+            "  default:\n"
+            "    backup_destination: kachi://storage.local\n"
+            "  local:\n"
+            "    backup_destination: /backups\n"
+        )
+
+        parsed = Settings(config_file)
+
+        assert parsed.server.token == "secret"
+        assert parsed.settings[0].backup_destination.token == "secret"
+        assert "secret" not in repr(parsed.settings[0].backup_destination)
+        assert parsed.settings[1].backup_destination == Path("/backups")
+
+        config_file.write_text("server:\n  token: ''\nprofiles: {}\n")
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_remote_destination_cannot_be_in_list(self, tmp_path: Path):
+        """Test that a kachi:// destination cannot be one of several."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "profiles:\n"
+            "  default:\n"
+            "    backup_destination:\n"
+            "      - /backups\n"
+            "      - kachi://storage.local\n"
+        )
+
+        with pytest.raises(ValueError):
+            Settings(config_file)
+
+    def test_schedule_settings(self, tmp_path: Path):
+        """Test that schedules accept an interval or a mapping with jitter."""
+        config_file = tmp_path / "config.yaml"
+        config_file.write_text(
+            "daemon:\n"
+            "  max_concurrent: 3\n"
+            "profiles:\n"
+            "  default:\n"
+            "    schedule: 6h\n"
+            "  jittered:\n"
+            "    schedule:\n"
+            "      every: 30m\n"
+            "      jitter: 5m\n"
+            "  manual:\n"
+            "    schedule: null\n"
+        )
+
+        parsed = Settings(config_file)
+
+        assert parsed.daemon == DaemonSettings(max_concurrent=3)
+        assert parsed.settings[0].schedule == Schedule(every=21600.0)
+        assert parsed.settings[1].schedule == Schedule(every=1800.0, jitter=300.0)
+        assert parsed.settings[2].schedule is None
+
+    def test_invalid_schedule(self, tmp_path: Path):
+        """Test that a schedule without a valid interval raises ValueError."""
+        config_file = tmp_path / "config.yaml"
+        for schedule in ("often", "0", "{jitter: 5m}"):
+            config_file.write_text(f"profiles:\n  default:\n    schedule: {schedule}\n")
+            with pytest.raises(ValueError):
+                Settings(config_file)
@@ -0,0 +1,192 @@
+"""Tests for the scheduling daemon."""
+
+import os
+import random
+import threading
+from pathlib import Path
+
+import pytest
+
+from kachi.config import Config
+from kachi.daemon import Daemon
+
+
+def _write_config(path: Path, profiles: dict[str, str], max_concurrent: int = 2):
+    """Write a config with one scheduled profile per name."""
+    lines = [f"daemon:\n  max_concurrent: {max_concurrent}\n", "profiles:\n"]
+    for name, schedule in profiles.items():
+        lines.append(
+            f"  {name}:\n"
+            f"    sources: []\n"
+            f"    backup_destination: {path.parent}\n"
+            f"    schedule: {schedule}\n"
+        )
+    path.write_text("".join(lines))
+
+
+def _touch_later(path: Path) -> None:
+    """Move a file's modification time forward so a change is detected."""
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+class Runner:
+    """Record profile runs, holding each until it is released."""
+
+    def __init__(self):
+        """Start with no runs."""
+        self.started: list[str] = []
+        self.release = threading.Event()
+
+    def __call__(self, conf, profile, throttle) -> None:
+        """Record a run and wait to be released."""
+        self.started.append(profile.name)
+        self.release.wait(5)
+
+
+@pytest.fixture
+def config_file(tmp_path: Path) -> Path:
+    """Return the path of a config file with two scheduled profiles."""
+    path = tmp_path / "config.yaml"
+    _write_config(path, {"a": "1h", "b": "30m"})
+    return path
+
+
+class TestDaemon:
+    """Tests for the Daemon class."""
+
+    def test_profiles_start_when_first_loaded(self, config_file: Path):
+        """Test that scheduled profiles run as soon as the daemon starts."""
+        runner = Runner()
+        daemon = Daemon(Config(config_file), runner)
+        daemon.reload()
+
+        started = daemon.tick(0.0)
+        runner.release.set()
+        daemon.join()
+
+        assert sorted(started) == ["a", "b"]
+
+    def test_running_profile_is_not_started_again(self, config_file: Path):
+        """Test that a profile never overlaps its previous run."""
+        runner = Runner()
+        daemon = Daemon(Config(config_file), runner)
+        daemon.reload()
+
+        daemon.tick(0.0)
+        again = daemon.tick(7200.0)
+        runner.release.set()
+        daemon.join()
+
+        assert again == []
+        assert sorted(runner.started) == ["a", "b"]
+
+    def test_next_run_follows_interval(self, config_file: Path):
+        """Test that a profile is due again one interval after it started."""
+        runner = Runner()
+        runner.release.set()
+        daemon = Daemon(Config(config_file), runner)
+        daemon.reload()
+
+        daemon.tick(0.0)
+        daemon.join()
+
+        assert daemon.tick(1799.0) == []
+        assert daemon.tick(1800.0) == ["b"]
+        daemon.join()
+        assert sorted(daemon.tick(3600.0)) == ["a", "b"]
+        daemon.join()
+
+    def test_concurrency_limit(self, tmp_path: Path):
+        """Test that no more than max_concurrent profiles run at once."""
+        path = tmp_path / "config.yaml"
+        _write_config(path, {"a": "1h", "b": "1h", "c": "1h"}, max_concurrent=2)
+        runner = Runner()
+        daemon = Daemon(Config(path), runner)
+        daemon.reload()
+
+        first = daemon.tick(0.0)
+        assert len(first) == 2
+        runner.release.set()
+        daemon.join()
+        second = daemon.tick(1.0)
+        daemon.join()
+
+        assert sorted(first + second) == ["a", "b", "c"]
+
+    def test_shared_target_waits(self, tmp_path: Path):
+        """Test that profiles copying to the same path do not run together."""
+        src = tmp_path / "notes.txt"
+        src.write_text("notes")
+        path = tmp_path / "config.yaml"
+        path.write_text(
+            "profiles:\n"
+            "  default:\n"
+            f"    sources: [{src}]\n"
+            f"    backup_destination: {tmp_path}\n"
+            "    schedule: 1h\n"
+            "  copy:\n"
+            "    schedule: 1h\n"
+        )
+        runner = Runner()
+        daemon = Daemon(Config(path), runner)
+        daemon.reload()
+
+        first = daemon.tick(0.0)
+        runner.release.set()
+        daemon.join()
+        second = daemon.tick(1.0)
+        daemon.join()
+
+        assert len(first) == 1
+        assert sorted(first + second) == ["copy", "default"]
+
+    def test_jitter_delays_start(self, tmp_path: Path):
+        """Test that jitter spreads out the start of a profile."""
+        path = tmp_path / "config.yaml"
+        _write_config(path, {"a": "{every: 1h, jitter: 10m}"})
+        daemon = Daemon(Config(path), Runner(), rng=random.Random(1))
+        daemon.reload()
+
+        assert daemon.tick(0.0) == []
+        due = daemon.next_due()
+        assert 0 < due <= 600
+
+    def test_reload_picks_up_changes(self, config_file: Path):
+        """Test that an edited config file replaces the profiles in memory."""
+        daemon = Daemon(Config(config_file), Runner())
+        assert daemon.reload()
+        assert not daemon.reload()
+
+        _write_config(config_file, {"c": "2h"})
+        _touch_later(config_file)
+
+        assert daemon.reload()
+        assert [p.name for p in daemon.scheduled()] == ["c"]
+
+    def test_invalid_config_keeps_previous(self, config_file: Path):
+        """Test that a broken edit does not replace the working config."""
+        daemon = Daemon(Config(config_file), Runner())
+        daemon.reload()
+
+        config_file.write_text("profiles:\n  a:\n    schedule: often\n")
+        _touch_later(config_file)
+
+        assert not daemon.reload()
+        assert sorted(p.name for p in daemon.scheduled()) == ["a", "b"]
+
+    def test_run_forever_stops(self, config_file: Path):
+        """Test that stop ends the loop after running backups finish."""
+        runner = Runner()
+        runner.release.set()
+        daemon = Daemon(Config(config_file), runner)
+        thread = threading.Thread(target=daemon.run_forever, args=(0.05,))
+        thread.start()
+        while len(runner.started) < 2:
+            threading.Event().wait(0.01)
+
+        daemon.stop()
+        thread.join(5)
+
+        assert not thread.is_alive()
+        assert sorted(runner.started) == ["a", "b"]
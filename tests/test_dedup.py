@@ -0,0 +1,241 @@
+"""Tests for the content-defined chunk store."""
+
+import io
+import json
+import os
+import random
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.config import Dedup
+from kachi.dedup import (
+    _GEAR,
+    RECIPE_SUFFIX,
+    STORE_DIRNAME,
+    ChunkSizes,
+    DedupStats,
+    chunk_path,
+    cut_point,
+    iter_chunks,
+    put_chunk,
+    restore_file,
+    restore_tree,
+    store_file,
+)
+from kachi.engine import CopyEngine
+
+SIZES = ChunkSizes.for_average(4096)
+
+
+def _random_bytes(n: int, seed: int = 0) -> bytes:
+    """Return reproducible pseudo-random bytes."""
+    return random.Random(seed).randbytes(n)
+
+
+class TestChunking:
+    """Tests for iter_chunks."""
+
+    def test_chunks_rebuild_the_input(self):
+        """Test that joining the chunks gives back the original data."""
+        data = _random_bytes(200_000)
+
+        chunks = list(iter_chunks(io.BytesIO(data), SIZES))
+
+        assert b"".join(chunks) == data
+        assert all(len(c) <= SIZES.max for c in chunks)
+        assert all(len(c) >= SIZES.min for c in chunks[:-1])
+
+    def test_insertion_keeps_most_chunks(self):
+        """Test that an insertion only changes the chunks around it."""
+        data = _random_bytes(200_000)
+        edited = data[:50_000] + b"inserted bytes" + data[50_000:]
+
+        before = set(iter_chunks(io.BytesIO(data), SIZES))
+        after = list(iter_chunks(io.BytesIO(edited), SIZES))
+
+        shared = sum(len(c) for c in after if c in before)
+        assert shared >= 0.8 * len(edited)
+
+    def test_empty_file_has_no_chunks(self):
+        """Test that an empty file produces no chunks."""
+        assert list(iter_chunks(io.BytesIO(b""), SIZES)) == []
+
+    def test_cut_points_match_plain_gear_hash(self):
+        """Test that cut points match a byte-by-byte 64-bit gear hash."""
+
+        def reference(data: bytes, start: int) -> int:
+            stop = min(len(data), start + SIZES.max)
+            h = 0
+            for i in range(start + SIZES.min, stop):
+                h = ((h << 1) + _GEAR[data[i]]) & ((1 << 64) - 1)
+                mask = SIZES.mask_small if i < start + SIZES.avg else SIZES.mask_large
+                if not h & mask:
+                    return i + 1
+            return stop
+
+        data = _random_bytes(200_000, seed=1)
+        pos = 0
+        while pos < len(data):
+            end = cut_point(data, pos, len(data), SIZES)
+            assert end == reference(data, pos)
+            pos = end
+
+
+class TestStoreFile:
+    """Tests for store_file and restore_file."""
+
+    def test_round_trip(self, tmp_path: Path):
+        """Test that a stored file can be restored byte for byte."""
+        src = tmp_path / "image.bin"
+        src.write_bytes(_random_bytes(100_000))
+        store = tmp_path / STORE_DIRNAME
+        recipe = tmp_path / f"image.bin{RECIPE_SUFFIX}"
+
+        size, chunks, new_chunks, new_bytes, _ = store_file(
+            str(src), str(recipe), str(store), 4096
+        )
+        restored = tmp_path / "restored.bin"
+        restore_file(recipe, restored, store)
+
+        assert restored.read_bytes() == src.read_bytes()
+        assert size == new_bytes == 100_000
+        assert chunks == new_chunks
+        assert restored.stat().st_mtime == pytest.approx(src.stat().st_mtime)
+
+    def test_identical_content_is_stored_once(self, tmp_path: Path):
+        """Test that a second copy of the same data adds no chunks."""
+        data = _random_bytes(100_000)
+        store = tmp_path / STORE_DIRNAME
+        for name in ("a.bin", "b.bin"):
+            (tmp_path / name).write_bytes(data)
+
+        store_file(str(tmp_path / "a.bin"), str(tmp_path / "a.r"), str(store), 4096)
+        _, _, new_chunks, new_bytes, _ = store_file(
+            str(tmp_path / "b.bin"), str(tmp_path / "b.r"), str(store), 4096
+        )
+
+        assert (new_chunks, new_bytes) == (0, 0)
+
+    def test_corrupt_chunk_is_detected(self, tmp_path: Path):
+        """Test that restoring from a damaged chunk raises ValueError."""
+        src = tmp_path / "data.bin"
+        src.write_bytes(_random_bytes(10_000))
+        store = tmp_path / STORE_DIRNAME
+        recipe = tmp_path / "data.r"
+        store_file(str(src), str(recipe), str(store), 4096)
+        digest = json.loads(recipe.read_text())["chunks"][0][0]
+        chunk = store / digest[:2] / digest
+        chunk.write_bytes(b"x" * len(chunk.read_bytes()))
+
+        with pytest.raises(ValueError):
+            restore_file(recipe, tmp_path / "out.bin", store)
+
+
+class TestPutChunk:
+    """Tests for put_chunk."""
+
+    def test_chunk_is_flushed_before_it_is_stored(self, tmp_path: Path):
+        """Test that a new chunk's data is synced to disk when asked."""
+        sync = "fdatasync" if hasattr(os, "fdatasync") else "fsync"
+
+        with patch(f"kachi.dedup.os.{sync}") as synced:
+            assert put_chunk(tmp_path, "ab" * 32, b"chunk data", sync=True)
+
+        synced.assert_called_once()
+        assert chunk_path(tmp_path, "ab" * 32).read_bytes() == b"chunk data"
+
+    def test_chunk_is_not_flushed_by_default(self, tmp_path: Path):
+        """Test that chunks are not synced unless durable writes are on."""
+        sync = "fdatasync" if hasattr(os, "fdatasync") else "fsync"
+
+        with patch(f"kachi.dedup.os.{sync}") as synced:
+            assert put_chunk(tmp_path, "cd" * 32, b"chunk data")
+
+        synced.assert_not_called()
+
+    def test_stored_chunk_is_not_rewritten(self, tmp_path: Path):
+        """Test that an intact chunk is left alone."""
+        put_chunk(tmp_path, "ab" * 32, b"chunk data")
+
+        assert not put_chunk(tmp_path, "ab" * 32, b"chunk data")
+
+    def test_truncated_chunk_is_replaced(self, tmp_path: Path):
+        """Test that a chunk cut short by a crash is written again."""
+        path = chunk_path(tmp_path, "ab" * 32)
+        path.parent.mkdir()
+        path.write_bytes(b"")
+
+        assert put_chunk(tmp_path, "ab" * 32, b"chunk data")
+        assert path.read_bytes() == b"chunk data"
+        assert list(path.parent.iterdir()) == [path]
+
+
+class TestDedupStats:
+    """Tests for DedupStats."""
+
+    def test_ratio(self):
+        """Test that the ratio compares logical size to stored data."""
+        assert DedupStats(bytes_in=400, bytes_stored=100).ratio == 4.0
+        assert DedupStats().ratio == 1.0
+
+
+class TestDedupEngine:
+    """Tests for deduplicated copies through the copy engine."""
+
+    def test_dedup_within_and_across_runs(self, tmp_path: Path):
+        """Test that shared data is stored once per run and never again."""
+        shared = _random_bytes(200_000, seed=1)
+        src = tmp_path / "src"
+        src.mkdir()
+        (src / "vm1.img").write_bytes(shared + _random_bytes(20_000, seed=2))
+        (src / "vm2.img").write_bytes(shared + _random_bytes(20_000, seed=3))
+        dest = tmp_path / "dest"
+        dest.mkdir()
+        store = dest / STORE_DIRNAME
+
+        def run() -> CopyEngine:
+            engine = CopyEngine(
+                dedup=Dedup(chunk_size=4096, workers=1), chunk_store=store
+            )
+            for f in sorted(src.iterdir()):
+                engine.copy_file(f, dest / f.name)
+            engine.flush()
+            return engine
+
+        first = run().deduplicator.stats
+        second = run().deduplicator.stats
+
+        assert first.bytes_in == 440_000
+        assert first.bytes_stored < 300_000
+        assert first.ratio > 1.4
+        assert second.new_chunks == 0
+        assert (dest / f"vm1.img{RECIPE_SUFFIX}").exists()
+        assert not (dest / "vm1.img").exists()
+
+        restore_tree(dest / f"vm2.img{RECIPE_SUFFIX}", tmp_path / "restored")
+        assert (tmp_path / "restored" / "vm2.img").read_bytes() == (
+            src / "vm2.img"
+        ).read_bytes()
+
+    def test_restore_tree(self, tmp_path: Path):
+        """Test that a deduplicated directory is restored under its names."""
+        src = tmp_path / "src"
+        (src / "sub").mkdir(parents=True)
+        (src / "a.txt").write_text("alpha")
+        (src / "sub" / "b.txt").write_text("beta")
+        dest = tmp_path / "dest"
+        dest.mkdir()
+        engine = CopyEngine(dedup=Dedup(workers=1), chunk_store=dest / STORE_DIRNAME)
+        for f in (src / "a.txt", src / "sub" / "b.txt"):
+            target = dest / "src" / f.relative_to(src)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            engine.copy_file(f, target)
+        engine.flush()
+
+        files, total = restore_tree(dest / "src", tmp_path / "restored")
+
+        assert (files, total) == (2, 9)
+        assert (tmp_path / "restored" / "src" / "a.txt").read_text() == "alpha"
+        assert (tmp_path / "restored" / "src" / "sub" / "b.txt").read_text() == "beta"
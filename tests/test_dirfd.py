@@ -0,0 +1,227 @@
+"""Tests for directory-descriptor-relative tree copies."""
+
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.backup import backup_dir
+from kachi.dirfd import HAVE_DIR_FD, copy_at, copy_tree_at
+from kachi.engine import CopyEngine
+from kachi.events import FileCopied, FileFailed
+
+pytestmark = pytest.mark.skipif(
+    not HAVE_DIR_FD, reason="platform has no dir_fd support"
+)
+
+
+def _make_tree(root: Path) -> None:
+    """Create a small nested tree with files at several levels."""
+    (root / "a" / "b" / "c").mkdir(parents=True)
+    (root / "top.txt").write_text("top")
+    (root / "a" / "one.txt").write_text("one")
+    (root / "a" / "b" / "two.txt").write_text("two")
+    (root / "a" / "b" / "c" / "three.txt").write_text("three")
+
+
+def _contents(root: Path) -> dict[str, str]:
+    """Map the relative path of every file under root to its text."""
+    return {
+        str(p.relative_to(root)): p.read_text() for p in root.rglob("*") if p.is_file()
+    }
+
+
+class TestCopyTreeAt:
+    """Tests for copy_tree_at."""
+
+    def test_copies_nested_tree(self, tmp_path: Path):
+        """Test that every file and directory is copied."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        dest = tmp_path / "dest"
+
+        copy_tree_at(src, dest, CopyEngine().copy_file_at)
+
+        assert _contents(dest) == _contents(src)
+
+    def test_preserves_metadata(self, tmp_path: Path):
+        """Test that modes and modification times are copied."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        f = src / "a" / "one.txt"
+        f.chmod(0o640)
+        os.utime(f, ns=(1_000_000_000, 2_000_000_000))
+        os.utime(src / "a", ns=(3_000_000_000, 4_000_000_000))
+        dest = tmp_path / "dest"
+
+        copy_tree_at(src, dest, CopyEngine().copy_file_at)
+
+        copied = (dest / "a" / "one.txt").stat()
+        assert copied.st_mode & 0o777 == 0o640
+        assert copied.st_mtime_ns == 2_000_000_000
+        assert (dest / "a").stat().st_mtime_ns == 4_000_000_000
+
+    @pytest.mark.skipif(not hasattr(os, "setxattr"), reason="no xattr support")
+    def test_preserves_xattrs(self, tmp_path: Path):
+        """Test that extended attributes are copied like shutil.copy2 does."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        try:
+            os.setxattr(src / "top.txt", "user.kachi", b"tagged")
+        except OSError:
+            pytest.skip("file system does not support user xattrs")
+        dest = tmp_path / "dest"
+
+        copy_tree_at(src, dest, CopyEngine().copy_file_at)
+
+        assert os.getxattr(dest / "top.txt", "user.kachi") == b"tagged"
+
+    def test_merges_into_existing_destination(self, tmp_path: Path):
+        """Test that existing files are overwritten and others kept."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        dest = tmp_path / "dest"
+        (dest / "a").mkdir(parents=True)
+        (dest / "a" / "one.txt").write_text("old contents")
+        (dest / "extra.txt").write_text("extra")
+
+        copy_tree_at(src, dest, CopyEngine().copy_file_at)
+
+        assert (dest / "a" / "one.txt").read_text() == "one"
+        assert (dest / "extra.txt").read_text() == "extra"
+
+    def test_collects_errors_and_continues(self, tmp_path: Path):
+        """Test that a failed file is reported after copying the rest."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        dest = tmp_path / "dest"
+
+        def fail_two(src_dir_fd, dst_dir_fd, name, st):
+            if name == "two.txt":
+                raise PermissionError("denied")
+            return copy_at(src_dir_fd, dst_dir_fd, name, st)
+
+        with patch("kachi.engine.copy_at", side_effect=fail_two):
+            with pytest.raises(shutil.Error) as excinfo:
+                copy_tree_at(src, dest, CopyEngine().copy_file_at)
+
+        [(failed_src, _, reason)] = excinfo.value.args[0]
+        assert failed_src == str(src / "a" / "b" / "two.txt")
+        assert "denied" in reason
+        assert (dest / "a" / "b" / "c" / "three.txt").read_text() == "three"
+
+    @pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="mkfifo not available")
+    def test_fifo_is_reported_not_read(self, tmp_path: Path):
+        """Test that a named pipe in the tree is an error instead of a hang."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        os.mkfifo(src / "a" / "pipe")
+        dest = tmp_path / "dest"
+
+        with pytest.raises(shutil.Error) as excinfo:
+            copy_tree_at(src, dest, CopyEngine().copy_file_at)
+
+        [(failed_src, _, reason)] = excinfo.value.args[0]
+        assert failed_src == str(src / "a" / "pipe")
+        assert "not a regular file" in reason
+        assert _contents(dest) == _contents(src)
+
+    def test_missing_source_raises(self, tmp_path: Path):
+        """Test that a missing source raises FileNotFoundError."""
+        with pytest.raises(FileNotFoundError):
+            copy_tree_at(tmp_path / "missing", tmp_path / "dest", copy_at)
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "copy_file_range"), reason="copy_file_range not available"
+)
+class TestCopyFileRange:
+    """Tests for copies through copy_file_range."""
+
+    @pytest.mark.parametrize("stop_after", [0, 3])
+    def test_short_copy_falls_back_to_read(self, tmp_path: Path, stop_after: int):
+        """Test that a copy reporting end of file early is completed."""
+        src = tmp_path / "src"
+        src.mkdir()
+        (src / "file.txt").write_text("contents")
+        copy_file_range = os.copy_file_range
+        calls = []
+
+        def short_copy(fsrc, fdst, count):
+            calls.append(count)
+            if len(calls) > 1 or not stop_after:
+                return 0
+            return copy_file_range(fsrc, fdst, stop_after)
+
+        with patch("kachi.dirfd.os.copy_file_range", side_effect=short_copy):
+            copy_tree_at(src, tmp_path / "dest", CopyEngine().copy_file_at)
+
+        assert calls
+        assert (tmp_path / "dest" / "file.txt").read_text() == "contents"
+
+
+class TestCopyFileAt:
+    """Tests for CopyEngine.copy_file_at."""
+
+    def test_records_stats_and_events(self, tmp_path: Path):
+        """Test that copies are counted and reported with full paths."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        engine = CopyEngine()
+        events = []
+        engine.listener = events.append
+
+        copy_tree_at(src, tmp_path / "dest", engine.copy_file_at)
+
+        assert engine.stats.files == 4
+        assert engine.stats.bytes == 14
+        assert {e.dst for e in events if isinstance(e, FileCopied)} == {
+            tmp_path / "dest" / p for p in _contents(src)
+        }
+
+    def test_durable_engine_uses_full_paths(self, tmp_path: Path):
+        """Test that durable writes fall back to copy_file."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        engine = CopyEngine(durable=True)
+
+        with patch("kachi.engine.copy_at") as fd_copy:
+            copy_tree_at(src, tmp_path / "dest", engine.copy_file_at)
+            engine.flush()
+
+        fd_copy.assert_not_called()
+        assert _contents(tmp_path / "dest") == _contents(src)
+
+    def test_backup_dir_uses_dir_fds(self, tmp_path: Path):
+        """Test that backup_dir walks with descriptors when given an engine."""
+        src = tmp_path / "src"
+        _make_tree(src)
+        dest = tmp_path / "dest"
+        dest.mkdir()
+
+        with patch("kachi.backup.shutil.copytree") as copytree:
+            assert backup_dir(src, dest, CopyEngine())
+
+        copytree.assert_not_called()
+        assert _contents(dest / "src") == _contents(src)
+
+    def test_backup_dir_reports_broken_link(self, tmp_path: Path):
+        """Test that a broken symbolic link is reported as a failed file."""
+        src = tmp_path / "src"
+        src.mkdir()
+        (src / "ok.txt").write_text("ok")
+        (src / "broken").symlink_to(tmp_path / "missing")
+        dest = tmp_path / "dest"
+        dest.mkdir()
+        engine = CopyEngine()
+        events = []
+        engine.listener = events.append
+
+        assert not backup_dir(src, dest, engine)
+
+        assert sorted(type(e).__name__ for e in events) == ["FileCopied", "FileFailed"]
+        [failed] = [e for e in events if isinstance(e, FileFailed)]
+        assert failed.src == src / "broken"
+        assert failed.dst == dest / "src" / "broken"
@@ -0,0 +1,218 @@
+"""Tests for the copy engine module."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.config import Limits
+from kachi.engine import (
+    CopyEngine,
+    DurableBatch,
+    RateLimiter,
+    Throttle,
+    is_sparse,
+    temp_path,
+)
+
+
+class FakeClock:
+    """A monotonic clock that only advances when sleep is called."""
+
+    def __init__(self):
+        """Start the clock at zero."""
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        """Return the current fake time."""
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """Advance the fake time instead of sleeping."""
+        self.now += seconds
+
+
+class TestRateLimiter:
+    """Tests for the RateLimiter token bucket."""
+
+    def test_consume_within_capacity_does_not_wait(self):
+        """Test that requests within the bucket capacity return immediately."""
+        clock = FakeClock()
+        with (
+            patch("kachi.engine.time.monotonic", clock.monotonic),
+            patch("kachi.engine.time.sleep", clock.sleep),
+        ):
+            limiter = RateLimiter(rate=100)
+            assert limiter.consume(100) == 0.0
+            assert clock.now == 0.0
+
+    def test_consume_beyond_capacity_waits_for_refill(self):
+        """Test that exceeding the rate sleeps long enough to honour it."""
+        clock = FakeClock()
+        with (
+            patch("kachi.engine.time.monotonic", clock.monotonic),
+            patch("kachi.engine.time.sleep", clock.sleep),
+        ):
+            limiter = RateLimiter(rate=100)
+            limiter.consume(100)
+            assert limiter.consume(300) == 3.0
+            # 400 tokens at 100/s, with a full bucket of 100 to start with.
+            assert clock.now == 3.0
+
+
+class TestCopyEngine:
+    """Tests for CopyEngine."""
+
+    def test_copy_file_records_stats(self, tmp_path: Path):
+        """Test that copying a file updates the transfer statistics."""
+        src = tmp_path / "src.txt"
+        src.write_text("hello")
+        engine = CopyEngine()
+
+        engine.copy_file(src, tmp_path / "dst.txt")
+
+        assert (tmp_path / "dst.txt").read_text() == "hello"
+        assert engine.stats.files == 1
+        assert engine.stats.bytes == 5
+
+    def test_throttled_copy_preserves_content_and_metadata(self, tmp_path: Path):
+        """Test that a byte-limited copy writes the same data and mtime."""
+        src = tmp_path / "src.bin"
+        src.write_bytes(b"x" * 4096)
+        dst = tmp_path / "dst.bin"
+        engine = CopyEngine(throttles=[Throttle(Limits(bytes_per_second=1024**3))])
+
+        engine.copy_file(src, dst)
+
+        assert dst.read_bytes() == src.read_bytes()
+        assert dst.stat().st_mtime_ns == src.stat().st_mtime_ns
+        assert engine.stats.bytes == 4096
+
+    def test_throttles_are_shared_between_engines(self, tmp_path: Path):
+        """Test that a shared throttle limits files across engines."""
+        src = tmp_path / "src.txt"
+        src.write_text("x")
+        clock = FakeClock()
+
+        with (
+            patch("kachi.engine.time.monotonic", clock.monotonic),
+            patch("kachi.engine.time.sleep", clock.sleep),
+        ):
+            shared = Throttle(Limits(files_per_second=1))
+            first = CopyEngine(throttles=[shared])
+            second = CopyEngine(throttles=[shared])
+            first.copy_file(src, tmp_path / "a.txt")
+            second.copy_file(src, tmp_path / "b.txt")
+
+        assert clock.now == 1.0
+        assert second.stats.throttled_seconds == 1.0
+
+
+class TestDurableWrites:
+    """Tests for durable, batched writes."""
+
+    def test_files_are_renamed_into_place_on_flush(self, tmp_path: Path):
+        """Test that durable copies only appear at their final path on commit."""
+        src = tmp_path / "src.txt"
+        src.write_text("durable")
+        dst = tmp_path / "dst.txt"
+        engine = CopyEngine(durable=True)
+
+        engine.copy_file(src, dst)
+        assert not dst.exists()
+        assert Path(temp_path(dst)).exists()
+
+        engine.flush()
+        assert dst.read_text() == "durable"
+        assert not Path(temp_path(dst)).exists()
+        assert dst.stat().st_mtime_ns == src.stat().st_mtime_ns
+
+    def test_batch_syncs_each_file_and_directory_once(self, tmp_path: Path):
+        """Test that a batch flushes its own files and their directory once."""
+        batch = DurableBatch(max_files=3)
+        for name in ("a", "b", "c"):
+            tmp = tmp_path / f"{name}.tmp"
+            tmp.write_text(name)
+            full = batch.add(str(tmp), str(tmp_path / name), 1)
+
+        assert full
+        with (
+            patch("kachi.engine.os.sync", create=True) as sync,
+            patch("kachi.engine._fsync_file") as fsync_file,
+            patch("kachi.engine._fsync_dir") as fsync_dir,
+        ):
+            batch.commit()
+
+        sync.assert_not_called()
+        assert sorted(c.args[0] for c in fsync_file.call_args_list) == [
+            str(tmp_path / f"{name}.tmp") for name in ("a", "b", "c")
+        ]
+        fsync_dir.assert_called_once_with(tmp_path)
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["a", "b", "c"]
+
+    def test_failed_copy_removes_temporary_file(self, tmp_path: Path):
+        """Test that a failed durable copy leaves no temporary file behind."""
+        src = tmp_path / "src.txt"
+        src.write_text("data")
+        dst = tmp_path / "dst.txt"
+        engine = CopyEngine(durable=True)
+
+        def fail(src, dst):
+            Path(dst).write_text("partial")
+            raise OSError("disk full")
+
+        with patch("shutil.copy2", side_effect=fail):
+            try:
+                engine.copy_file(src, dst)
+            except OSError:
+                pass
+
+        assert not Path(temp_path(dst)).exists()
+        assert not dst.exists()
+
+
+def _make_sparse_file(path: Path) -> Path:
+    """Create a file with a large hole between two small data regions.
+
+    Skips the calling test when the file system does not store holes.
+
+    Args:
+        path: Where to create the file.
+
+    Returns:
+        The path of the created file.
+    """
+    with open(path, "wb") as f:
+        f.write(b"head")
+        f.seek(8 * 1024 * 1024)
+        f.write(b"tail")
+    if not is_sparse(path.stat()):
+        pytest.skip("File system does not support sparse files")
+    return path
+
+
+class TestSparseCopies:
+    """Tests for sparse-file-aware copying."""
+
+    def test_sparse_file_keeps_holes(self, tmp_path: Path):
+        """Test that only data extents are written and holes are preserved."""
+        src = _make_sparse_file(tmp_path / "sparse.img")
+        dst = tmp_path / "copy.img"
+        engine = CopyEngine()
+
+        engine.copy_file(src, dst)
+
+        assert dst.read_bytes() == src.read_bytes()
+        assert is_sparse(dst.stat())
+        assert engine.stats.bytes == src.stat().st_size
+        assert engine.stats.physical_bytes < engine.stats.bytes
+
+    def test_regular_file_reports_equal_sizes(self, tmp_path: Path):
+        """Test that logical and physical sizes match for dense files."""
+        src = tmp_path / "dense.txt"
+        src.write_text("dense")
+        engine = CopyEngine()
+
+        engine.copy_file(src, tmp_path / "copy.txt")
+
+        assert engine.stats.physical_bytes == engine.stats.bytes == 5
@@ -3,7 +3,7 @@
 from pathlib import Path
 from unittest.mock import Mock
 
-from src.kachi.errors import BackupErrorHandler
+from kachi.errors import BackupErrorHandler
 
 
 class TestBackupErrorHandler:
@@ -72,3 +72,16 @@ class TestBackupErrorHandler:
         error_call = mock_logger.error.call_args[0][0]
         assert "Destination is not a directory" in error_call
         assert str(test_path) in error_call
+
+    def test_handle_destination_errors(self):
+        """Test that per-destination failures are summarized as a warning."""
+        mock_logger = Mock()
+        error_handler = BackupErrorHandler(mock_logger)
+        test_path = Path("/mnt/share")
+
+        error_handler.handle_destination_errors(test_path, 2)
+
+        mock_logger.warning.assert_called_once()
+        warning_call = mock_logger.warning.call_args[0][0]
+        assert "2 sources" in warning_call
+        assert str(test_path) in warning_call
@@ -0,0 +1,151 @@
+"""Tests for the multi-destination fan-out module."""
+
+import os
+import shutil
+import threading
+from pathlib import Path, PurePath
+from unittest.mock import patch
+
+import pytest
+
+from kachi.engine import CopyEngine, is_sparse
+from kachi.fanout import FanOut, _DestinationWriter
+
+
+def _make_tree(tmp_path: Path) -> Path:
+    """Create a source directory with a nested file.
+
+    Args:
+        tmp_path: The pytest temporary directory.
+
+    Returns:
+        Path to the source directory.
+    """
+    src = tmp_path / "src"
+    (src / "nested").mkdir(parents=True)
+    (src / "a.txt").write_text("alpha")
+    (src / "nested" / "b.txt").write_text("beta")
+    return src
+
+
+class TestFanOut:
+    """Tests for FanOut."""
+
+    def test_copy_tree_to_all_destinations(self, tmp_path: Path):
+        """Test that every destination receives a full copy of the tree."""
+        src = _make_tree(tmp_path)
+        roots = [tmp_path / "one", tmp_path / "two"]
+        for root in roots:
+            root.mkdir()
+        engine = CopyEngine()
+
+        with FanOut(engine, roots) as fan_out:
+            fan_out.copy_tree(src, PurePath("src"))
+            failures = fan_out.wait()
+
+        assert failures == {roots[0]: [], roots[1]: []}
+        for root in roots:
+            assert (root / "src" / "a.txt").read_text() == "alpha"
+            assert (root / "src" / "nested" / "b.txt").read_text() == "beta"
+        # Each source file is read, and counted, only once.
+        assert engine.stats.files == 2
+        assert engine.stats.bytes == 9
+
+    def test_broken_destination_does_not_affect_others(self, tmp_path: Path):
+        """Test that failures are tracked per destination."""
+        src = _make_tree(tmp_path)
+        good = tmp_path / "good"
+        broken = tmp_path / "broken"
+        good.mkdir()
+        broken.mkdir()
+        # A file where the copied directory should go breaks every write.
+        (broken / "src").write_text("in the way")
+
+        with FanOut(CopyEngine(), [good, broken]) as fan_out:
+            fan_out.copy_tree(src, PurePath("src"))
+            failures = fan_out.wait()
+
+        assert failures[good] == []
+        assert len(failures[broken]) > 0
+        assert (good / "src" / "nested" / "b.txt").read_text() == "beta"
+
+    def test_durable_fan_out_commits_on_wait(self, tmp_path: Path):
+        """Test that durable writes are renamed into place when waited on."""
+        src = _make_tree(tmp_path)
+        roots = [tmp_path / "one", tmp_path / "two"]
+        for root in roots:
+            root.mkdir()
+
+        with FanOut(CopyEngine(durable=True), roots) as fan_out:
+            fan_out.copy_tree(src, PurePath("src"))
+            fan_out.wait()
+
+        for root in roots:
+            names = sorted(p.name for p in (root / "src").iterdir())
+            assert names == ["a.txt", "nested"]
+
+    def test_sparse_file_keeps_holes_in_every_destination(self, tmp_path: Path):
+        """Test that the fan-out writes only the data extents of sparse files."""
+        src = tmp_path / "sparse.img"
+        with open(src, "wb") as f:
+            f.seek(4 * 1024 * 1024)
+            f.write(b"tail")
+        roots = [tmp_path / "one", tmp_path / "two"]
+        for root in roots:
+            root.mkdir()
+        engine = CopyEngine()
+
+        with FanOut(engine, roots) as fan_out:
+            fan_out.copy_file(src, PurePath("sparse.img"))
+            fan_out.wait()
+
+        for root in roots:
+            assert (root / "sparse.img").read_bytes() == src.read_bytes()
+        if is_sparse(src.stat()):
+            assert engine.stats.physical_bytes == 4
+
+    def test_stalled_destination_is_detached(self, tmp_path: Path):
+        """Test that a destination that stops writing does not block the rest."""
+        src = _make_tree(tmp_path)
+        fast = tmp_path / "fast"
+        slow = tmp_path / "slow"
+        fast.mkdir()
+        slow.mkdir()
+        release = threading.Event()
+        apply = _DestinationWriter._apply
+
+        def stall(writer, *op):
+            if writer.root == slow:
+                release.wait()
+            apply(writer, *op)
+
+        with (
+            patch("kachi.fanout.MAX_PENDING_CHUNKS", 1),
+            patch.object(_DestinationWriter, "_apply", stall),
+        ):
+            with FanOut(CopyEngine(), [fast, slow], stall_timeout=0.1) as fan_out:
+                fan_out.copy_tree(src, PurePath("src"))
+                failures = fan_out.wait()
+                again = fan_out.wait()
+            release.set()
+
+        assert failures[fast] == []
+        assert isinstance(failures[slow][0][1], TimeoutError)
+        assert isinstance(again[slow][0][1], TimeoutError)
+        assert (fast / "src" / "nested" / "b.txt").read_text() == "beta"
+
+    @pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="mkfifo not available")
+    def test_fifo_is_reported_not_read(self, tmp_path: Path):
+        """Test that a named pipe in the tree is an error instead of a hang."""
+        src = _make_tree(tmp_path)
+        os.mkfifo(src / "pipe")
+        root = tmp_path / "one"
+        root.mkdir()
+
+        with FanOut(CopyEngine(), [root]) as fan_out:
+            with pytest.raises(shutil.Error) as excinfo:
+                fan_out.copy_tree(src, PurePath("src"))
+            fan_out.wait()
+
+        assert "not a regular file" in excinfo.value.args[0][0][2]
+        assert (root / "src" / "a.txt").read_text() == "alpha"
@@ -0,0 +1,126 @@
+"""Tests for the run history module."""
+
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from kachi.history import HistoryStore, Trend
+
+
+class TestHistoryStore:
+    """Tests for HistoryStore."""
+
+    def test_throughput_without_history(self, tmp_path: Path):
+        """Test that no throughput is reported before any run is recorded."""
+        store = HistoryStore(tmp_path / "history.db")
+        assert store.throughput("p") is None
+        assert not (tmp_path / "history.db").exists()
+
+    def test_throughput_from_recorded_runs(self, tmp_path: Path):
+        """Test that throughput is averaged over recorded runs."""
+        store = HistoryStore(tmp_path / "history.db")
+        store.record_run("p", seconds=2.0, files=1, bytes_copied=100)
+        store.record_run("p", seconds=2.0, files=1, bytes_copied=300)
+
+        assert store.throughput("p") == 100.0
+
+    def test_throughput_falls_back_to_all_profiles(self, tmp_path: Path):
+        """Test that a profile without history uses other profiles' runs."""
+        store = HistoryStore(tmp_path / "history.db")
+        store.record_run("other", seconds=1.0, files=1, bytes_copied=50)
+        store.record_run("empty", seconds=1.0, files=0, bytes_copied=0)
+
+        assert store.throughput("empty") == 50.0
+
+    def test_trends_without_history(self, tmp_path: Path):
+        """Test that a profile without runs has no trends."""
+        store = HistoryStore(tmp_path / "history.db")
+        assert store.trends("p") == (None, [])
+        assert store.profiles() == []
+
+    def test_trends_compare_latest_with_median(self, tmp_path: Path):
+        """Test that the latest run is compared with the median of earlier runs."""
+        store = HistoryStore(tmp_path / "history.db")
+        for seconds in (10.0, 12.0, 11.0, 30.0):
+            store.record_run(
+                "p",
+                seconds,
+                2,
+                200,
+                {
+                    Path("/data/slow"): (seconds - 1, 1, 100),
+                    Path("/data/steady"): (1.0, 1, 100),
+                },
+            )
+
+        profile, sources = store.trends("p")
+
+        assert store.profiles() == ["p"]
+        assert (profile.seconds, profile.previous_runs) == (30.0, 3)
+        assert profile.baseline_seconds == 11.0
+        assert [s.name for s in sources] == ["/data/slow", "/data/steady"]
+        assert sources[0].slower(1.5)
+        assert not sources[1].slower(1.5)
+        assert not sources[1].larger(1.5)
+
+    def test_trends_skip_removed_sources(self, tmp_path: Path):
+        """Test that sources missing from the latest run are left out."""
+        store = HistoryStore(tmp_path / "history.db")
+        store.record_run("p", 1.0, 1, 10, {Path("/old"): (1.0, 1, 10)})
+        store.record_run("p", 1.0, 1, 10, {Path("/new"): (1.0, 1, 10)})
+
+        _, sources = store.trends("p")
+
+        assert [(s.name, s.previous_runs) for s in sources] == [("/new", 0)]
+
+    def test_runs_with_errors_are_left_out(self, tmp_path: Path):
+        """Test that failed runs skew neither trends nor throughput."""
+        store = HistoryStore(tmp_path / "history.db")
+        store.record_run("p", 10.0, 2, 1000, {Path("/data"): (10.0, 2, 1000)})
+        store.record_run("p", 1.0, 1, 10, {Path("/data"): (1.0, 1, 10)}, errors=3)
+
+        profile, sources = store.trends("p")
+
+        assert (profile.seconds, profile.previous_runs) == (10.0, 0)
+        assert [(s.name, s.seconds) for s in sources] == [("/data", 10.0)]
+        assert store.throughput("p") == 100.0
+
+    def test_old_database_gains_errors_column(self, tmp_path: Path):
+        """Test that a database from before errors were recorded still works."""
+        path = tmp_path / "history.db"
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE runs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "profile TEXT NOT NULL, started REAL NOT NULL, seconds REAL NOT NULL, "
+            "files INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "INSERT INTO runs (profile, started, seconds, files, bytes) "
+            "VALUES ('p', 0, 2.0, 1, 100)"
+        )
+        conn.commit()
+        conn.close()
+        store = HistoryStore(path)
+
+        store.record_run("p", 2.0, 1, 300, errors=1)
+
+        assert store.throughput("p") == 50.0
+
+
+class TestTrend:
+    """Tests for Trend."""
+
+    def test_short_runs_are_not_flagged_as_slower(self):
+        """Test that runs under the minimum duration are never flagged."""
+        trend = Trend("s", 0.3, 1, 10, 1, baseline_seconds=0.1, baseline_bytes=10)
+        assert trend.time_growth == pytest.approx(3.0)
+        assert not trend.slower(1.5)
+        assert trend.slower(1.5, min_seconds=0.1)
+
+    def test_size_growth(self):
+        """Test that data growth beyond the threshold is flagged."""
+        trend = Trend("s", 1.0, 1, 300, 1, baseline_seconds=1.0, baseline_bytes=100)
+        assert trend.larger(2.0)
+        assert not trend.larger(3.0)
+        assert Trend("s", 1.0, 1, 300).size_growth is None
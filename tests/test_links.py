@@ -0,0 +1,129 @@
+"""Tests for linking identical files within a run."""
+
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.backup import backup_profile
+from kachi.config import Profile, Scheduling
+from kachi.engine import CopyEngine
+from kachi.links import find_duplicates
+from kachi.scheduler import DeviceScheduler
+
+
+@pytest.fixture
+def homes(tmp_path: Path) -> list[Path]:
+    """Create two home directories sharing a .bashrc, plus a unique file."""
+    sources = []
+    for user in ("alice", "bob"):
+        home = tmp_path / "home" / user
+        home.mkdir(parents=True)
+        (home / ".bashrc").write_text("export EDITOR=vim\n")
+        sources.append(home)
+    (sources[0] / "notes.txt").write_text("only alice")
+    (sources[1] / "todo.txt").write_text("only bob!!")
+    return sources
+
+
+class TestFindDuplicates:
+    """Tests for find_duplicates."""
+
+    def test_groups_identical_files(self, homes: list[Path]):
+        """Test that identical files share a group and others have none."""
+        index = find_duplicates(homes)
+
+        alice, bob = (os.stat(h / ".bashrc") for h in homes)
+        assert index.group_of(alice) is not None
+        assert index.group_of(alice) == index.group_of(bob)
+        # Same size as notes.txt, different content.
+        assert index.group_of(os.stat(homes[1] / "todo.txt")) is None
+        assert len(index) == 2
+
+    def test_changed_file_is_not_grouped(self, homes: list[Path]):
+        """Test that a file modified after hashing is copied, not linked."""
+        index = find_duplicates(homes)
+        bashrc = homes[0] / ".bashrc"
+        st = bashrc.stat()
+        os.utime(bashrc, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+
+        assert index.group_of(bashrc.stat()) is None
+
+
+class TestLinkedBackups:
+    """Tests for backing up profiles with link_duplicates."""
+
+    def _profile(self, homes: list[Path], dest: Path, **options) -> Profile:
+        """Return a profile backing up the homes with duplicates linked."""
+        return Profile(
+            name="homes",
+            sources=homes,
+            backup_destination=dest,
+            link_duplicates=True,
+            **options,
+        )
+
+    def test_duplicates_are_hard_linked(self, homes: list[Path], tmp_path: Path):
+        """Test that the second copy is a link and the bytes are reported."""
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        engine = CopyEngine()
+
+        _, success, errors = backup_profile(self._profile(homes, dest), engine)
+
+        alice = (dest / "alice" / ".bashrc").stat()
+        bob = (dest / "bob" / ".bashrc").stat()
+        assert (success, errors) == (2, 0)
+        assert alice.st_ino == bob.st_ino
+        assert engine.stats.linked_files == 1
+        assert engine.stats.linked_bytes == len("export EDITOR=vim\n")
+        assert engine.stats.files == 4
+
+    def test_parallel_sources_share_index(self, homes: list[Path], tmp_path: Path):
+        """Test that sources backed up in parallel link across each other."""
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        scheduler = DeviceScheduler(
+            Scheduling(workers=2, device_limit=2), lambda p, throttle: CopyEngine()
+        )
+
+        with patch("kachi.scheduler.find_duplicates", wraps=find_duplicates) as find:
+            [run] = scheduler.run([self._profile(homes, dest)])
+
+        alice = (dest / "alice" / ".bashrc").stat()
+        bob = (dest / "bob" / ".bashrc").stat()
+        assert find.call_count == 1
+        assert (run.success, run.errors) == (2, 0)
+        assert alice.st_ino == bob.st_ino
+        assert run.stats.linked_files == 1
+
+    def test_durable_links(self, homes: list[Path], tmp_path: Path):
+        """Test that linking works while copies wait to be renamed."""
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        engine = CopyEngine(durable=True)
+
+        backup_profile(self._profile(homes, dest, durable=True), engine)
+
+        alice = (dest / "alice" / ".bashrc").stat()
+        bob = (dest / "bob" / ".bashrc").stat()
+        assert alice.st_ino == bob.st_ino
+        assert (dest / "bob" / ".bashrc").read_text() == "export EDITOR=vim\n"
+
+    def test_rewriting_a_linked_copy_leaves_the_other(
+        self, homes: list[Path], tmp_path: Path
+    ):
+        """Test that a later run never writes through a link."""
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        backup_profile(self._profile(homes, dest), CopyEngine())
+        (homes[0] / ".bashrc").write_text("export EDITOR=emacs\n")
+
+        backup_profile(
+            Profile(name="homes", sources=homes, backup_destination=dest),
+            CopyEngine(),
+        )
+
+        assert (dest / "alice" / ".bashrc").read_text() == "export EDITOR=emacs\n"
+        assert (dest / "bob" / ".bashrc").read_text() == "export EDITOR=vim\n"
@@ -0,0 +1,106 @@
+"""Tests for the dry-run planning module."""
+
+import os
+from pathlib import Path
+
+from kachi.config import Profile
+from kachi.plan import ProfilePlan, plan_profile
+
+
+def _make_source(tmp_path: Path) -> Path:
+    """Create a small source tree with two files and a nested directory.
+
+    Args:
+        tmp_path: The pytest temporary directory.
+
+    Returns:
+        Path to the source directory.
+    """
+    src = tmp_path / "src-dir"
+    (src / "nested").mkdir(parents=True)
+    (src / "a.txt").write_text("aaaa")
+    (src / "nested" / "b.txt").write_text("bbbbbb")
+    return src
+
+
+class TestPlan:
+    """Tests for plan_profile and ProfilePlan."""
+
+    def test_plan_counts_new_files(self, tmp_path: Path):
+        """Test that files missing from the destination are counted as new."""
+        src = _make_source(tmp_path)
+        dest = tmp_path / "backup"
+        dest.mkdir()
+
+        plan = plan_profile(Profile(name="p", sources=[src], backup_destination=dest))
+
+        assert plan.files == 2
+        assert plan.bytes == 10
+        assert plan.new == 2
+        assert plan.changed == 0
+
+    def test_plan_detects_changed_and_unchanged_files(self, tmp_path: Path):
+        """Test that existing copies are classified as changed or unchanged."""
+        src = _make_source(tmp_path)
+        dest = tmp_path / "backup"
+        (dest / "src-dir" / "nested").mkdir(parents=True)
+
+        # Unchanged copy: same size and modification time.
+        a_copy = dest / "src-dir" / "a.txt"
+        a_copy.write_text("aaaa")
+        st = (src / "a.txt").stat()
+        os.utime(a_copy, ns=(st.st_atime_ns, st.st_mtime_ns))
+        # Changed copy: different size.
+        (dest / "src-dir" / "nested" / "b.txt").write_text("b")
+
+        plan = plan_profile(Profile(name="p", sources=[src], backup_destination=dest))
+
+        assert plan.new == 0
+        assert plan.changed == 1
+        assert plan.sources[0].unchanged == 1
+
+    def test_plan_single_file_and_missing_source(self, tmp_path: Path):
+        """Test planning a file source alongside a missing source."""
+        f = tmp_path / "file.txt"
+        f.write_text("12345")
+        dest = tmp_path / "backup"
+        dest.mkdir()
+        missing = tmp_path / "missing.txt"
+
+        plan = plan_profile(
+            Profile(name="p", sources=[f, missing], backup_destination=dest)
+        )
+
+        assert plan.files == 1
+        assert plan.bytes == 5
+        assert plan.not_found == [missing]
+        assert plan.destination_valid
+
+    def test_plan_does_not_write(self, tmp_path: Path):
+        """Test that planning leaves an invalid destination untouched."""
+        src = _make_source(tmp_path)
+        dest = tmp_path / "does-not-exist"
+
+        plan = plan_profile(Profile(name="p", sources=[src], backup_destination=dest))
+
+        assert not dest.exists()
+        assert not plan.destination_valid
+        assert plan.new == 2
+
+    def test_plan_counts_unreadable_entries(self, tmp_path: Path):
+        """Test that a broken symlink is counted as an error, not raised."""
+        src = _make_source(tmp_path)
+        (src / "nested" / "dangling").symlink_to(tmp_path / "gone")
+        dest = tmp_path / "backup"
+        dest.mkdir()
+
+        plan = plan_profile(Profile(name="p", sources=[src], backup_destination=dest))
+
+        assert plan.files == 2
+        assert plan.errors == 1
+
+    def test_estimate_seconds(self):
+        """Test that the duration estimate uses the given throughput."""
+        plan = ProfilePlan(profile="p", destination=None)
+        assert plan.estimate_seconds(None) is None
+        assert plan.estimate_seconds(100.0) == 0.0
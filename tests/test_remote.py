@@ -0,0 +1,262 @@
+"""Tests for the remote backup module."""
+
+import os
+import socket
+import struct
+import threading
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from kachi.backup import backup_profile, backup_remote
+from kachi.config import FastScan, Profile, RemoteDestination
+from kachi.engine import CopyEngine
+from kachi.errors import DestinationError
+from kachi.events import FileFailed
+from kachi.remote import (
+    MAX_HEADER_SIZE,
+    BackupServer,
+    RemoteStore,
+    close_pools,
+    get_pool,
+)
+
+
+@pytest.fixture
+def server(tmp_path: Path, request):
+    """Run a backup server on a free localhost port.
+
+    Tests marked with ``@pytest.mark.parametrize("server", [token],
+    indirect=True)`` get a server that requires that token.
+    """
+    root = tmp_path / "store"
+    root.mkdir()
+    server = BackupServer(root, token=getattr(request, "param", None))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    close_pools()
+    server.shutdown()
+    server.server_close()
+
+
+def _destination(server: BackupServer) -> RemoteDestination:
+    """Return the destination a test server listens on."""
+    return RemoteDestination(*server.server_address[:2])
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> Path:
+    """Create a source tree with small files and one larger file."""
+    src = tmp_path / "docs"
+    (src / "sub").mkdir(parents=True)
+    for i in range(5):
+        (src / f"note{i}.txt").write_text(f"note {i}")
+    (src / "sub" / "big.bin").write_bytes(os.urandom(200 * 1024))
+    return src
+
+
+class TestBackupRemote:
+    """Tests for backing up to a server."""
+
+    def test_tree_is_stored_under_profile(
+        self, server: BackupServer, source: Path, tmp_path: Path
+    ):
+        """Test that a tree arrives intact, with its modification times."""
+        engine = CopyEngine()
+
+        assert backup_remote(source, _destination(server), "laptop", engine)
+
+        stored = tmp_path / "store" / "laptop" / "docs"
+        assert (stored / "note3.txt").read_text() == "note 3"
+        big = stored / "sub" / "big.bin"
+        assert big.read_bytes() == (source / "sub" / "big.bin").read_bytes()
+        assert big.stat().st_mtime_ns == (source / "sub" / "big.bin").stat().st_mtime_ns
+        assert engine.stats.files == 6
+
+    def test_small_files_are_batched(self, server: BackupServer, source: Path):
+        """Test that small files are sent in batches rather than one by one."""
+        requests = []
+        original = RemoteStore.receive
+
+        def record(store, header, rfile):
+            requests.append(header["op"])
+            return original(store, header, rfile)
+
+        with patch.object(RemoteStore, "receive", record):
+            assert backup_remote(source, _destination(server), "p", CopyEngine())
+
+        assert requests.count("batch") == 1
+        assert requests.count("file") == 1
+
+    def test_connections_are_reused(self, server: BackupServer, source: Path):
+        """Test that a second backup reuses the pooled connection."""
+        dest = _destination(server)
+        backup_remote(source, dest, "p", CopyEngine())
+        first = list(get_pool(dest)._idle)
+
+        backup_remote(source, dest, "p", CopyEngine())
+
+        assert get_pool(dest)._idle == first
+        assert len(first) == 1
+
+    def test_concurrent_clients_use_separate_profiles(
+        self, server: BackupServer, source: Path, tmp_path: Path
+    ):
+        """Test that several clients can write to the server at once."""
+        dest = _destination(server)
+        results = {}
+
+        def run(name: str) -> None:
+            results[name] = backup_remote(source, dest, name, CopyEngine())
+
+        threads = [threading.Thread(target=run, args=(f"host{i}",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert all(results.values())
+        for i in range(4):
+            assert (tmp_path / "store" / f"host{i}" / "docs" / "note0.txt").exists()
+
+    def test_server_write_errors_are_reported(
+        self, server: BackupServer, source: Path, tmp_path: Path
+    ):
+        """Test that a file the server cannot write fails the source."""
+        (tmp_path / "store" / "p").write_text("not a directory")
+
+        assert not backup_remote(source, _destination(server), "p", CopyEngine())
+
+    @pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="mkfifo not available")
+    def test_fifo_is_reported_not_sent(
+        self, server: BackupServer, source: Path, tmp_path: Path
+    ):
+        """Test that a named pipe in the tree is an error instead of a hang."""
+        os.mkfifo(source / "sub" / "pipe")
+        engine = CopyEngine()
+        events = []
+        engine.listener = events.append
+
+        assert not backup_remote(source, _destination(server), "p", engine)
+
+        stored = tmp_path / "store" / "p" / "docs"
+        assert (stored / "note0.txt").read_text() == "note 0"
+        assert not (stored / "sub" / "pipe").exists()
+        failed = [e for e in events if isinstance(e, FileFailed)]
+        assert [e.src for e in failed] == [source / "sub" / "pipe"]
+
+    def test_unsupported_options_are_reported(
+        self, server: BackupServer, source: Path, caplog: pytest.LogCaptureFixture
+    ):
+        """Test that fast scans are reported as not applied to a server."""
+        profile = Profile(
+            name="p",
+            sources=[source],
+            backup_destination=_destination(server),
+            fast_scan=FastScan(),
+        )
+
+        backup_profile(profile)
+
+        assert "fast scans" in caplog.text
+
+    def test_unreachable_server_aborts_profile(self, source: Path):
+        """Test that a profile exits when its server cannot be reached."""
+        profile = Profile(
+            name="p",
+            sources=[source],
+            backup_destination=RemoteDestination("127.0.0.1", 1),
+        )
+
+        with pytest.raises(DestinationError):
+            backup_profile(profile)
+
+    def test_backup_profile_sends_sources(
+        self, server: BackupServer, source: Path, tmp_path: Path
+    ):
+        """Test that backup_profile sends every source to the server."""
+        profile = Profile(
+            name="p",
+            sources=[source, tmp_path / "missing"],
+            backup_destination=_destination(server),
+        )
+
+        not_found, success, errors = backup_profile(profile)
+
+        assert not_found == [tmp_path / "missing"]
+        assert (success, errors) == (1, 1)
+        assert (tmp_path / "store" / "p" / "docs" / "note1.txt").exists()
+
+
+class TestRemoteStore:
+    """Tests for RemoteStore."""
+
+    @pytest.mark.parametrize(
+        ("profile", "path"),
+        [
+            ("..", "file"),
+            ("a/b", "file"),
+            ("p", "../escape"),
+            ("p", "/etc/passwd"),
+            ("p", "..\\..\\evil.txt"),
+            ("p", "C:\\Windows\\evil.txt"),
+            ("p", "sub/C:evil.txt"),
+        ],
+    )
+    def test_paths_cannot_escape_store(self, tmp_path: Path, profile, path):
+        """Test that profile names and paths are confined to the store."""
+        with pytest.raises(ValueError):
+            RemoteStore(tmp_path).target(profile, path)
+
+    @pytest.mark.skipif(os.name == "nt", reason="Symlinks need privileges")
+    def test_symlinks_cannot_escape_store(self, tmp_path: Path):
+        """Test that a symlink inside the store cannot redirect writes."""
+        (tmp_path / "store" / "p").mkdir(parents=True)
+        (tmp_path / "store" / "p" / "link").symlink_to(tmp_path)
+
+        with pytest.raises(ValueError):
+            RemoteStore(tmp_path / "store").target("p", "link/evil.txt")
+
+    def test_target_stays_in_profile_directory(self, tmp_path: Path):
+        """Test that a valid path resolves inside the profile's directory."""
+        target = RemoteStore(tmp_path).target("p", "docs/./note.txt")
+
+        assert target == (tmp_path / "p" / "docs" / "note.txt").resolve()
+
+
+class TestServerSecurity:
+    """Tests for the server's token check and message limits."""
+
+    @pytest.mark.parametrize("server", ["secret"], indirect=True)
+    def test_matching_token_is_accepted(
+        self, server: BackupServer, source: Path, tmp_path: Path
+    ):
+        """Test that a client with the server's token can back up."""
+        host, port = server.server_address[:2]
+        dest = RemoteDestination(host, port, token="secret")
+
+        assert backup_remote(source, dest, "p", CopyEngine())
+        assert (tmp_path / "store" / "p" / "docs" / "note0.txt").exists()
+
+    @pytest.mark.parametrize("server", ["secret"], indirect=True)
+    @pytest.mark.parametrize("token", [None, "wrong"])
+    def test_wrong_token_is_refused(
+        self, server: BackupServer, source: Path, tmp_path: Path, token
+    ):
+        """Test that a client without the right token cannot write files."""
+        host, port = server.server_address[:2]
+        dest = RemoteDestination(host, port, token=token)
+
+        with pytest.raises(PermissionError):
+            with get_pool(dest).connection():
+                pass
+        assert not (tmp_path / "store" / "p").exists()
+
+    def test_oversized_header_closes_connection(self, server: BackupServer):
+        """Test that the server refuses a header above the size limit."""
+        with socket.create_connection(server.server_address[:2], timeout=5) as sock:
+            sock.sendall(struct.pack("!I", MAX_HEADER_SIZE + 1))
+
+            assert sock.recv(1) == b""
@@ -0,0 +1,209 @@
+"""Tests for the fast scan module."""
+
+import os
+import shutil
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from kachi.backup import backup_dir
+from kachi.config import FastScan
+from kachi.engine import CopyEngine
+from kachi.scan import ScanState, fast_copy_tree
+
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    """Create a small source tree with a nested directory."""
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a.txt").write_text("a")
+    (src / "sub" / "b.txt").write_text("b")
+    return src
+
+
+def _copy(src: str, dst: str) -> str:
+    """Copy a file with shutil, so calls can be recorded by a mock."""
+    return shutil.copy2(src, dst)
+
+
+class TestFastCopyTree:
+    """Tests for fast_copy_tree."""
+
+    def test_first_run_copies_everything(self, tree: Path, tmp_path: Path):
+        """Test that without state every directory is listed and copied."""
+        dest = tmp_path / "dest" / "src"
+
+        stats = fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+
+        assert stats.full
+        assert stats.dirs_listed == 2
+        assert stats.copied == 2
+        assert (dest / "a.txt").read_text() == "a"
+        assert (dest / "sub" / "b.txt").read_text() == "b"
+
+    def test_unchanged_directories_are_not_listed(self, tree: Path, tmp_path: Path):
+        """Test that a second run reuses listings and copies nothing."""
+        dest = tmp_path / "dest" / "src"
+        fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+        copy = MagicMock(side_effect=_copy)
+
+        with patch("kachi.scan.os.scandir") as scandir:
+            stats = fast_copy_tree(tree, dest, copy, tmp_path / "scan", FastScan())
+
+        scandir.assert_not_called()
+        copy.assert_not_called()
+        assert not stats.full
+        assert stats.dirs_reused == 2
+        assert stats.files == 2
+
+    def test_file_changed_in_place_is_copied(self, tree: Path, tmp_path: Path):
+        """Test that a modified file is found without relisting its directory."""
+        dest = tmp_path / "dest" / "src"
+        fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+        (tree / "sub" / "b.txt").write_text("changed")
+
+        stats = fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+
+        assert stats.dirs_listed == 0
+        assert stats.copied == 1
+        assert (dest / "sub" / "b.txt").read_text() == "changed"
+
+    def test_new_file_relists_its_directory(self, tree: Path, tmp_path: Path):
+        """Test that adding a file lists only the directory it was added to."""
+        dest = tmp_path / "dest" / "src"
+        fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+        (tree / "sub" / "c.txt").write_text("c")
+        # Make sure the directory time differs on coarse-grained clocks.
+        st = os.stat(tree / "sub")
+        os.utime(tree / "sub", ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+        stats = fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+
+        assert stats.dirs_listed == 1
+        assert stats.dirs_reused == 1
+        assert stats.copied == 1
+        assert (dest / "sub" / "c.txt").read_text() == "c"
+
+    def test_periodic_full_rescan(self, tree: Path, tmp_path: Path):
+        """Test that every Nth run lists every directory again."""
+        dest = tmp_path / "dest" / "src"
+        settings = FastScan(full_rescan_every=2)
+
+        results = [
+            fast_copy_tree(tree, dest, _copy, tmp_path / "scan", settings).full
+            for _ in range(4)
+        ]
+
+        assert results == [True, False, True, False]
+
+    def test_missing_destination_copies_everything(self, tree: Path, tmp_path: Path):
+        """Test that a removed destination is repopulated in full."""
+        dest = tmp_path / "dest" / "src"
+        fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+        shutil.rmtree(dest)
+
+        stats = fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+
+        assert stats.full
+        assert stats.copied == 2
+
+    def test_failed_copy_is_retried(self, tree: Path, tmp_path: Path):
+        """Test that a file that failed to copy is not recorded as done."""
+        dest = tmp_path / "dest" / "src"
+
+        def failing(src: str, dst: str) -> str:
+            if src.endswith("a.txt"):
+                raise PermissionError("denied")
+            return _copy(src, dst)
+
+        with pytest.raises(shutil.Error):
+            fast_copy_tree(tree, dest, failing, tmp_path / "scan", FastScan())
+        stats = fast_copy_tree(tree, dest, _copy, tmp_path / "scan", FastScan())
+
+        assert stats.copied == 1
+        assert (dest / "a.txt").exists()
+
+    @pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="mkfifo not available")
+    def test_fifo_is_reported_not_copied(self, tree: Path, tmp_path: Path):
+        """Test that a named pipe is an error instead of a copy that hangs."""
+        os.mkfifo(tree / "sub" / "pipe")
+        dest = tmp_path / "dest" / "src"
+        copy = MagicMock(side_effect=_copy)
+
+        with pytest.raises(shutil.Error) as excinfo:
+            fast_copy_tree(tree, dest, copy, tmp_path / "scan", FastScan())
+
+        [(failed_src, _, reason)] = excinfo.value.args[0]
+        assert failed_src == str(tree / "sub" / "pipe")
+        assert "not a regular file" in reason
+        assert copy.call_count == 2
+        assert (dest / "sub" / "b.txt").read_text() == "b"
+
+    def test_full_rescan_repairs_destination(self, tree: Path, tmp_path: Path):
+        """Test that a full rescan replaces deleted and damaged copies."""
+        dest = tmp_path / "dest" / "src"
+        settings = FastScan(full_rescan_every=2)
+        fast_copy_tree(tree, dest, _copy, tmp_path / "scan", settings)
+        fast_copy_tree(tree, dest, _copy, tmp_path / "scan", settings)
+        (dest / "a.txt").unlink()
+        (dest / "sub" / "b.txt").write_text("damaged")
+
+        stats = fast_copy_tree(tree, dest, _copy, tmp_path / "scan", settings)
+
+        assert stats.full
+        assert stats.copied == 2
+        assert (dest / "a.txt").read_text() == "a"
+        assert (dest / "sub" / "b.txt").read_text() == "b"
+
+    def test_failed_flush_is_retried(self, tree: Path, tmp_path: Path):
+        """Test that a file failing when queued copies finish is not recorded."""
+        dest = tmp_path / "dest" / "src"
+
+        def flush():
+            raise shutil.Error([(str(tree / "a.txt"), str(dest / "a.txt"), "boom")])
+
+        with pytest.raises(shutil.Error):
+            fast_copy_tree(
+                tree, dest, _copy, tmp_path / "scan", FastScan(), flush=flush
+            )
+        copy = MagicMock(side_effect=_copy)
+        fast_copy_tree(tree, dest, copy, tmp_path / "scan", FastScan())
+
+        copy.assert_called_once_with(str(tree / "a.txt"), str(dest / "a.txt"))
+
+
+class TestScanState:
+    """Tests for ScanState."""
+
+    def test_state_depends_on_source_and_destination(self, tmp_path: Path):
+        """Test that each source and destination pair has its own file."""
+        first = ScanState.for_source(tmp_path, Path("/a"), Path("/b"))
+        second = ScanState.for_source(tmp_path, Path("/a"), Path("/c"))
+
+        assert first.path != second.path
+
+    def test_corrupt_state_is_ignored(self, tmp_path: Path):
+        """Test that an unreadable state file is treated as missing."""
+        state = ScanState(tmp_path / "state.json")
+        state.path.write_text("not json")
+
+        assert not state.load()
+
+
+class TestBackupDirFastScan:
+    """Tests for backup_dir with fast scans enabled."""
+
+    def test_backup_dir_uses_fast_scan(self, tree: Path, tmp_path: Path):
+        """Test that an engine with fast scans bypasses shutil.copytree."""
+        dest = tmp_path / "dest"
+        dest.mkdir()
+        engine = CopyEngine(fast_scan=FastScan(), scan_dir=tmp_path / "scan")
+
+        with patch("kachi.backup.shutil.copytree") as copytree:
+            assert backup_dir(tree, dest, engine)
+
+        copytree.assert_not_called()
+        assert (dest / "src" / "sub" / "b.txt").read_text() == "b"
+        assert engine.stats.files == 2
@@ -0,0 +1,178 @@
+"""Tests for the device-aware scheduler module."""
+
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+from kachi.config import Profile, Scheduling
+from kachi.engine import CopyEngine
+from kachi.scheduler import DeviceScheduler, is_rotational
+
+
+class ConcurrencyProbe:
+    """Stand-in for backup_profile that records how many calls overlap."""
+
+    def __init__(self):
+        """Start with no calls in flight."""
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def __call__(self, profile, engine):
+        """Pretend to back up a profile, holding it briefly."""
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self.lock:
+            self.active -= 1
+        engine.stats.files += 1
+        engine.stats.bytes += 10
+        return [], 1, 0
+
+
+def _profiles(tmp_path: Path) -> list[Profile]:
+    """Create two profiles with two sources each and separate destinations.
+
+    Args:
+        tmp_path: The pytest temporary directory.
+
+    Returns:
+        The profiles.
+    """
+    profiles = []
+    for name in ("one", "two"):
+        dest = tmp_path / f"dest-{name}"
+        dest.mkdir()
+        sources = []
+        for i in range(2):
+            src = tmp_path / f"{name}-{i}.txt"
+            src.write_text(name)
+            sources.append(src)
+        profiles.append(Profile(name=name, sources=sources, backup_destination=dest))
+    return profiles
+
+
+class TestIsRotational:
+    """Tests for is_rotational."""
+
+    def test_unknown_without_device_numbers(self, monkeypatch):
+        """Test that platforms without major/minor numbers report None."""
+        monkeypatch.delattr("os.major", raising=False)
+
+        assert is_rotational(1234) is None
+
+
+class TestDeviceScheduler:
+    """Tests for DeviceScheduler."""
+
+    def test_same_device_is_serialized(self, tmp_path: Path):
+        """Test that items sharing a device respect its concurrency limit."""
+        probe = ConcurrencyProbe()
+        scheduler = DeviceScheduler(
+            Scheduling(workers=4, device_limit=1), lambda p, throttle: CopyEngine()
+        )
+
+        with patch("kachi.scheduler.backup_profile", probe):
+            runs = scheduler.run(_profiles(tmp_path))
+
+        assert probe.peak == 1
+        assert [r.success for r in runs] == [2, 2]
+
+    def test_shared_target_is_serialized(self, tmp_path: Path):
+        """Test that two profiles copying a source to one path never overlap."""
+        probe = ConcurrencyProbe()
+        scheduler = DeviceScheduler(
+            Scheduling(workers=4, device_limit=4), lambda p, throttle: CopyEngine()
+        )
+        src = tmp_path / "notes.txt"
+        src.write_text("notes")
+        dest = tmp_path / "dest"
+        dest.mkdir()
+        profiles = [
+            Profile(name=name, sources=[src], backup_destination=dest)
+            for name in ("one", "two")
+        ]
+
+        with patch("kachi.scheduler.backup_profile", probe):
+            runs = scheduler.run(profiles)
+
+        assert probe.peak == 1
+        assert [r.success for r in runs] == [1, 1]
+
+    def test_independent_devices_run_in_parallel(self, tmp_path: Path):
+        """Test that items on different devices run at the same time."""
+        probe = ConcurrencyProbe()
+        scheduler = DeviceScheduler(
+            Scheduling(workers=4, device_limit=1), lambda p, throttle: CopyEngine()
+        )
+
+        def fake_device(path: Path) -> int:
+            # Each profile's files and destination live on their own device.
+            return 1 if "one" in path.name else 2
+
+        with (
+            patch("kachi.scheduler.backup_profile", probe),
+            patch("kachi.scheduler.device_of", fake_device),
+            patch("kachi.scheduler.is_rotational", return_value=None),
+        ):
+            runs = scheduler.run(_profiles(tmp_path))
+
+        assert probe.peak == 2
+        assert sorted(scheduler.devices) == [1, 2]
+        assert scheduler.devices[1].files == 2
+        assert scheduler.devices[1].bytes == 20
+        assert scheduler.devices[1].busy_seconds > 0
+        assert runs[0].stats.files == 2
+
+    def test_rotational_devices_use_their_own_limit(self, tmp_path: Path):
+        """Test that spinning disks get the rotational concurrency limit."""
+        scheduler = DeviceScheduler(
+            Scheduling(device_limit=4, rotational_limit=1),
+            lambda p, throttle: CopyEngine(),
+        )
+
+        with patch("kachi.scheduler.is_rotational", return_value=True):
+            scheduler.plan(_profiles(tmp_path))
+
+        assert {d.limit for d in scheduler.devices.values()} == {1}
+
+    def test_copies_files_and_reports_invalid_destination(self, tmp_path: Path):
+        """Test a real run, including a profile with no valid destination."""
+        profiles = _profiles(tmp_path)
+        profiles.append(
+            Profile(
+                name="broken",
+                sources=[tmp_path / "one-0.txt"],
+                backup_destination=tmp_path / "missing",
+            )
+        )
+        scheduler = DeviceScheduler(Scheduling(), lambda p, throttle: CopyEngine())
+
+        runs = scheduler.run(profiles)
+
+        assert (tmp_path / "dest-two" / "two-1.txt").read_text() == "two"
+        assert [r.aborted for r in runs] == [False, False, True]
+        assert runs[0].stats.files == 2
+        assert runs[0].seconds > 0
+
+    def test_sources_of_a_profile_share_its_throttle(self, tmp_path: Path):
+        """Test that a profile's limits apply to all of its sources together."""
+        throttles = []
+
+        def make_engine(profile, throttle):
+            throttles.append((profile.name, throttle))
+            return CopyEngine(throttles=[throttle])
+
+        scheduler = DeviceScheduler(Scheduling(workers=4), make_engine)
+
+        with patch("kachi.scheduler.backup_profile", ConcurrencyProbe()):
+            scheduler.run(_profiles(tmp_path))
+
+        by_profile = {}
+        for name, throttle in throttles:
+            by_profile.setdefault(name, set()).add(id(throttle))
+        assert len(throttles) == 4
+        assert all(len(ids) == 1 for ids in by_profile.values())
+        assert by_profile["one"] != by_profile["two"]
@@ -0,0 +1,53 @@
+"""Tests for the size and duration helpers."""
+
+import pytest
+
+from kachi.units import format_bytes, format_duration, parse_duration, parse_size
+
+
+class TestUnits:
+    """Tests for format_bytes, format_duration, parse_size and parse_duration."""
+
+    def test_format_bytes(self):
+        """Test that byte counts use binary multiples."""
+        assert format_bytes(512) == "512 B"
+        assert format_bytes(1536) == "1.5 KB"
+        assert format_bytes(10 * 1024**3) == "10.0 GB"
+
+    def test_format_duration(self):
+        """Test that durations are formatted by magnitude."""
+        assert format_duration(0.42) == "0.4s"
+        assert format_duration(125) == "2m 05s"
+        assert format_duration(7260) == "2h 01m"
+
+    @pytest.mark.parametrize(
+        ("value", "expected"),
+        [(100, 100), ("100", 100), ("512K", 524288), ("10MB", 10485760)],
+    )
+    def test_parse_size(self, value, expected):
+        """Test that sizes with and without units are parsed."""
+        assert parse_size(value) == expected
+
+    def test_parse_size_binary_suffix(self):
+        """Test that IEC suffixes are accepted."""
+        assert parse_size("1.5GiB") == int(1.5 * 1024**3)
+
+    @pytest.mark.parametrize("value", ["fast", "-1", -5, True])
+    def test_parse_size_invalid(self, value):
+        """Test that invalid sizes raise ValueError."""
+        with pytest.raises(ValueError):
+            parse_size(value)
+
+    @pytest.mark.parametrize(
+        ("value", "expected"),
+        [(90, 90.0), ("90s", 90.0), ("15m", 900.0), ("6h", 21600.0), ("1d", 86400.0)],
+    )
+    def test_parse_duration(self, value, expected):
+        """Test that durations with and without units are parsed."""
+        assert parse_duration(value) == expected
+
+    @pytest.mark.parametrize("value", ["often", "-1h", -5, True])
+    def test_parse_duration_invalid(self, value):
+        """Test that invalid durations raise ValueError."""
+        with pytest.raises(ValueError):
+            parse_duration(value)